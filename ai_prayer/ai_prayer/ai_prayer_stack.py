@@ -15,11 +15,14 @@ from aws_cdk import (
     aws_s3_deployment as s3_deployment,
     aws_certificatemanager as acm,
     aws_cloudfront as cloudfront,
+    aws_cloudfront_origins as origins,
     aws_route53 as route53,
     aws_route53_targets as route53_targets,
+    aws_secretsmanager as secretsmanager,
     RemovalPolicy,
     Duration,
     CfnOutput,
+    BundlingOptions,
 )
 from aws_cdk.aws_lambda_python_alpha import PythonFunction
 from aws_cdk.aws_lambda import Architecture
@@ -39,6 +42,41 @@ class AiPrayerStack(Stack):
             removal_policy=RemovalPolicy.DESTROY,
             billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
         )
+        # DynamoDB creates one GSI per table update, so each index has its own
+        # flag: turn them on one deploy at a time, in this order, and only
+        # then the settings that read them (see README).
+        for flag, dependent in (('verified_users_index', 'use_verified_users_index'),
+                                ('verification_state_index', 'use_verification_state_index'),
+                                ('delivery_shard_index', 'sharded_schedule')):
+            if app_config.get(dependent) and not app_config.get(flag):
+                raise ValueError(f"'{dependent}' needs '{flag}' deployed first")
+        # Sparse index: only verified users carry `verified_at`, so the daily
+        # jobs scan just the subscribers instead of filtering the whole table.
+        if app_config.get('verified_users_index'):
+            users_table.add_global_secondary_index(
+                index_name="VerifiedUsersIndex",
+                partition_key=dynamodb.Attribute(name="verified_at", type=dynamodb.AttributeType.STRING),
+                projection_type=dynamodb.ProjectionType.ALL
+            )
+        # Users by verification state and signup time, so the unverified-user
+        # report queries one key range instead of scanning everybody.
+        if app_config.get('verification_state_index'):
+            users_table.add_global_secondary_index(
+                index_name="VerificationStateIndex",
+                partition_key=dynamodb.Attribute(name="verification_state", type=dynamodb.AttributeType.STRING),
+                sort_key=dynamodb.Attribute(name="subscribed_at", type=dynamodb.AttributeType.STRING),
+                projection_type=dynamodb.ProjectionType.KEYS_ONLY
+            )
+        # Sparse index of verified users by the UTC hour of their local check-in,
+        # so each hourly run reads only its own shard.
+        if app_config.get('delivery_shard_index'):
+            users_table.add_global_secondary_index(
+                index_name="DeliveryShardIndex",
+                partition_key=dynamodb.Attribute(name="delivery_shard", type=dynamodb.AttributeType.NUMBER),
+                projection_type=dynamodb.ProjectionType.INCLUDE,
+                # tz lets a shard run recompute the shard after a DST change.
+                non_key_attributes=["verification_token", "tz"]
+            )
 
         # DynamoDB Table to store user's feelings
         feelings_table = dynamodb.Table(
@@ -49,11 +87,38 @@ class AiPrayerStack(Stack):
             billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
         )
 
+        # DynamoDB Table to store each user's incrementally maintained personality profile
+        profiles_table = dynamodb.Table(
+            self, "ProfilesTable",
+            partition_key=dynamodb.Attribute(name="email", type=dynamodb.AttributeType.STRING),
+            removal_policy=RemovalPolicy.DESTROY,
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+
+        # DynamoDB Table recording which pipeline stages each user's daily prayer
+        # has completed, so redelivered or re-dispatched messages don't run twice
+        ledger_table = dynamodb.Table(
+            self, "PrayerLedgerTable",
+            partition_key=dynamodb.Attribute(name="email", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="day", type=dynamodb.AttributeType.STRING),
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY,
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST
+        )
+
         # S3 Bucket for prayer audio files
         prayers_bucket = s3.Bucket(
             self, "PrayersBucket",
             removal_policy=RemovalPolicy.DESTROY,
-            auto_delete_objects=True
+            auto_delete_objects=True,
+            lifecycle_rules=[
+                # Intermediate prayer pipeline artifacts (text, raw voice track)
+                s3.LifecycleRule(prefix="artifacts/", expiration=Duration.days(7)),
+                # Manifests of ingested prayer batch jobs
+                s3.LifecycleRule(prefix="batch/done/", expiration=Duration.days(30)),
+                # Requests prepared for a batch job across several invocations
+                s3.LifecycleRule(prefix="batch/parts/", expiration=Duration.days(7))
+            ]
         )
 
         # S3 Bucket for the frontend website
@@ -94,13 +159,18 @@ class AiPrayerStack(Stack):
         )
         users_table.grant_read_write_data(lambda_role)
         feelings_table.grant_read_write_data(lambda_role)
+        profiles_table.grant_read_write_data(lambda_role)
+        ledger_table.grant_read_write_data(lambda_role)
         prayers_bucket.grant_read_write(lambda_role)
         lambda_role.add_to_policy(iam.PolicyStatement(
-            actions=["ses:SendEmail", "ses:SendRawEmail"],
+            actions=[
+                "ses:SendEmail", "ses:SendRawEmail", "ses:SendBulkTemplatedEmail", "ses:GetSendQuota",
+                "ses:GetTemplate", "ses:CreateTemplate", "ses:UpdateTemplate"
+            ],
             resources=["*"]
         ))
         lambda_role.add_to_policy(iam.PolicyStatement(
-            actions=["bedrock:InvokeModel"],
+            actions=["bedrock:InvokeModel", "bedrock:InvokeModelWithResponseStream"],
             resources=["*"]
         ))
 
@@ -118,48 +188,223 @@ class AiPrayerStack(Stack):
             )
         )
 
+        prayer_concurrency = app_config.get('prayer_concurrency', 4)
+        # Hourly, time-zone sharded check-ins and dispatch. Enable once the
+        # `backfill-user-index` action has given existing users a delivery_shard.
+        sharded_schedule = app_config.get('sharded_schedule', False)
+        # "batch" generates the day's prayer texts as one OpenAI batch job.
+        generation_mode = app_config.get('generation_mode', 'online')
+
         # Unified Lambda Function
+        prayer_timeout = Duration.minutes(3)
         unified_lambda = _lambda.DockerImageFunction(
             self, "PrayerLambda",
             code=_lambda.DockerImageCode.from_image_asset(
                 directory=os.path.join(os.path.dirname(__file__), "..", "lambda"),
                 platform=Platform.LINUX_AMD64
             ),
-            timeout=Duration.minutes(3),
+            timeout=prayer_timeout,
             memory_size=1024,
             role=lambda_role,
             architecture=Architecture.X86_64,
             environment={
                 "USERS_TABLE_NAME": users_table.table_name,
                 "FEELINGS_TABLE_NAME": feelings_table.table_name,
+                "PROFILES_TABLE_NAME": profiles_table.table_name,
+                "PRAYER_LEDGER_TABLE_NAME": ledger_table.table_name,
                 "PRAYERS_BUCKET_NAME": prayers_bucket.bucket_name,
                 "LOOKBACK_DAYS": "365",
                 "OPENAI_API_KEY": app_config['openai_api_key'],
                 "SEND_EMAIL": app_config['send_email'],
                 "ADMIN_EMAIL": app_config['admin_email'],
+                # Enable once the `backfill-user-index` action has been run after deploy.
+                "VERIFIED_USERS_INDEX": "VerifiedUsersIndex" if app_config.get('use_verified_users_index') else "",
+                "USER_SCAN_SEGMENTS": str(app_config.get('user_scan_segments', 4)),
+                "DISPATCH_WORKERS": str(app_config.get('dispatch_workers', 8)),
+                "GOSPEL_PREFETCH_DAYS": "7",
+                "PRAYER_CONCURRENCY": str(prayer_concurrency),
+                # "chunked" synthesizes and mixes the prayer in parallel parts; opt-in.
+                "TTS_MODE": app_config.get('tts_mode', 'single'),
+                "DELIVERY_SHARD_INDEX": "DeliveryShardIndex" if sharded_schedule else "",
+                "TTS_CHUNK_CHARS": str(app_config.get('tts_chunk_chars', 600)),
+                # mp3, mp3-vbr, opus or aac, see lambda/mixer.py
+                "AUDIO_PROFILE": app_config.get('audio_profile', 'mp3'),
+                "GENERATION_MODE": generation_mode,
+                "FUNCTION_TIMEOUT_SECONDS": str(int(prayer_timeout.to_seconds())),
             },
         )
+        # A check-in running out of time hands the rest to a new invocation.
+        # A separate policy, since the role's own would depend on the function.
+        iam.Policy(
+            self, "PrayerLambdaInvokeSelf",
+            roles=[lambda_role],
+            statements=[iam.PolicyStatement(
+                actions=["lambda:InvokeFunction"],
+                resources=[unified_lambda.function_arn]
+            )]
+        )
+
+        # Slim API Lambda: the HTTP routes are single DynamoDB/SES calls, so they
+        # run from a zip holding just their modules on the stock runtime (which
+        # provides boto3) instead of cold-starting the generation image.
+        api_code = _lambda.Code.from_asset(
+            os.path.join(os.path.dirname(__file__), "..", "lambda"),
+            exclude=["*", "!api.py", "!clients.py", "!metrics.py", "!journal_writer.py", "!users.py"],
+            # The runtime has no time zone database, which users.py needs for zoneinfo.
+            bundling=BundlingOptions(
+                image=_lambda.Runtime.PYTHON_3_12.bundling_image,
+                command=["bash", "-c", "pip install tzdata -t /asset-output && cp *.py /asset-output"]
+            )
+        )
+        api_lambda = _lambda.Function(
+            self, "ApiLambda",
+            runtime=_lambda.Runtime.PYTHON_3_12,
+            handler="api.handler",
+            code=api_code,
+            timeout=Duration.seconds(10),
+            memory_size=256,
+            architecture=Architecture.ARM_64,
+            environment={
+                "USERS_TABLE_NAME": users_table.table_name,
+                "FEELINGS_TABLE_NAME": feelings_table.table_name,
+                "SEND_EMAIL": app_config['send_email'],
+                "ADMIN_EMAIL": app_config['admin_email'],
+            },
+        )
+        users_table.grant_read_write_data(api_lambda)
+        feelings_table.grant_write_data(api_lambda)
+        api_lambda.add_to_role_policy(iam.PolicyStatement(
+            actions=["ses:SendEmail"],
+            resources=["*"]
+        ))
+
+        # Write-behind journal ingestion: /journal only enqueues, and a consumer
+        # with capped concurrency persists entries in batches, so the 21:00
+        # check-in burst neither slows the API nor throttles the feelings table.
+        if app_config.get('journal_write_behind', True):
+            journal_dlq = sqs.Queue(
+                self, "JournalDLQ",
+                retention_period=Duration.days(14),
+            )
+            journal_queue = sqs.Queue(
+                self, "JournalQueue",
+                visibility_timeout=Duration.minutes(1),
+                retention_period=Duration.days(4),
+                dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=5, queue=journal_dlq),
+            )
+            journal_writer_timeout = Duration.seconds(30)
+            journal_batching_window = Duration.seconds(5)
+            journal_writer_lambda = _lambda.Function(
+                self, "JournalWriterLambda",
+                runtime=_lambda.Runtime.PYTHON_3_12,
+                handler="journal_writer.handler",
+                code=api_code,
+                timeout=journal_writer_timeout,
+                memory_size=256,
+                architecture=Architecture.ARM_64,
+                environment={
+                    "FEELINGS_TABLE_NAME": feelings_table.table_name,
+                },
+            )
+            feelings_table.grant_write_data(journal_writer_lambda)
+            journal_writer_lambda.add_event_source(lambda_event_sources.SqsEventSource(
+                journal_queue,
+                batch_size=100,
+                max_batching_window=journal_batching_window,
+                max_concurrency=app_config.get('journal_writer_concurrency', 2),
+                report_batch_item_failures=True,
+            ))
+            journal_queue.grant_send_messages(api_lambda)
+            api_lambda.add_environment("JOURNAL_QUEUE_URL", journal_queue.queue_url)
+            # prayer_generation_dispatch drains the queue before reading journals.
+            journal_queue.grant_consume_messages(lambda_role)
+            unified_lambda.add_environment("JOURNAL_QUEUE_URL", journal_queue.queue_url)
+            # The drain only waits for entries queued before it, bounded to a
+            # quarter of the dispatch's time budget.
+            unified_lambda.add_environment("JOURNAL_DRAIN_TIMEOUT", str(prayer_timeout.to_seconds() // 4))
+            unified_lambda.add_environment(
+                "JOURNAL_WRITER_MAX_SECONDS",
+                str(journal_writer_timeout.to_seconds() + journal_batching_window.to_seconds())
+            )
 
         # API Gateway to Lambda Integration
-        lambda_integration = apigateway.LambdaIntegration(unified_lambda)
+        lambda_integration = apigateway.LambdaIntegration(api_lambda)
         api.root.add_resource("signup").add_method("POST", lambda_integration)
         api.root.add_resource("verify").add_method("GET", lambda_integration)
         api.root.add_resource("journal").add_method("POST", lambda_integration)
         api.root.add_resource("unsubscribe").add_method("GET", lambda_integration)
         api.root.add_resource("feedback").add_method("POST", lambda_integration)
 
-        # SQS for prayer requests
-        prayer_request_queue = sqs.Queue(
-            self, "PrayerRequestQueue",
-            visibility_timeout=Duration.minutes(5),
-            retention_period=Duration.days(4),
-        )
-        prayer_request_queue.grant_send_messages(unified_lambda)
-        prayer_request_queue.grant_consume_messages(lambda_role)
-        unified_lambda.add_event_source(lambda_event_sources.SqsEventSource(prayer_request_queue))
-        
-        # Update Lambda environment with SQS URL
-        unified_lambda.add_environment("PRAYER_REQUEST_QUEUE_URL", prayer_request_queue.queue_url)
+        # Prayer generation is a pipeline of stages connected by SQS queues, with
+        # intermediate artifacts in the prayers bucket. Each stage has its own
+        # batch size, concurrency cap and retry policy, e.g. TTS can follow the
+        # OpenAI rate limit while delivery fans out wide. The handler processes
+        # a batch PRAYER_CONCURRENCY records at a time and returns
+        # batchItemFailures, so only failed messages are redelivered.
+        pipeline_stages = [
+            # (id, queue url env var, batch size, max concurrency, max receives)
+            ("PrayerRequest", "PRAYER_REQUEST_QUEUE_URL", prayer_concurrency, 10, 3),
+            ("PrayerTts", "PRAYER_TTS_QUEUE_URL", 2, 5, 5),
+            ("PrayerMix", "PRAYER_MIX_QUEUE_URL", prayer_concurrency, 10, 3),
+            ("PrayerDelivery", "PRAYER_DELIVERY_QUEUE_URL", 10, 20, 3),
+        ]
+        for stage_id, env_name, batch_size, max_concurrency, max_receive_count in pipeline_stages:
+            stage_dlq = sqs.Queue(
+                self, f"{stage_id}DLQ",
+                retention_period=Duration.days(14),
+            )
+            stage_queue = sqs.Queue(
+                self, f"{stage_id}Queue",
+                visibility_timeout=Duration.minutes(5),
+                retention_period=Duration.days(4),
+                dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=max_receive_count, queue=stage_dlq),
+            )
+            stage_queue.grant_send_messages(unified_lambda)
+            stage_queue.grant_consume_messages(lambda_role)
+            unified_lambda.add_event_source(lambda_event_sources.SqsEventSource(
+                stage_queue,
+                batch_size=batch_size,
+                max_concurrency=max_concurrency,
+                max_batching_window=Duration.seconds(5),
+                report_batch_item_failures=True,
+            ))
+            unified_lambda.add_environment(env_name, stage_queue.queue_url)
+
+        # Prayer audio behind CloudFront: the bucket stays private (origin access
+        # control), links are CloudFront-signed against a key group, and plays
+        # are cached at the edge. Range requests pass through to S3 as usual.
+        # Needs an RSA key pair; without it the Lambda keeps using S3 presigned URLs.
+        # The private key stays out of the template: it lives in a Secrets Manager
+        # secret (name or ARN in prayer_cdn_private_key_secret) the Lambda reads.
+        if app_config.get('prayer_cdn_public_key') and app_config.get('prayer_cdn_private_key_secret'):
+            prayer_cdn_key = cloudfront.PublicKey(
+                self, "PrayerCdnPublicKey",
+                encoded_key=app_config['prayer_cdn_public_key']
+            )
+            prayer_cdn = cloudfront.Distribution(
+                self, "PrayerCdn",
+                default_behavior=cloudfront.BehaviorOptions(
+                    origin=origins.S3BucketOrigin.with_origin_access_control(prayers_bucket),
+                    viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
+                    allowed_methods=cloudfront.AllowedMethods.ALLOW_GET_HEAD,
+                    cache_policy=cloudfront.CachePolicy.CACHING_OPTIMIZED,
+                    trusted_key_groups=[cloudfront.KeyGroup(
+                        self, "PrayerCdnKeyGroup",
+                        items=[prayer_cdn_key]
+                    )]
+                ),
+                price_class=cloudfront.PriceClass.PRICE_CLASS_100
+            )
+            unified_lambda.add_environment("PRAYER_CDN_DOMAIN", prayer_cdn.distribution_domain_name)
+            unified_lambda.add_environment("PRAYER_CDN_KEY_PAIR_ID", prayer_cdn_key.public_key_id)
+            secret_id = app_config['prayer_cdn_private_key_secret']
+            if secret_id.startswith("arn:"):
+                prayer_cdn_secret = secretsmanager.Secret.from_secret_complete_arn(self, "PrayerCdnPrivateKey", secret_id)
+            else:
+                prayer_cdn_secret = secretsmanager.Secret.from_secret_name_v2(self, "PrayerCdnPrivateKey", secret_id)
+            prayer_cdn_secret.grant_read(unified_lambda)
+            unified_lambda.add_environment("PRAYER_CDN_PRIVATE_KEY_SECRET", secret_id)
+            CfnOutput(self, "PrayerCdnDomainName", value=prayer_cdn.distribution_domain_name)
 
         # --- Unverified User Reporter Lambda ---
         reporter_lambda = PythonFunction(
@@ -175,34 +420,66 @@ class AiPrayerStack(Stack):
                 "SEND_EMAIL": app_config['send_email']
             }
         )
+        # Only switch the report to the index once `backfill-user-index` has
+        # tagged the existing users with their verification_state.
+        if app_config.get('use_verification_state_index'):
+            reporter_lambda.add_environment("VERIFICATION_STATE_INDEX", "VerificationStateIndex")
         users_table.grant_read_data(reporter_lambda)
         reporter_lambda.add_to_role_policy(iam.PolicyStatement(
-            actions=["ses:SendEmail"],
+            actions=["ses:SendEmail", "ses:SendRawEmail"],
             resources=["*"]
         ))
 
         # EventBridge Rules
+        # Sharded runs fire every hour and pass the scheduled time, from which
+        # the handler picks the users whose local check-in/prayer hour it is.
+        shard_input = {"time": events.EventField.time} if sharded_schedule else {}
         check_in_rule = events.Rule(
             self, "CheckInRule",
-            schedule=events.Schedule.cron(minute="0", hour="21"),
+            schedule=events.Schedule.cron(minute="0", hour="*" if sharded_schedule else "21"),
             targets=[targets.LambdaFunction(
                 unified_lambda,
                 event=events.RuleTargetInput.from_object({
                     "action": "check-in",
                     "api_gateway_url": api.url,
-                    "web_bucket_url": web_bucket.bucket_website_url
+                    "web_bucket_url": web_bucket.bucket_website_url,
+                    **shard_input
                 })
             )]
         )
         
         prayer_dispatch_rule = events.Rule(
             self, "PrayerDispatchRule",
-            schedule=events.Schedule.cron(minute="0", hour="12"),
+            schedule=events.Schedule.cron(minute="0", hour="*" if sharded_schedule else "12"),
             targets=[targets.LambdaFunction(
                 unified_lambda,
                 event=events.RuleTargetInput.from_object({
                     "action": "prayer-generation-dispatch",
-                    "api_gateway_url": api.url
+                    "api_gateway_url": api.url,
+                    **shard_input
+                })
+            )]
+        )
+
+        if generation_mode == 'batch':
+            # Ingest finished batch jobs; they take minutes to hours to complete.
+            events.Rule(
+                self, "PrayerBatchPollRule",
+                schedule=events.Schedule.rate(Duration.minutes(15)),
+                targets=[targets.LambdaFunction(
+                    unified_lambda,
+                    event=events.RuleTargetInput.from_object({"action": "prayer-batch-poll"})
+                )]
+            )
+
+        # Warm the Gospel cache ahead of the daily prayer run
+        gospel_prefetch_rule = events.Rule(
+            self, "GospelPrefetchRule",
+            schedule=events.Schedule.cron(minute="0", hour="11"),
+            targets=[targets.LambdaFunction(
+                unified_lambda,
+                event=events.RuleTargetInput.from_object({
+                    "action": "gospel-prefetch"
                 })
             )]
         )
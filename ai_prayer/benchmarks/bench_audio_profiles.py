@@ -0,0 +1,135 @@
+"""Compare the prayer encoding profiles on encode time, size and quality.
+
+Each profile runs the real mix (voice over the looped background) through
+mixer.mix_with_background. The result is decoded again and compared with an
+uncompressed mix of the same input: SNR and a log-spectral distance on
+16 kHz mono, the band that carries speech. Lower LSD is closer to the
+source; the `mp3` profile is what prayers were exported as so far.
+
+    python benchmarks/bench_audio_profiles.py --voice lambda/web/prayer.mp3 --background lambda/bg.mp3
+
+Needs ffmpeg on PATH and numpy (requirements-dev.txt). Without
+--background a quiet synthetic pad stands in for bg.mp3.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+sys.path.insert(0, LAMBDA_DIR)
+
+import mixer  # noqa: E402
+
+ANALYSIS_RATE = 16000
+FRAME = 512
+
+
+def decode(data, rate=ANALYSIS_RATE):
+    """Decode encoded audio bytes to mono float samples at `rate`."""
+    pcm = subprocess.run(
+        [mixer.FFMPEG, "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+         "-f", "s16le", "-ar", str(rate), "-ac", "1", "pipe:1"],
+        input=data, capture_output=True, check=True
+    ).stdout
+    return np.frombuffer(pcm, dtype="<i2").astype(np.float64) / 32768
+
+
+def log_spectrum(samples):
+    frames = len(samples) // FRAME
+    windowed = samples[:frames * FRAME].reshape(frames, FRAME) * np.hanning(FRAME)
+    return 10 * np.log10(np.abs(np.fft.rfft(windowed, axis=1)) ** 2 + 1e-10)
+
+
+def compare(reference, candidate):
+    """SNR (dB) and log-spectral distance (dB) of `candidate` against `reference`.
+
+    Codecs add a few ms of priming delay, so the candidate is aligned to the
+    reference first by cross-correlating their first seconds.
+    """
+    head = ANALYSIS_RATE * 2
+    correlation = np.correlate(candidate[:head + 4096], reference[:head], mode="valid")
+    offset = int(np.argmax(correlation))
+    candidate = candidate[offset:]
+    n = min(len(reference), len(candidate))
+    reference, candidate = reference[:n], candidate[:n]
+    noise = np.sum((reference - candidate) ** 2)
+    snr = 10 * np.log10(np.sum(reference ** 2) / noise) if noise else float("inf")
+    # Floor both spectra 80 dB under the reference peak and skip near-silent
+    # frames, so inaudible noise-floor differences don't dominate the distance.
+    ref_spec, cand_spec = log_spectrum(reference), log_spectrum(candidate)
+    floor = ref_spec.max() - 80
+    ref_spec, cand_spec = np.maximum(ref_spec, floor), np.maximum(cand_spec, floor)
+    audible = ref_spec.max(axis=1) > floor + 30
+    lsd = np.mean(np.sqrt(np.mean((ref_spec[audible] - cand_spec[audible]) ** 2, axis=1)))
+    return snr, lsd
+
+
+def synthetic_background(path, seconds=30):
+    subprocess.run(
+        [mixer.FFMPEG, "-hide_banner", "-loglevel", "error", "-y",
+         "-f", "lavfi", "-i", f"sine=frequency=220:duration={seconds}",
+         "-f", "lavfi", "-i", f"sine=frequency=330:duration={seconds}",
+         "-filter_complex", "amix=inputs=2,volume=0.1", "-ac", "2", path],
+        check=True
+    )
+
+
+def run_profile(voice, output_format, output_args):
+    start = time.perf_counter()
+    cpu = time.process_time()
+    children = os.times()
+    data = b"".join(mixer.mix_with_background([voice], output_format=output_format, output_args=output_args))
+    after = os.times()
+    return data, {
+        "seconds": time.perf_counter() - start,
+        # ffmpeg does the encoding in a child process.
+        "cpu_seconds": (time.process_time() - cpu) + (after.children_user - children.children_user)
+        + (after.children_system - children.children_system),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--voice", default=os.path.join(LAMBDA_DIR, "web", "prayer.mp3"))
+    parser.add_argument("--background", help="background music, defaults to a synthetic pad")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--profiles", default=",".join(mixer.AUDIO_PROFILES))
+    args = parser.parse_args()
+
+    with open(args.voice, "rb") as f:
+        voice = f.read()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.background:
+            mixer.BG_PATH = args.background
+        else:
+            mixer.BG_PATH = os.path.join(workdir, "bg.mp3")
+            synthetic_background(mixer.BG_PATH)
+        # Decoded once up front, as it is once per container in production.
+        mixer.background_pcm()
+
+        reference_wav, _ = run_profile(voice, "wav", mixer.DEFAULT_OUTPUT_ARGS)
+        reference = decode(reference_wav)
+        duration = len(reference) / ANALYSIS_RATE
+
+        print(f"voice {os.path.basename(args.voice)}: {duration:.1f}s, reference is the uncompressed mix")
+        print(f"{'profile':<9} {'size KiB':>9} {'kbps':>6} {'encode s':>9} {'cpu s':>7} {'SNR dB':>7} {'LSD dB':>7}")
+        for name in args.profiles.split(","):
+            profile = mixer.AUDIO_PROFILES[name]
+            timings = []
+            for _ in range(args.runs):
+                data, timing = run_profile(voice, profile["format"], profile["args"])
+                timings.append(timing)
+            best = min(timings, key=lambda timing: timing["seconds"])
+            snr, lsd = compare(reference, decode(data))
+            print(f"{name:<9} {len(data) / 1024:9.1f} {len(data) * 8 / duration / 1000:6.1f} "
+                  f"{best['seconds']:9.2f} {best['cpu_seconds']:7.2f} {snr:7.1f} {lsd:7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Measure the import and init cost of each Lambda entry module on a cold start.
+
+Every sample runs in a fresh interpreter, like a new Lambda container: it
+reports how long `import <module>` takes as a whole (init duration, which
+includes module-level client and table setup) and which of its imports
+dominate, from `python -X importtime`. No AWS calls are made:
+
+    python benchmarks/bench_cold_start.py --runs 5
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+
+# handler module -> what it serves
+FUNCTIONS = {
+    "api": "ApiLambda (HTTP routes)",
+    "main": "PrayerLambda (generation image)",
+}
+ENV = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "AWS_EC2_METADATA_DISABLED": "true",
+    "USERS_TABLE_NAME": "users",
+    "FEELINGS_TABLE_NAME": "feelings",
+    "PROFILES_TABLE_NAME": "profiles",
+    "PRAYERS_BUCKET_NAME": "prayers",
+    "SEND_EMAIL": "sender@example.com",
+    "ADMIN_EMAIL": "admin@example.com",
+    "OPENAI_API_KEY": "testing",
+}
+PROBE = """
+import sys, time, json, resource
+start = time.perf_counter()
+import {module}
+init = time.perf_counter() - start
+print(json.dumps({{"init_ms": init * 1000, "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "modules": len(sys.modules)}}))
+"""
+
+
+def sample(module):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(module=module)],
+        cwd=LAMBDA_DIR, env=dict(os.environ, **ENV), capture_output=True, text=True, check=True
+    )
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+    # importtime lines: "import time: self [us] | cumulative | imported package",
+    # nested imports indented. Keep the cumulative cost of every package
+    # (names without a dot) except the probed module itself.
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        if "." not in name and name != module:
+            packages[name] = int(cumulative)
+    stats["imports"] = packages
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=6, help="heaviest imports to list per function")
+    args = parser.parse_args()
+
+    for module, description in FUNCTIONS.items():
+        samples = [sample(module) for _ in range(args.runs)]
+        init = [s["init_ms"] for s in samples]
+        print(f"{module}.handler  {description}")
+        print(f"  init     median {statistics.median(init):8.1f}ms  min {min(init):8.1f}ms  max {max(init):8.1f}ms")
+        print(f"  modules  {samples[-1]['modules']}  peak RSS {samples[-1]['rss_mb']:.1f} MiB")
+        imports = {}
+        for s in samples:
+            for name, us in s["imports"].items():
+                imports.setdefault(name, []).append(us)
+        heaviest = sorted(imports.items(), key=lambda item: -statistics.median(item[1]))[:args.top]
+        for name, us in heaviest:
+            print(f"  import   {name:<24} {statistics.median(us) / 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
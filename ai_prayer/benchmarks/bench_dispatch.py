@@ -0,0 +1,84 @@
+"""Compare serial send_message dispatch against batched, concurrent fan-out.
+
+Runs against an in-process stand-in for SQS with a fixed per-call latency
+and an optional transient failure rate, so it needs no AWS account:
+
+    python benchmarks/bench_dispatch.py --users 5000 --latency-ms 20
+"""
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda"))
+
+from sqs_batch import send_batched  # noqa: E402
+
+
+class FakeSQS:
+    def __init__(self, latency, failure_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.received = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def send_message(self, QueueUrl, MessageBody):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            self.received += 1
+        return {'MessageId': str(self.received)}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        assert len(Entries) <= 10
+        time.sleep(self.latency)
+        failed = [
+            {'Id': e['Id'], 'SenderFault': False, 'Code': 'InternalError', 'Message': 'transient'}
+            for e in Entries if random.random() < self.failure_rate
+        ]
+        with self._lock:
+            self.calls += 1
+            self.received += len(Entries) - len(failed)
+        return {'Successful': [], 'Failed': failed}
+
+
+def bodies(n):
+    for i in range(n):
+        yield json.dumps({"recipient_email": f"user{i}@example.com", "token": "t", "api_gateway_url": "https://x"})
+
+
+def run_serial(sqs, n):
+    start = time.perf_counter()
+    for body in bodies(n):
+        sqs.send_message(QueueUrl="q", MessageBody=body)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--failure-rate", type=float, default=0.01)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    latency = args.latency_ms / 1000
+
+    serial_sqs = FakeSQS(latency)
+    serial_seconds = run_serial(serial_sqs, args.users)
+
+    batched_sqs = FakeSQS(latency, args.failure_rate)
+    metrics = send_batched(batched_sqs, "q", bodies(args.users), max_workers=args.workers)
+
+    print(f"users={args.users} latency={args.latency_ms}ms failure_rate={args.failure_rate}")
+    print(f"serial : {args.users / serial_seconds:10.1f} users/s  ({serial_seconds:.2f}s, {serial_sqs.calls} calls)")
+    print(f"batched: {metrics['per_second']:10.1f} users/s  ({metrics['seconds']:.2f}s, {batched_sqs.calls} calls, "
+          f"{metrics['retries']} retried, {metrics['failed']} failed)")
+    assert batched_sqs.received == metrics['sent']
+
+
+if __name__ == "__main__":
+    main()
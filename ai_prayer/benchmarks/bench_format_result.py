@@ -0,0 +1,127 @@
+"""Micro-benchmark format_result: the old regexes against the single-pass extractor.
+
+Model answers are rebuilt from the saved youtube/datas outputs the way
+DeepSeek R1 returns them: reasoning, a little prose, then a fenced block.
+Summaries become ```markdown answers; transcript sentences become the
+proofreading JSON (finding/correction/rationale), clean, followed by prose
+with stray braces, cut off at max_tokens, and without a fence. For every
+shape it reports the time per call and how many answers parsed, i.e. how
+many would not have cost another model call:
+
+    python benchmarks/bench_format_result.py --repeat 20
+"""
+import os
+import re
+import sys
+import json
+import glob
+import time
+import argparse
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+DATAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "youtube", "datas")
+sys.path.insert(0, LAMBDA_DIR)
+
+from extract import extract_json, extract_markdown  # noqa: E402
+
+
+def old_format_result(content, type='json'):
+    """format_result as it was before the extractor."""
+    if type == 'json':
+        pattern = r'(?P<quote>["\'`]{3})json\s*(?P<json>(\{.*?\}|\[.*?\]))\s*(?P=quote)'
+        matches = list(re.finditer(pattern, content, re.DOTALL))
+        if matches:
+            return json.loads(matches[-1].group("json"))
+        return json.loads(content)
+    elif type == 'markdown':
+        match = re.search(r'(?P<quote>["\'`]{3})markdown\s+(.*?)(?P=quote)', content, re.DOTALL)
+        return match.group(2) if match else content
+
+
+def new_format_result(content, type='json'):
+    return extract_json(content) if type == 'json' else extract_markdown(content)
+
+
+def think(text):
+    return f"<think>\nThe user wants {text[:400]}... Let me check the requirement again.\n</think>\n\n"
+
+
+def answers(datas_dir, items):
+    """(shape, type, content, expected, prefix) for every saved video. With
+    `prefix` a non-empty leading part of `expected` also counts as parsed."""
+    for path in sorted(glob.glob(os.path.join(datas_dir, "*_summarize.txt"))):
+        with open(path) as f:
+            summary = f.read()
+        with open(path.replace("_summarize.txt", "_transcript.txt")) as f:
+            sentences = [s.strip() for s in re.split(r"(?<=[.?!])\s+", f.read()) if len(s.strip()) > 20]
+        yield "markdown", "markdown", f"{think(summary)}Here is the summary:\n```markdown\n{summary}\n```\n", summary + "\n", False
+
+        findings = [{
+            "finding": sentence,
+            "correction": sentence.replace(" the ", " a "),
+            "rationale": f"Article usage in \"{sentence[:30]}\" {{see style guide}}",
+        } for sentence in sentences[:items]]
+        block = json.dumps(findings, indent=2, ensure_ascii=False)
+        yield "json", "json", f"{think(block)}```json\n{block}\n```", findings, False
+        yield "json + prose", "json", (f"{think(block)}```json\n{block}\n```\n\nNotes: items use the {{finding}} "
+                                       f"shape; see [1] for details."), findings, False
+        cut = block[:int(len(block) * 0.8)]
+        yield "json truncated", "json", f"{think(block)}```json\n{cut}", findings, True
+        yield "json unfenced", "json", f"Sure, here are the findings:\n{block}\nLet me know if you need more.", findings, False
+
+
+def parsed(result, expected, prefix):
+    if prefix and isinstance(result, list) and result:
+        return result == expected[:len(result)]
+    return result == expected
+
+
+def measure(fn, shape_type, content, repeat):
+    best = float("inf")
+    result = error = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            result = fn(content, type=shape_type)
+        except ValueError as e:
+            error = e
+        best = min(best, time.perf_counter() - start)
+    return best, result, error
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--datas", default=DATAS_DIR)
+    parser.add_argument("--items", type=int, default=60, help="findings per JSON answer")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    shapes = {}
+    for shape, shape_type, content, expected, prefix in answers(args.datas, args.items):
+        stats = shapes.setdefault(shape, {"n": 0, "bytes": 0, "old_s": 0.0, "new_s": 0.0, "old_ok": 0, "new_ok": 0})
+        stats["n"] += 1
+        stats["bytes"] += len(content)
+        for name, fn in (("old", old_format_result), ("new", new_format_result)):
+            seconds, result, error = measure(fn, shape_type, content, args.repeat)
+            stats[f"{name}_s"] += seconds
+            if error is None and parsed(result, expected, prefix):
+                stats[f"{name}_ok"] += 1
+
+    print(f"{'shape':<16} {'answers':>7} {'avg KiB':>8} {'old us':>9} {'new us':>9} {'old ok':>7} {'new ok':>7}")
+    for shape, stats in shapes.items():
+        n = stats["n"]
+        print(f"{shape:<16} {n:7d} {stats['bytes'] / n / 1024:8.1f} {stats['old_s'] / n * 1e6:9.1f} "
+              f"{stats['new_s'] / n * 1e6:9.1f} {stats['old_ok']:7d} {stats['new_ok']:7d}")
+
+    # An answer with several unclosed fences: each one makes the old lazy
+    # regex scan to the end of the text again.
+    print()
+    for size in (1, 4, 16):
+        content = ("```json\n{\"finding\": \"x\"}, partial " + "word " * 200 + "\n") * (20 * size)
+        old, _, _ = measure(old_format_result, "json", content, 3)
+        new, _, _ = measure(new_format_result, "json", content, 3)
+        print(f"unclosed fences x{20 * size:<4} {len(content) / 1024:7.1f} KiB  old {old * 1e3:8.2f}ms  new {new * 1e3:8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""Drive the daily prayer jobs end to end against local stand-ins.
+
+DynamoDB, SQS, S3 and SES are served in-process by moto; OpenAI and the
+USCCB Gospel page by small local HTTP servers with configurable latency.
+N synthetic users with journals are seeded, then `main.handler` runs the
+check-in, dispatch and processing steps the way the scheduled rules and
+the SQS event source would. Nothing leaves the machine:
+
+    python benchmarks/load_test.py --users 1000 --openai-latency-ms 800
+
+Requires moto (requirements-dev.txt), plus ffmpeg on PATH when the pipeline
+runs through the mix stage. Absolute numbers include moto's own overhead;
+compare runs against each other rather than against production.
+"""
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import struct
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+sys.path.insert(0, LAMBDA_DIR)
+
+STAGES = ("text", "tts", "mix", "deliver")
+QUEUE_ENV = {
+    "tts": "PRAYER_TTS_QUEUE_URL",
+    "mix": "PRAYER_MIX_QUEUE_URL",
+    "deliver": "PRAYER_DELIVERY_QUEUE_URL",
+}
+API_GATEWAY_URL = "https://api.example.com/prod"
+WEB_BUCKET_URL = "https://web.example.com"
+PRAYER_TEXT = (
+    "Let's first look at God's word: " + " ".join(["Peace I leave with you; my peace I give to you."] * 8)
+    + "\n\nNow, Let's pray together. " + " ".join(["Lord, thank you for your word today."] * 9) + " Amen."
+)
+GOSPEL_HTML = """<html><body>
+<div class="b-verse"><h3 class="name">Gospel</h3><div class="content-body">
+Jesus said to his disciples: "Peace I leave with you; my peace I give to you."
+</div></div></body></html>"""
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(pct / 100 * len(ordered))) - 1)]
+
+
+def sine_pcm(seconds, rate=24000):
+    return b"".join(struct.pack("<h", int(6000 * math.sin(2 * math.pi * 220 * i / rate)))
+                    for i in range(int(seconds * rate)))
+
+
+def encode_mp3(pcm, rate=24000):
+    """Encode mono s16le PCM to MP3 with ffmpeg, for the fake TTS and the background track."""
+    return subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "s16le", "-ar", str(rate), "-ac", "1",
+         "-i", "pipe:0", "-f", "mp3", "pipe:1"],
+        input=pcm, capture_output=True, check=True
+    ).stdout
+
+
+class FakeServer:
+    """Serve the OpenAI endpoints the pipeline calls and the USCCB reading page."""
+
+    def __init__(self, openai_latency, tts_latency, gospel_latency, speech_mp3, speech_pcm):
+        self.calls = {}
+        lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, body, content_type):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with lock:
+                    server.calls["gospel"] = server.calls.get("gospel", 0) + 1
+                time.sleep(gospel_latency)
+                self.reply(GOSPEL_HTML.encode(), "text/html")
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                name = self.path.rsplit("/", 1)[-1]
+                with lock:
+                    server.calls[name] = server.calls.get(name, 0) + 1
+                if self.path.endswith("/audio/speech"):
+                    time.sleep(tts_latency)
+                    if request.get("response_format") == "pcm":
+                        self.reply(speech_pcm, "audio/pcm")
+                    else:
+                        self.reply(speech_mp3, "audio/mpeg")
+                    return
+                time.sleep(openai_latency)
+                text = PRAYER_TEXT if "prayer" in request.get("input", "") else '{"hopeful": "Looks forward"}'
+                self.reply(json.dumps({
+                    "id": "resp_load_test", "object": "response", "created_at": int(time.time()),
+                    "model": request.get("model"), "status": "completed",
+                    "parallel_tool_calls": True, "tool_choice": "auto", "tools": [],
+                    "output": [{
+                        "type": "message", "id": "msg_load_test", "status": "completed", "role": "assistant",
+                        "content": [{"type": "output_text", "text": text, "annotations": []}],
+                    }],
+                }).encode(), "application/json")
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+def configure_environment(args, server):
+    os.environ.update({
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_EC2_METADATA_DISABLED": "true",
+        "USERS_TABLE_NAME": "load-users",
+        "FEELINGS_TABLE_NAME": "load-feelings",
+        "PROFILES_TABLE_NAME": "load-profiles",
+        "PRAYER_LEDGER_TABLE_NAME": "load-ledger",
+        "PRAYERS_BUCKET_NAME": "load-prayers",
+        "LOOKBACK_DAYS": "365",
+        "SEND_EMAIL": "sender@example.com",
+        "ADMIN_EMAIL": "admin@example.com",
+        "OPENAI_API_KEY": "load-test",
+        "OPENAI_BASE_URL": f"{server.url}/v1",
+        "GOSPEL_SOURCE_URL": f"{server.url}/daily-bible-reading",
+        "VERIFIED_USERS_INDEX": "VerifiedUsersIndex",
+        "USER_SCAN_SEGMENTS": str(args.scan_segments),
+        "PRAYER_CONCURRENCY": str(args.concurrency),
+        "TTS_MODE": args.tts_mode,
+    })
+
+
+def create_resources(args):
+    import boto3
+
+    dynamodb = boto3.client("dynamodb")
+
+    def table(name, keys, indexes=()):
+        attributes = {key for key, _ in keys} | {key for _, index_keys in indexes for key, _ in index_keys}
+        dynamodb.create_table(
+            TableName=name,
+            KeySchema=[{"AttributeName": key, "KeyType": kind} for key, kind in keys],
+            AttributeDefinitions=[{"AttributeName": key, "AttributeType": "S"} for key in sorted(attributes)],
+            BillingMode="PAY_PER_REQUEST",
+            **({"GlobalSecondaryIndexes": [{
+                "IndexName": index_name,
+                "KeySchema": [{"AttributeName": key, "KeyType": kind} for key, kind in index_keys],
+                "Projection": {"ProjectionType": "ALL"},
+            } for index_name, index_keys in indexes]} if indexes else {})
+        )
+
+    table("load-users", [("email", "HASH")], [
+        ("VerifiedUsersIndex", [("verified_at", "HASH")]),
+        ("VerificationStateIndex", [("verification_state", "HASH"), ("subscribed_at", "RANGE")]),
+    ])
+    table("load-feelings", [("email", "HASH"), ("timestamp", "RANGE")])
+    table("load-profiles", [("email", "HASH")])
+    table("load-ledger", [("email", "HASH"), ("day", "RANGE")])
+    boto3.client("s3").create_bucket(Bucket="load-prayers")
+    boto3.client("ses").verify_email_identity(EmailAddress="sender@example.com")
+
+    sqs = boto3.client("sqs")
+    os.environ["PRAYER_REQUEST_QUEUE_URL"] = sqs.create_queue(QueueName="load-prayer-request")["QueueUrl"]
+    # Stages after --until are handed to a queue nobody reads, which stops the
+    # pipeline there; the ones before it run inline like without stage queues.
+    for stage in STAGES[STAGES.index(args.until) + 1:]:
+        os.environ[QUEUE_ENV[stage]] = sqs.create_queue(QueueName=f"load-prayer-{stage}")["QueueUrl"]
+
+
+def seed(args):
+    import boto3
+
+    dynamodb = boto3.resource("dynamodb")
+    now = datetime.utcnow()
+    start = time.perf_counter()
+    with dynamodb.Table("load-users").batch_writer() as users, \
+            dynamodb.Table("load-feelings").batch_writer() as feelings:
+        for i in range(args.users):
+            email = f"user{i}@example.com"
+            subscribed_at = (now - timedelta(days=30)).isoformat()
+            users.put_item(Item={
+                "email": email,
+                "verified": True,
+                "verification_state": "verified",
+                "verification_token": f"token{i}",
+                "subscribed_at": subscribed_at,
+                "verified_at": subscribed_at,
+            })
+            for j in range(args.journal_entries):
+                feelings.put_item(Item={
+                    "email": email,
+                    "timestamp": (now - timedelta(hours=j * 20 + 1)).isoformat(),
+                    "feeling": f"Day {j}: grateful for my family, a little anxious about work.",
+                })
+    return time.perf_counter() - start
+
+
+def report(name, count, seconds, latencies=None):
+    line = f"{name:<9} {count:>7} in {seconds:8.2f}s  {count / seconds if seconds else 0:9.1f}/s"
+    if latencies:
+        line += (f"  p50 {percentile(latencies, 50) * 1000:8.1f}ms"
+                 f"  p99 {percentile(latencies, 99) * 1000:8.1f}ms")
+    print(f"{line}  peak RSS {peak_rss_mb():7.1f} MiB")
+
+
+def run_process(main, args):
+    """Feed the request queue to main.handler in SQS event batches, timing every record."""
+    import boto3
+
+    latencies = []
+    lock = threading.Lock()
+    process_prayer_record = main.process_prayer_record
+
+    def timed(record):
+        start = time.perf_counter()
+        try:
+            return process_prayer_record(record)
+        finally:
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    main.process_prayer_record = timed
+    sqs = boto3.client("sqs")
+    queue_url = os.environ["PRAYER_REQUEST_QUEUE_URL"]
+    processed = failed = 0
+    start = time.perf_counter()
+    try:
+        while True:
+            messages = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=args.batch_size).get("Messages", [])
+            if not messages:
+                break
+            result = main.handler({"Records": [{
+                "messageId": message["MessageId"],
+                "receiptHandle": message["ReceiptHandle"],
+                "body": message["Body"],
+                "eventSource": "aws:sqs",
+            } for message in messages]}, None)
+            failures = {failure["itemIdentifier"] for failure in result["batchItemFailures"]}
+            failed += len(failures)
+            processed += len(messages)
+            done = [message for message in messages if message["MessageId"] not in failures]
+            for i in range(0, len(done), 10):
+                sqs.delete_message_batch(QueueUrl=queue_url, Entries=[
+                    {"Id": str(n), "ReceiptHandle": message["ReceiptHandle"]}
+                    for n, message in enumerate(done[i:i + 10])
+                ])
+    finally:
+        main.process_prayer_record = process_prayer_record
+    return processed, failed, time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--journal-entries", type=int, default=5, help="journal entries seeded per user")
+    parser.add_argument("--openai-latency-ms", type=float, default=200.0)
+    parser.add_argument("--tts-latency-ms", type=float, default=500.0)
+    parser.add_argument("--gospel-latency-ms", type=float, default=300.0)
+    parser.add_argument("--speech-seconds", type=float, default=5.0, help="length of the fake TTS audio")
+    parser.add_argument("--tts-mode", choices=("single", "chunked"), default="chunked")
+    parser.add_argument("--until", choices=STAGES, default="deliver", help="last pipeline stage to run")
+    parser.add_argument("--batch-size", type=int, default=10, help="SQS event source batch size")
+    parser.add_argument("--concurrency", type=int, default=4, help="PRAYER_CONCURRENCY")
+    parser.add_argument("--scan-segments", type=int, default=4, help="USER_SCAN_SEGMENTS")
+    parser.add_argument("--ses-rate", type=float, default=1000.0,
+                        help="SES sends/s for the check-in governor (moto reports a quota of 1/s)")
+    parser.add_argument("--steps", default="check-in,dispatch,process")
+    args = parser.parse_args()
+    steps = args.steps.split(",")
+
+    mixing = args.until in ("mix", "deliver") and "process" in steps
+    if mixing and not shutil.which("ffmpeg"):
+        parser.error("ffmpeg is required to run the mix stage; pass --until tts to stop before it")
+    speech_pcm = sine_pcm(args.speech_seconds)
+    speech_mp3 = encode_mp3(speech_pcm) if shutil.which("ffmpeg") else b"\xff\xfb" * 1024
+
+    server = FakeServer(args.openai_latency_ms / 1000, args.tts_latency_ms / 1000,
+                        args.gospel_latency_ms / 1000, speech_mp3, speech_pcm)
+    configure_environment(args, server)
+
+    from moto import mock_aws
+
+    with mock_aws(), tempfile.TemporaryDirectory() as workdir:
+        create_resources(args)
+        seconds = seed(args)
+        report("seed", args.users, seconds)
+
+        import mailer
+        import mixer
+        import main as prayer
+        if mixing:
+            mixer.BG_PATH = os.path.join(workdir, "bg.mp3")
+            with open(mixer.BG_PATH, "wb") as bg:
+                bg.write(encode_mp3(sine_pcm(3, rate=44100), rate=44100))
+        mailer.send_rate_governor = lambda ses_client: mailer.TokenBucket(args.ses_rate)
+
+        if "check-in" in steps:
+            start = time.perf_counter()
+            prayer.handler({"action": "check-in", "web_bucket_url": WEB_BUCKET_URL,
+                            "api_gateway_url": API_GATEWAY_URL}, None)
+            report("check-in", args.users, time.perf_counter() - start)
+
+        if "dispatch" in steps:
+            start = time.perf_counter()
+            prayer.handler({"action": "prayer-generation-dispatch", "api_gateway_url": API_GATEWAY_URL}, None)
+            report("dispatch", args.users, time.perf_counter() - start)
+
+        if "process" in steps:
+            processed, failed, seconds, latencies = run_process(prayer, args)
+            report("process", processed, seconds, latencies)
+            if failed:
+                print(f"{failed} records failed")
+
+    print(f"fake upstream calls: {json.dumps(server.calls, sort_keys=True)}")
+    server.close()
+
+
+if __name__ == "__main__":
+    main()
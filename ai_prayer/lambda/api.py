@@ -0,0 +1,240 @@
+import os
+import json
+import logging
+import secrets
+import urllib.parse
+from datetime import datetime
+from clients import get_client, get_dynamodb
+from metrics import log_event
+from journal_writer import JOURNAL_QUEUE_URL, enqueue
+from users import delivery_shard, valid_time_zone
+
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+dynamodb_client = get_dynamodb()
+ses_client = get_client("ses")
+
+USERS_TABLE = dynamodb_client.Table(os.environ["USERS_TABLE_NAME"])
+FEELINGS_TABLE = dynamodb_client.Table(os.environ["FEELINGS_TABLE_NAME"])
+SEND_EMAIL = os.environ["SEND_EMAIL"]
+ADMIN_EMAIL = os.environ["ADMIN_EMAIL"]
+JOURNAL_MAX_CHARS = int(os.environ.get("JOURNAL_MAX_CHARS", "10000"))
+
+
+def signup(event):
+    body = json.loads(event['body'])
+    email = body['email']
+    
+    verification_token = secrets.token_urlsafe(16)
+    
+    user = {
+        'email': email,
+        'verified': False,
+        'verification_state': 'unverified',
+        'verification_token': verification_token,
+        'subscribed_at': datetime.utcnow().isoformat()
+    }
+    # Browser time zone, used to send check-ins and prayers at local times.
+    tz = valid_time_zone(body.get('tz'))
+    if tz:
+        user['tz'] = tz
+    USERS_TABLE.put_item(Item=user)
+    
+    api_gateway_url = f"https://{event['requestContext']['domainName']}/{event['requestContext']['stage']}"
+    verification_link = f"{api_gateway_url}/verify?email={urllib.parse.quote(email)}&token={verification_token}"
+    unsubscribe_link = f"{api_gateway_url}/unsubscribe?email={urllib.parse.quote(email)}&token={verification_token}"
+    
+    ses_client.send_email(
+        Source=SEND_EMAIL,
+        Destination={'ToAddresses': [email]},
+        Message={
+            'Subject': {'Data': "Verify your email for AI Prayer Companion"},
+            'Body': {
+                'Html': {
+                    'Data': f"""
+                        <p>Thank you for signing up! Please click the link below to verify your email address:</p>
+                        <a href="{verification_link}">Verify Email</a>
+                        <hr>
+                        <p style="font-size: 0.8em; color: #666;">To unsubscribe, <a href="{unsubscribe_link}">click here</a>.</p>
+                        <p style="font-size: 0.8em; color: #666; text-align: center;">
+                            Visit our main page at <a href="https://prayer.graceful.cloud">prayer.graceful.cloud</a>
+                        </p>
+                    """
+                }
+            }
+        }
+    )
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST, OPTIONS',
+            'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'
+        },
+        'body': json.dumps({'message': 'Verification email sent.'})
+    }
+
+
+def verify(event):
+    email = event['queryStringParameters']['email']
+    token = event['queryStringParameters']['token']
+    
+    response = USERS_TABLE.get_item(Key={'email': email})
+    user = response.get('Item')
+    
+    if user and user.get('verification_token') == token:
+        USERS_TABLE.update_item(
+            Key={'email': email},
+            UpdateExpression="set verified = :v, verified_at = :t, verification_state = :s, delivery_shard = :d",
+            ExpressionAttributeValues={
+                ':v': True,
+                ':t': datetime.utcnow().isoformat(),
+                ':s': 'verified',
+                ':d': delivery_shard(user.get('tz'))
+            }
+        )
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'text/html'},
+            'body': "<h1>Email verified successfully!</h1><p>You will now receive daily prayer check-ins.</p>"
+        }
+    
+    return {
+        'statusCode': 400,
+        'headers': {'Content-Type': 'text/html'},
+        'body': "<h1>Invalid verification link.</h1>"
+    }
+
+
+def unsubscribe(event):
+    email = event['queryStringParameters']['email']
+    token = event['queryStringParameters']['token']
+
+    response = USERS_TABLE.get_item(Key={'email': email})
+    user = response.get('Item')
+
+    if user and user.get('verification_token') == token:
+        USERS_TABLE.update_item(
+            Key={'email': email},
+            UpdateExpression="set verified = :v, unsubscribed_at = :u, verification_state = :s remove verified_at, delivery_shard",
+            ExpressionAttributeValues={
+                ':v': False,
+                ':u': datetime.utcnow().isoformat(),
+                ':s': 'unsubscribed'
+            }
+        )
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'text/html'},
+            'body': "<h1>You have been unsubscribed successfully.</h1>"
+        }
+
+    return {
+        'statusCode': 400,
+        'headers': {'Content-Type': 'text/html'},
+        'body': "<h1>Invalid unsubscribe link.</h1>"
+    }
+
+
+def journal(event):
+    body = json.loads(event['body'])
+    email = body.get('email')
+    feeling = body.get('feeling')
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'
+    }
+    if not isinstance(email, str) or not email.strip() or not isinstance(feeling, str) or not feeling.strip():
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'message': 'email and feeling are required.'})}
+    if len(feeling) > JOURNAL_MAX_CHARS:
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'message': 'Journal entry is too long.'})}
+
+    entry = {
+        'email': email,
+        'timestamp': datetime.utcnow().isoformat(),
+        'feeling': feeling
+    }
+    # Write-behind: the check-in burst lands on the queue and is persisted in
+    # batches by journal_writer, keeping DynamoDB writes out of the request.
+    if JOURNAL_QUEUE_URL:
+        enqueue(entry)
+    else:
+        FEELINGS_TABLE.put_item(Item=entry)
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps({'message': 'Journal entry saved.'})
+    }
+
+
+def handle_feedback(event):
+    body = json.loads(event['body'])
+    feedback_text = body.get('feedback')
+    user_email = body.get('email', 'Anonymous')
+
+    subject = "New Feedback Received for AI Prayer Companion"
+    body_html = f"""
+    <h3>New Feedback Received</h3>
+    <p><strong>From:</strong> {user_email}</p>
+    <p><strong>Message:</strong></p>
+    <p>{feedback_text}</p>
+    """
+
+    ses_client.send_email(
+        Source=SEND_EMAIL,
+        Destination={'ToAddresses': [ADMIN_EMAIL]},
+        Message={
+            'Subject': {'Data': subject},
+            'Body': {'Html': {'Data': body_html}}
+        }
+    )
+
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'POST, OPTIONS',
+            'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'
+        },
+        'body': json.dumps({'message': 'Feedback sent successfully.'})
+    }
+
+
+def handler(event, context):
+    log_event(event)
+    return route(event)
+
+
+def route(event):
+    if 'httpMethod' in event:
+        path = event['path']
+        method = event['httpMethod']
+        
+        if path == '/signup' and method == 'POST':
+            return signup(event)
+        elif path == '/verify' and method == 'GET':
+            return verify(event)
+        elif path == '/unsubscribe' and method == 'GET':
+            return unsubscribe(event)
+        elif path == '/journal' and method == 'POST':
+            return journal(event)
+        elif path == '/feedback' and method == 'POST':
+            return handle_feedback(event)
+        elif method == 'OPTIONS':
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Methods': 'POST, GET, OPTIONS',
+                    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'
+                },
+                'body': ''
+            }
+
+    LOGGER.error(f"Unknown event: {event}")
+    return {"statusCode": 400, "body": "Invalid action or event source."}
@@ -0,0 +1,210 @@
+import os
+import json
+import uuid
+import logging
+from datetime import datetime
+from botocore.exceptions import ClientError
+from clients import get_client, get_openai
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# "openai" submits to the OpenAI Batch API; "local" reads and writes job
+# files under BATCH_LOCAL_DIR, for tests and load runs.
+BATCH_PROVIDER = os.environ.get("BATCH_PROVIDER", "openai")
+BATCH_LOCAL_DIR = os.environ.get("BATCH_LOCAL_DIR", "/tmp/prayer-batches")
+BATCH_ENDPOINT = "/v1/responses"
+# Manifests of submitted jobs, one per day and shard: what each request is
+# for, until it is ingested.
+PENDING_PREFIX = "batch/pending/"
+DONE_PREFIX = "batch/done/"
+# What each invocation of a dispatch prepared, until the last one submits.
+PARTS_PREFIX = "batch/parts/"
+
+
+def request_line(custom_id, model, prompt):
+    return json.dumps({
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {"model": model, "input": prompt},
+    })
+
+
+def _output_text(line):
+    """(custom_id, text) of one output line; text is None for a failed request."""
+    result = json.loads(line)
+    response = result.get("response") or {}
+    if result.get("error") or response.get("status_code") != 200:
+        LOGGER.warning(f"Batch request {result.get('custom_id')} failed: {result.get('error') or response.get('status_code')}")
+        return result.get("custom_id"), None
+    for item in response["body"].get("output", []):
+        if item.get("type") == "message":
+            return result["custom_id"], item["content"][0]["text"]
+    return result["custom_id"], None
+
+
+class OpenAIBatchProvider:
+    """Jobs run by the OpenAI Batch API within its 24 hour window."""
+
+    def submit(self, name, lines):
+        client = get_openai()
+        input_file = client.files.create(file=(f"{name}.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch")
+        job = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h",
+            metadata={"name": name},
+        )
+        return job.id
+
+    def status(self, job_id):
+        """One of running, completed or failed."""
+        job = get_openai().batches.retrieve(job_id)
+        if job.status == "completed":
+            return "completed"
+        if job.status in ("failed", "expired", "cancelled"):
+            LOGGER.warning(f"Batch {job_id} ended as {job.status}: {job.errors}")
+            return "failed"
+        return "running"
+
+    def results(self, job_id):
+        """Yield (custom_id, text) for every request of a completed job."""
+        client = get_openai()
+        job = client.batches.retrieve(job_id)
+        # Requests that failed land in the error file rather than the output file.
+        for file_id in (job.output_file_id, job.error_file_id):
+            if file_id:
+                for line in client.files.content(file_id).text.splitlines():
+                    if line.strip():
+                        yield _output_text(line)
+
+
+class LocalBatchProvider:
+    """Stand-in for a batch endpoint that works on files in `directory`.
+
+    A job is `<job_id>.input.jsonl` and completes once `<job_id>.output.jsonl`
+    (same line format as the OpenAI Batch API) appears next to it. With
+    `respond`, a callable from a request body to its text, the output is
+    written right away on submit.
+    """
+
+    def __init__(self, directory=BATCH_LOCAL_DIR, respond=None):
+        self.directory = directory
+        self.respond = respond
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id, kind):
+        return os.path.join(self.directory, f"{job_id}.{kind}.jsonl")
+
+    def submit(self, name, lines):
+        job_id = f"{name}-{uuid.uuid4().hex[:8]}"
+        with open(self._path(job_id, "input"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+        if self.respond:
+            with open(self._path(job_id, "output"), "w") as f:
+                for line in lines:
+                    request = json.loads(line)
+                    f.write(json.dumps({
+                        "custom_id": request["custom_id"],
+                        "response": {"status_code": 200, "body": {"output": [
+                            {"type": "message", "content": [{"type": "output_text", "text": self.respond(request["body"])}]}
+                        ]}},
+                        "error": None,
+                    }) + "\n")
+        return job_id
+
+    def status(self, job_id):
+        return "completed" if os.path.exists(self._path(job_id, "output")) else "running"
+
+    def results(self, job_id):
+        with open(self._path(job_id, "output")) as f:
+            for line in f:
+                if line.strip():
+                    yield _output_text(line)
+
+
+_provider = None
+
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        _provider = LocalBatchProvider() if BATCH_PROVIDER == "local" else OpenAIBatchProvider()
+    return _provider
+
+
+def _manifest_key(prefix, name):
+    return f"{prefix}{name}.json"
+
+
+def manifest_exists(bucket, name):
+    """Whether a job called `name` was dispatched, pending or finished."""
+    s3_client = get_client("s3")
+    return any(
+        s3_client.list_objects_v2(Bucket=bucket, Prefix=_manifest_key(prefix, name), MaxKeys=1).get("KeyCount")
+        for prefix in (PENDING_PREFIX, DONE_PREFIX)
+    )
+
+
+def claim_manifest(bucket, manifest):
+    """Write the manifest of a job that is about to be submitted, unless one
+    with the same name exists. Returns whether this caller got to write it."""
+    try:
+        get_client("s3").put_object(
+            Bucket=bucket,
+            Key=_manifest_key(PENDING_PREFIX, manifest["name"]),
+            Body=json.dumps(manifest).encode("utf-8"),
+            ContentType="application/json",
+            IfNoneMatch="*",
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict"):
+            return False
+        raise
+    return True
+
+
+def save_part(bucket, name, part):
+    """Store the requests one invocation prepared for job `name`."""
+    get_client("s3").put_object(
+        Bucket=bucket,
+        Key=f"{PARTS_PREFIX}{name}/{uuid.uuid4().hex}.json",
+        Body=json.dumps(part).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def load_parts(bucket, name):
+    s3_client = get_client("s3")
+    for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=f"{PARTS_PREFIX}{name}/"):
+        for obj in page.get("Contents", []):
+            yield json.loads(s3_client.get_object(Bucket=bucket, Key=obj["Key"])["Body"].read())
+
+
+def save_manifest(bucket, manifest):
+    get_client("s3").put_object(
+        Bucket=bucket,
+        Key=_manifest_key(PENDING_PREFIX, manifest["name"]),
+        Body=json.dumps(manifest).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def pending_manifests(bucket):
+    s3_client = get_client("s3")
+    for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=PENDING_PREFIX):
+        for obj in page.get("Contents", []):
+            yield json.loads(s3_client.get_object(Bucket=bucket, Key=obj["Key"])["Body"].read())
+
+
+def finish_manifest(bucket, manifest, status):
+    """Move an ingested (or given up) job out of the pending prefix."""
+    s3_client = get_client("s3")
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=_manifest_key(DONE_PREFIX, manifest["name"]),
+        Body=json.dumps(dict(manifest, status=status, finished_at=datetime.utcnow().isoformat())).encode("utf-8"),
+        ContentType="application/json",
+    )
+    s3_client.delete_object(Bucket=bucket, Key=_manifest_key(PENDING_PREFIX, manifest["name"]))
@@ -0,0 +1,60 @@
+import os
+import logging
+import urllib.parse
+from datetime import datetime, timedelta
+from clients import get_client
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# CloudFront distribution in front of the prayers bucket. Without it (or its
+# signing key) links fall back to S3 presigned URLs. The PEM private key is
+# read from Secrets Manager on first use, never from the environment.
+PRAYER_CDN_DOMAIN = os.environ.get("PRAYER_CDN_DOMAIN", "")
+PRAYER_CDN_KEY_PAIR_ID = os.environ.get("PRAYER_CDN_KEY_PAIR_ID", "")
+PRAYER_CDN_PRIVATE_KEY_SECRET = os.environ.get("PRAYER_CDN_PRIVATE_KEY_SECRET", "")
+# Prayer objects are written once under a timestamped key, so the edge and
+# the browser can keep them for as long as the link is valid.
+PRAYER_CACHE_CONTROL = "public, max-age=604800, immutable"
+
+_signer = None
+
+
+def _cloudfront_signer():
+    global _signer
+    if _signer is None:
+        from botocore.signers import CloudFrontSigner
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        secret = get_client("secretsmanager").get_secret_value(SecretId=PRAYER_CDN_PRIVATE_KEY_SECRET)
+        private_key = serialization.load_pem_private_key(secret["SecretString"].encode(), password=None)
+
+        def rsa_signer(message):
+            # CloudFront only accepts SHA1 RSA signatures for signed URLs.
+            return private_key.sign(message, padding.PKCS1v15(), hashes.SHA1())
+
+        _signer = CloudFrontSigner(PRAYER_CDN_KEY_PAIR_ID, rsa_signer)
+    return _signer
+
+
+def cdn_enabled():
+    return bool(PRAYER_CDN_DOMAIN and PRAYER_CDN_KEY_PAIR_ID and PRAYER_CDN_PRIVATE_KEY_SECRET)
+
+
+def audio_url(bucket, key, expires_in):
+    """A time-limited link to a prayer: CloudFront-signed when the CDN is
+    configured, otherwise an S3 presigned URL."""
+    if cdn_enabled():
+        try:
+            url = f"https://{PRAYER_CDN_DOMAIN}/{urllib.parse.quote(key)}"
+            return _cloudfront_signer().generate_presigned_url(
+                url, date_less_than=datetime.utcnow() + timedelta(seconds=expires_in)
+            )
+        except Exception:
+            LOGGER.exception(f"Signing a CloudFront URL for {key} failed, falling back to S3")
+    return get_client("s3").generate_presigned_url(
+        "get_object",
+        Params={"Bucket": bucket, "Key": key},
+        ExpiresIn=expires_in,
+    )
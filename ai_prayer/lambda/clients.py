@@ -0,0 +1,134 @@
+import os
+import boto3
+import logging
+import threading
+import weakref
+from botocore.config import Config
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+CLIENT_POOL_SIZE = int(os.environ.get("CLIENT_POOL_SIZE", "50"))
+
+# Shared by every boto3 client: a connection pool large enough for the worker
+# threads, TCP keep-alive so idle connections survive between invocations of a
+# warm container, and adaptive retries instead of failing a record on throttling.
+BOTO_CONFIG = Config(
+    max_pool_connections=CLIENT_POOL_SIZE,
+    tcp_keepalive=True,
+    retries={'max_attempts': 5, 'mode': 'adaptive'},
+)
+
+_lock = threading.Lock()
+_clients = {}
+_stats = {}
+# Connections the OpenAI client has used, gone once httpx closes them.
+_openai_streams = weakref.WeakSet()
+
+
+def _count(key, n=1):
+    with _lock:
+        _stats[key] = _stats.get(key, 0) + n
+
+
+def _counting_new_conn(new_conn):
+    def wrapper(self):
+        _count('http_new_connections')
+        return new_conn(self)
+    return wrapper
+
+
+# Every socket a urllib3 pool opens goes through _new_conn; botocore and
+# requests both pool through urllib3.
+for _pool_class in (HTTPConnectionPool, HTTPSConnectionPool):
+    _pool_class._new_conn = _counting_new_conn(_pool_class._new_conn)
+
+
+def _on_http_response(*args, **kwargs):
+    _count('http_requests')
+
+
+def _get(name, factory):
+    client = _clients.get(name)
+    if client is not None:
+        _count('clients_reused')
+        return client
+    # Client creation resolves credentials and loads service models; it is not
+    # thread safe on the default session and is exactly what we want to do once.
+    with _lock:
+        client = _clients.get(name)
+        if client is None:
+            client = _clients[name] = factory()
+            _stats['clients_created'] = _stats.get('clients_created', 0) + 1
+            return client
+    _count('clients_reused')
+    return client
+
+
+def get_client(service_name):
+    def create():
+        client = boto3.client(service_name, config=BOTO_CONFIG)
+        client.meta.events.register('response-received', _on_http_response)
+        return client
+    return _get(f"client:{service_name}", create)
+
+
+def get_dynamodb():
+    def create():
+        resource = boto3.resource("dynamodb", config=BOTO_CONFIG)
+        resource.meta.client.meta.events.register('response-received', _on_http_response)
+        return resource
+    return _get("resource:dynamodb", create)
+
+
+def get_http_session():
+    """Shared requests session for plain HTTPS calls (e.g. the Gospel source)."""
+    def create():
+        import requests
+        session = requests.Session()
+        session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=CLIENT_POOL_SIZE))
+        session.hooks['response'].append(_on_http_response)
+        return session
+    return _get("http", create)
+
+
+def _on_openai_response(response):
+    _count('openai_requests')
+    stream = response.extensions.get("network_stream")
+    if stream is None:
+        return
+    with _lock:
+        if stream in _openai_streams:
+            return
+        _openai_streams.add(stream)
+    _count('openai_new_connections')
+
+
+def get_openai():
+    def create():
+        import openai
+        return openai.OpenAI(
+            api_key=os.environ["OPENAI_API_KEY"],
+            http_client=openai.DefaultHttpxClient(event_hooks={"response": [_on_openai_response]}),
+        )
+    return _get("openai", create)
+
+
+def connection_stats(reset=True):
+    """Return client/connection reuse counters since the last reset.
+
+    `http_*` covers boto3 and requests, which both pool through urllib3.
+    `*_reused_connections` is requests minus sockets opened, i.e. how many
+    requests rode on an already established keep-alive connection.
+    """
+    with _lock:
+        stats = dict(_stats)
+        if reset:
+            _stats.clear()
+    for prefix in ('http', 'openai'):
+        requests = stats.get(f'{prefix}_requests', 0)
+        new = stats.get(f'{prefix}_new_connections', 0)
+        stats[f'{prefix}_new_connections'] = new
+        stats[f'{prefix}_reused_connections'] = max(requests - new, 0)
+    return stats
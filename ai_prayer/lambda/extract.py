@@ -0,0 +1,144 @@
+import re
+import json
+
+FENCES = ('```', "'''", '"""')
+# Everything the scan stops at; the text in between is skipped in C.
+JSON_TOKEN = re.compile(r'```|\'\'\'|"""|[{\[]')
+FENCE_LANGUAGE = re.compile(r'\S*')
+MARKDOWN_FENCE = re.compile(r'(```|\'\'\'|""")(?:markdown|md)\s+')
+DECODER = json.JSONDecoder()
+
+
+def _array_prefix(content, i):
+    """Decode the elements of the array opening at content[i] one by one.
+    Returns the complete ones and where decoding stopped."""
+    items = []
+    pos = i + 1
+    while True:
+        while pos < len(content) and content[pos].isspace():
+            pos += 1
+        try:
+            value, pos = DECODER.raw_decode(content, pos)
+        except ValueError:
+            return items, pos
+        if pos == len(content) and content[pos - 1] not in '"]}':
+            # A number or literal running into the end may itself be cut off.
+            return items, pos
+        items.append(value)
+        while pos < len(content) and content[pos].isspace():
+            pos += 1
+        if not content.startswith(',', pos):
+            return items, pos
+        pos += 1
+
+
+def _drop_reasoning(content):
+    """`content` without its <think> spans: drafts in there are not the answer.
+    A span left open by a cut-off answer runs to the end, and a closing tag
+    with no opening one (some providers drop it) ends reasoning that started
+    the text."""
+    parts = []
+    pos = 0
+    start = content.find('<think>')
+    close = content.find('</think>')
+    if close != -1 and (start == -1 or close < start):
+        pos = close + len('</think>')
+    while True:
+        start = content.find('<think>', pos)
+        if start == -1:
+            parts.append(content[pos:])
+            break
+        parts.append(content[pos:start])
+        close = content.find('</think>', start)
+        if close == -1:
+            break
+        pos = close + len('</think>')
+    return ''.join(parts)
+
+
+def extract_json(content):
+    """Return the JSON value a model answered with, scanning `content` once.
+
+    <think> spans are dropped first. Values inside ```json fences win, and
+    among those the last one that parses wins; when a json fence holds nothing
+    that parses, that is an error rather than a cue to read the prose. Without
+    a json fence the largest value in the text wins, so the answer beats
+    citations like [1] around it. Each candidate is decoded from where it
+    starts and the scan resumes where decoding ended or failed, so the work
+    stays linear in the answer's length. An array that was cut off (the answer
+    hit max_tokens) yields the elements finished so far.
+    Raises json.JSONDecodeError when there is no value at all.
+    """
+    content = _drop_reasoning(content)
+    fenced, partial_fenced, bare = [], [], []
+    json_fence = False
+    fence = None  # (delimiter, language) while inside a fence
+    pos = 0
+    while True:
+        match = JSON_TOKEN.search(content, pos)
+        if not match:
+            break
+        token, i = match.group(), match.start()
+        if token in FENCES:
+            if fence is None:
+                language = FENCE_LANGUAGE.match(content, i + 3)
+                fence = (token, language.group().lower())
+                json_fence = json_fence or fence[1] == 'json'
+                pos = language.end()
+            else:
+                if token == fence[0]:
+                    fence = None
+                pos = i + 3
+            continue
+        in_json_fence = fence is not None and fence[1] == 'json'
+        try:
+            value, pos = DECODER.raw_decode(content, i)
+        except ValueError as e:
+            pos = max(e.pos, i + 1)
+            if token == '[':
+                items, stopped = _array_prefix(content, i)
+                if items:
+                    if in_json_fence:
+                        partial_fenced.append(items)
+                    else:
+                        bare.append((stopped - i, items))
+                    pos = max(stopped, i + 1)
+            continue
+        if in_json_fence:
+            fenced.append(value)
+        else:
+            bare.append((pos - i, value))
+
+    # A cut-off array in a json fence still beats a complete value from the prose.
+    for values in (fenced, partial_fenced):
+        if values:
+            return values[-1]
+    if bare and not json_fence:
+        # max() keeps the first of equal sizes; reversed, that is the last one.
+        return max(reversed(bare), key=lambda candidate: candidate[0])[1]
+    raise json.JSONDecodeError('No JSON value found', content, 0)
+
+
+def extract_markdown(content):
+    """Return the body of the first ```markdown fence, or `content` when
+    there is none. Code fences nested in the markdown are kept, and a fence
+    left open by a truncated answer runs to the end."""
+    match = MARKDOWN_FENCE.search(content)
+    if not match:
+        return content
+    delimiter = match.group(1)
+    body = []
+    nested = False
+    for line in content[match.end():].splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped.startswith(delimiter):
+            if stripped == delimiter and not nested:
+                break
+            # ```lang opens a nested code block and a bare ``` closes it.
+            nested = stripped != delimiter
+        elif delimiter in line and not nested:
+            # Closing fence at the end of a text line.
+            body.append(line[:line.index(delimiter)])
+            break
+        body.append(line)
+    return ''.join(body)
@@ -0,0 +1,50 @@
+import os
+import logging
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+FEELINGS_MAX_ENTRIES = int(os.environ.get("FEELINGS_MAX_ENTRIES", "60"))
+FEELINGS_TOKEN_BUDGET = int(os.environ.get("FEELINGS_TOKEN_BUDGET", "6000"))
+FEELINGS_PAGE_SIZE = 25
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for English prose; good enough for budgeting.
+    return len(text) // 4 + 1
+
+
+def recent_feelings(table, email, since, max_entries=None, token_budget=None):
+    """Return the user's journal entries after `since` as (timestamp, feeling), newest first.
+
+    Only `timestamp` and `feeling` are read, page by page from the newest
+    entry backwards, and reading stops as soon as `max_entries` or
+    `token_budget` is reached. The latest entry is always returned, even if
+    it alone exceeds the budget.
+    """
+    max_entries = max_entries or FEELINGS_MAX_ENTRIES
+    token_budget = token_budget or FEELINGS_TOKEN_BUDGET
+    kwargs = dict(
+        KeyConditionExpression="email = :email AND #ts > :since",
+        ProjectionExpression="#ts, feeling",
+        ExpressionAttributeNames={"#ts": "timestamp"},
+        ExpressionAttributeValues={":email": email, ":since": since},
+        ScanIndexForward=False,
+        Limit=min(max_entries, FEELINGS_PAGE_SIZE),
+    )
+    entries = []
+    tokens = 0
+    while True:
+        response = table.query(**kwargs)
+        for item in response.get("Items", []):
+            cost = estimate_tokens(item["feeling"])
+            if entries and tokens + cost > token_budget:
+                return entries
+            entries.append((item["timestamp"], item["feeling"]))
+            tokens += cost
+            if len(entries) >= max_entries:
+                return entries
+        if "LastEvaluatedKey" not in response:
+            return entries
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        kwargs["Limit"] = min(max_entries - len(entries), FEELINGS_PAGE_SIZE)
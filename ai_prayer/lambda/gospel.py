@@ -0,0 +1,164 @@
+import os
+import time
+import logging
+import threading
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from clients import get_client, get_http_session
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+GOSPEL_SOURCE_URL = os.environ.get("GOSPEL_SOURCE_URL", "https://bible.usccb.org/daily-bible-reading")
+GOSPEL_CACHE_BUCKET = os.environ.get("GOSPEL_CACHE_BUCKET") or os.environ.get("PRAYERS_BUCKET_NAME", "")
+GOSPEL_CACHE_PREFIX = "cache/gospel/"
+GOSPEL_PREFETCH_DAYS = int(os.environ.get("GOSPEL_PREFETCH_DAYS", "7"))
+GOSPEL_FETCH_TIMEOUT = float(os.environ.get("GOSPEL_FETCH_TIMEOUT", "10"))
+# After a failed upstream fetch, don't retry from this container for a while so
+# a slow USCCB site can't add its timeout to every prayer in the batch.
+GOSPEL_NEGATIVE_TTL = 300
+
+# date iso string -> gospel text, or (failed_at,) for a recent upstream failure
+_MEMORY_CACHE = {}
+# One lock per day, so concurrent misses for it make one S3 read and fetch.
+_DAY_LOCKS = {}
+_DAY_LOCKS_LOCK = threading.Lock()
+
+
+def fetch_gospel(day):
+    """Download and parse the Gospel reading for `day` from USCCB."""
+    url = f"{GOSPEL_SOURCE_URL}?date={day.isoformat()}"
+    response = get_http_session().get(url, timeout=GOSPEL_FETCH_TIMEOUT)
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch data: {response.status_code}")
+
+    from bs4 import BeautifulSoup  # only needed on a cache miss
+
+    soup = BeautifulSoup(response.text, 'html.parser')
+
+    # Find all the reading blocks
+    readings = soup.find_all('div', class_='b-verse')
+
+    for reading in readings:
+        # Find the title of the reading
+        title_tag = reading.find('h3', class_='name')
+
+        if title_tag and 'Gospel' in title_tag.text:
+            gospel_title = title_tag.text.strip()
+
+            # Find the content of the reading
+            content_body = reading.find('div', class_='content-body')
+            if content_body:
+                gospel_text = content_body.get_text(separator="\n").strip()
+                return f"{gospel_title}\n\n{gospel_text}"
+
+    return ""
+
+
+def _cache_key(day):
+    return f"{GOSPEL_CACHE_PREFIX}{day.isoformat()}.txt"
+
+
+def _read_persisted(day):
+    if not GOSPEL_CACHE_BUCKET:
+        return None
+    s3_client = get_client("s3")
+    try:
+        response = s3_client.get_object(Bucket=GOSPEL_CACHE_BUCKET, Key=_cache_key(day))
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    return response['Body'].read().decode('utf-8')
+
+
+def _write_persisted(day, text):
+    """Store the text in S3; a failure only costs the next container a fetch.
+    Returns whether it was stored."""
+    if not GOSPEL_CACHE_BUCKET:
+        return False
+    try:
+        get_client("s3").put_object(
+            Bucket=GOSPEL_CACHE_BUCKET,
+            Key=_cache_key(day),
+            Body=text.encode('utf-8'),
+            ContentType="text/plain; charset=utf-8"
+        )
+    except Exception as e:
+        LOGGER.warning(f"Gospel cache write failed for {day}: {e}")
+        return False
+    return True
+
+
+def _day_lock(key):
+    with _DAY_LOCKS_LOCK:
+        return _DAY_LOCKS.setdefault(key, threading.Lock())
+
+
+def _cached(key):
+    """The memory-cached text for `key`, "" during a recent failure, else None."""
+    cached = _MEMORY_CACHE.get(key)
+    if isinstance(cached, str):
+        return cached
+    if cached and time.time() - cached[0] < GOSPEL_NEGATIVE_TTL:
+        return ""
+    return None
+
+
+def get_gospel(day=None):
+    """Return the Gospel for `day` (default today) from the memory or S3 cache.
+
+    Falls back to the network only on a cache miss, and returns an empty
+    string rather than raising when the upstream is unavailable.
+    """
+    day = day or date.today()
+    key = day.isoformat()
+    cached = _cached(key)
+    if cached is not None:
+        return cached
+    with _day_lock(key):
+        # Whoever held the lock may have filled the cache meanwhile.
+        cached = _cached(key)
+        if cached is not None:
+            return cached
+
+        try:
+            text = _read_persisted(day)
+        except Exception as e:
+            LOGGER.warning(f"Gospel cache read failed for {day}: {e}")
+            text = None
+        if text is not None:
+            _MEMORY_CACHE[key] = text
+            return text
+
+        LOGGER.warning(f"Gospel cache miss for {day}, fetching from upstream")
+        try:
+            text = fetch_gospel(day)
+        except Exception as e:
+            LOGGER.error(f"Gospel fetch failed for {day}: {e}")
+            _MEMORY_CACHE[key] = (time.time(),)
+            return ""
+        if text:
+            _write_persisted(day, text)
+        _MEMORY_CACHE[key] = text
+        return text
+
+
+def prefetch_gospels(days=None, start=None):
+    """Fetch and persist the Gospel for the next `days` days, starting at `start`."""
+    days = days or GOSPEL_PREFETCH_DAYS
+    start = start or date.today()
+
+    def prefetch(day):
+        try:
+            text = fetch_gospel(day)
+        except Exception as e:
+            LOGGER.error(f"Gospel prefetch failed for {day}: {e}")
+            return day.isoformat(), "failed"
+        if not text:
+            return day.isoformat(), "empty"
+        _MEMORY_CACHE[day.isoformat()] = text
+        return day.isoformat(), "cached" if _write_persisted(day, text) else "not persisted"
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = dict(executor.map(prefetch, [start + timedelta(days=i) for i in range(days)]))
+    LOGGER.info(f"Gospel prefetch results: {results}")
+    return results
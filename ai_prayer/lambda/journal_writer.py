@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import logging
+from clients import get_client, get_dynamodb
+from metrics import emit
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# Queue the API puts journal entries on; without it `journal` writes directly.
+JOURNAL_QUEUE_URL = os.environ.get("JOURNAL_QUEUE_URL", "")
+# Upper bound on a drain; keep it well below the timeout of the function draining.
+JOURNAL_DRAIN_TIMEOUT = float(os.environ.get("JOURNAL_DRAIN_TIMEOUT", "45"))
+# Longest the consumer holds a batch it received: its batching window plus its
+# timeout. A batch taken before a drain started is written by then.
+JOURNAL_WRITER_MAX_SECONDS = float(os.environ.get("JOURNAL_WRITER_MAX_SECONDS", "35"))
+RECEIVE_MAX_MESSAGES = 10
+
+FEELINGS_TABLE = get_dynamodb().Table(os.environ["FEELINGS_TABLE_NAME"])
+
+
+def enqueue(entry):
+    """Hand a validated journal entry to the write-behind queue."""
+    get_client("sqs").send_message(QueueUrl=JOURNAL_QUEUE_URL, MessageBody=json.dumps(entry))
+
+
+def _entry(body, message_id):
+    """The journal entry in a message body, or None for a malformed one."""
+    try:
+        entry = json.loads(body)
+        return {key: entry[key] for key in ('email', 'timestamp', 'feeling')}
+    except (ValueError, TypeError, KeyError):
+        LOGGER.exception(f"Malformed journal message {message_id}")
+        return None
+
+
+def persist(entries):
+    """Write journal entries in batches.
+
+    The timestamp is set by the API when the entry is accepted, so a
+    redelivered message overwrites the same item instead of duplicating it.
+    """
+    start = time.perf_counter()
+    # batch_writer sends 25 items per BatchWriteItem and resubmits unprocessed ones.
+    with FEELINGS_TABLE.batch_writer(overwrite_by_pkeys=['email', 'timestamp']) as batch:
+        for entry in entries:
+            batch.put_item(Item={
+                'email': entry['email'],
+                'timestamp': entry['timestamp'],
+                'feeling': entry['feeling']
+            })
+    return time.perf_counter() - start
+
+
+def handler(event, context):
+    """Persist a batch of queued journal entries and report how far behind we are."""
+    records = event['Records']
+    now_ms = time.time() * 1000
+    parsed = [(record, _entry(record['body'], record['messageId'])) for record in records]
+    entries = [entry for _, entry in parsed if entry is not None]
+    # Only the malformed messages go back, and on to the DLQ after enough receives.
+    malformed = [{"itemIdentifier": record['messageId']} for record, entry in parsed if entry is None]
+    oldest = min(int(record['attributes']['SentTimestamp']) for record in records)
+    try:
+        seconds = persist(entries)
+    except Exception:
+        LOGGER.exception(f"Failed to persist {len(entries)} journal entries")
+        return {"batchItemFailures": [{"itemIdentifier": record['messageId']} for record in records]}
+
+    emit("journal-write-behind", {
+        "entries": len(entries),
+        "write_ms": round(seconds * 1000, 1),
+        # Time the oldest entry of the batch spent queued: the backpressure signal.
+        "queue_lag_ms": round(now_ms - oldest, 1),
+        "max_receive_count": max(int(record['attributes'].get('ApproximateReceiveCount', 1)) for record in records),
+        "malformed": len(malformed),
+    })
+    return {"batchItemFailures": malformed}
+
+
+def _in_flight(sqs_client):
+    attributes = sqs_client.get_queue_attributes(
+        QueueUrl=JOURNAL_QUEUE_URL,
+        AttributeNames=['ApproximateNumberOfMessagesNotVisible']
+    )['Attributes']
+    return int(attributes['ApproximateNumberOfMessagesNotVisible'])
+
+
+def drain(timeout=None):
+    """Persist the entries queued before the call, so readers see them.
+
+    Pulls and writes visible messages itself instead of waiting for the
+    consumer, until a receive finds none sent before the call; then gives the
+    batches the consumer had taken by then the time to be written. Entries
+    queued after the call are not waited for: with hourly check-ins the queue
+    never empties. Returns True when done, False if `timeout` ran out first.
+    """
+    if not JOURNAL_QUEUE_URL:
+        return True
+    sqs_client = get_client("sqs")
+    cutoff_ms = time.time() * 1000
+    deadline = time.monotonic() + (timeout if timeout is not None else JOURNAL_DRAIN_TIMEOUT)
+    drained = 0
+    start = time.perf_counter()
+    while True:
+        if time.monotonic() >= deadline:
+            LOGGER.warning(f"Journal queue not drained after {drained} entries, dispatching anyway")
+            return False
+        messages = sqs_client.receive_message(
+            QueueUrl=JOURNAL_QUEUE_URL, MaxNumberOfMessages=RECEIVE_MAX_MESSAGES, WaitTimeSeconds=1,
+            AttributeNames=['SentTimestamp']
+        ).get('Messages', [])
+        parsed = [(message, _entry(message['Body'], message['MessageId'])) for message in messages]
+        written = [message for message, entry in parsed if entry is not None]
+        malformed = [message for message, entry in parsed if entry is None]
+        if written:
+            persist([entry for _, entry in parsed if entry is not None])
+            sqs_client.delete_message_batch(QueueUrl=JOURNAL_QUEUE_URL, Entries=[
+                {'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']} for i, message in enumerate(written)
+            ])
+        if malformed:
+            # Visible again right away, so its receives quickly add up to the DLQ's limit.
+            sqs_client.change_message_visibility_batch(QueueUrl=JOURNAL_QUEUE_URL, Entries=[
+                {'Id': str(i), 'ReceiptHandle': message['ReceiptHandle'], 'VisibilityTimeout': 0}
+                for i, message in enumerate(malformed)
+            ])
+        drained += len(written)
+        # A long poll returning less than a full batch had everything visible;
+        # if none of it predates the call, neither does anything left behind.
+        older = any(int(message['Attributes']['SentTimestamp']) <= cutoff_ms for message in written)
+        if not older and len(messages) < RECEIVE_MAX_MESSAGES:
+            break
+
+    settle_by = time.monotonic() + max(0.0, cutoff_ms / 1000 + JOURNAL_WRITER_MAX_SECONDS - time.time())
+    while _in_flight(sqs_client) and time.monotonic() < settle_by:
+        if time.monotonic() >= deadline:
+            LOGGER.warning("Journal batches still being written, dispatching anyway")
+            return False
+        time.sleep(1)
+    emit("journal-drain", {"entries": drained, "drain_seconds": round(time.perf_counter() - start, 3)})
+    return True
@@ -0,0 +1,123 @@
+import os
+import time
+import logging
+from datetime import datetime
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# Pipeline stages in the order a prayer goes through them.
+STAGE_ORDER = ("text", "tts", "mix", "deliver")
+# How long a worker owns a (user, day) entry while running a stage. Matches
+# the prayer queues' visibility timeout, after which SQS redelivers anyway.
+LEASE_SECONDS = int(os.environ.get("PRAYER_LEASE_SECONDS", "300"))
+# Ledger entries are dropped by DynamoDB TTL once redeliveries can't happen.
+LEDGER_TTL_DAYS = int(os.environ.get("PRAYER_LEDGER_TTL_DAYS", "14"))
+# Message fields produced by a stage and needed by the later ones.
+OUTPUT_FIELDS = ("text_key", "voice_key", "audio_key")
+
+
+class LeaseHeld(Exception):
+    """Another worker is running a stage for the same user and day."""
+
+    def __init__(self, message, until=None):
+        super().__init__(message)
+        # Epoch second the other worker's lease runs out, when known.
+        self.until = int(until) if until is not None else None
+
+
+def _done_attribute(stage):
+    return f"{stage}_done_at"
+
+
+def get_entry(table, email, day):
+    return table.get_item(Key={"email": email, "day": day}, ConsistentRead=True).get("Item") or {}
+
+
+def next_stage(entry):
+    """The first stage the entry has not completed, or None once delivered."""
+    for stage in STAGE_ORDER:
+        if _done_attribute(stage) not in entry:
+            return stage
+    return None
+
+
+def outputs(entry):
+    return {name: entry[name] for name in OUTPUT_FIELDS if name in entry}
+
+
+def acquire(table, email, day, stage, owner):
+    """Take the lease on (email, day) to run `stage`.
+
+    Returns False if the stage has already been completed, and raises
+    LeaseHeld while another worker's lease on the entry is still running.
+    """
+    now = int(time.time())
+    try:
+        table.update_item(
+            Key={"email": email, "day": day},
+            UpdateExpression="set lease_stage = :s, lease_owner = :o, lease_until = :u, "
+                             "expires_at = if_not_exists(expires_at, :e)",
+            ConditionExpression="attribute_not_exists(#done) AND "
+                                "(attribute_not_exists(lease_until) OR lease_until < :now OR lease_owner = :o)",
+            ExpressionAttributeNames={"#done": _done_attribute(stage)},
+            ExpressionAttributeValues={
+                ":s": stage,
+                ":o": owner,
+                ":u": now + LEASE_SECONDS,
+                ":e": now + LEDGER_TTL_DAYS * 86400,
+                ":now": now,
+            },
+        )
+        return True
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        entry = get_entry(table, email, day)
+        if _done_attribute(stage) in entry:
+            return False
+        raise LeaseHeld(f"{entry.get('lease_stage')} stage for {email} on {day} is leased until {entry.get('lease_until')}",
+                        entry.get('lease_until'))
+
+
+def complete(table, email, day, stage, owner, message):
+    """Record `stage` as done with its outputs and release the lease."""
+    names = {"#done": _done_attribute(stage)}
+    values = {":t": datetime.utcnow().isoformat(), ":o": owner}
+    assignments = ["#done = :t"]
+    for name in OUTPUT_FIELDS:
+        if name in message:
+            assignments.append(f"{name} = :{name}")
+            values[f":{name}"] = message[name]
+    try:
+        table.update_item(
+            Key={"email": email, "day": day},
+            UpdateExpression="set " + ", ".join(assignments) + " remove lease_stage, lease_owner, lease_until",
+            ConditionExpression="lease_owner = :o",
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        # The lease ran out mid-stage and someone else took over; let them
+        # carry the prayer forward instead of advancing it twice.
+        raise LeaseHeld(f"Lost the lease on {email} {day} while running the {stage} stage")
+
+
+def reopen(table, email, day, stage):
+    """Forget that `stage` was completed, so that it runs again."""
+    table.update_item(
+        Key={"email": email, "day": day},
+        UpdateExpression="remove #done",
+        ExpressionAttributeNames={"#done": _done_attribute(stage)},
+    )
+
+
+def release(table, email, day, owner):
+    """Drop the lease without completing the stage, e.g. when it was skipped or failed."""
+    try:
+        table.update_item(
+            Key={"email": email, "day": day},
+            UpdateExpression="remove lease_stage, lease_owner, lease_until",
+            ConditionExpression="lease_owner = :o",
+            ExpressionAttributeValues={":o": owner},
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
@@ -1,29 +1,41 @@
-import re
 import json
 import logging
+from extract import extract_json, extract_markdown
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
 
 def format_result(content, type='json'):
     if type == 'json':
-        pattern = r'(?P<quote>["\'`]{3})json\s*(?P<json>(\{.*?\}|\[.*?\]))\s*(?P=quote)'
-        matches = list(re.finditer(pattern, content, re.DOTALL))
-        if matches:
-            json_str = matches[-1].group("json")
-            return json.loads(json_str)
-        else:
-            return json.loads(content)
+        return extract_json(content)
     elif type == 'markdown':
-        pattern = r'(?P<quote>["\'`]{3})markdown\s+(.*?)(?P=quote)'
-        match = re.search(pattern, content, re.DOTALL)
-        if match:
-            return match.group(2)
-        else:
-            return content
+        return extract_markdown(content)
+
+
+def _stream_chunks(response):
+    """Decode the JSON chunks of an invoke_model_with_response_stream response."""
+    for event in response['body']:
+        if 'chunk' in event:
+            yield json.loads(event['chunk']['bytes'])
+
+
+def _converse_text(response):
+    """Yield the text deltas of a converse_stream response."""
+    for event in response['stream']:
+        delta = event.get('contentBlockDelta', {}).get('delta', {})
+        if 'text' in delta:
+            yield delta['text']
 
 
 def invoke_model(client, model_id, prompt, max_tokens=20000, attachment=None, temperature=0.9):
+    """Call the model and return the whole completion once it has finished."""
+    return "".join(invoke_model_stream(client, model_id, prompt, max_tokens=max_tokens, attachment=attachment,
+                                       temperature=temperature))
+
+
+def invoke_model_stream(client, model_id, prompt, max_tokens=20000, attachment=None, temperature=0.9):
+    """Yield the completion's text as the model generates it, so callers can
+    start on the output before the last token arrives."""
     if model_id.find('mistral') != -1:
         payload = {
             "messages" : [
@@ -48,12 +60,16 @@ def invoke_model(client, model_id, prompt, max_tokens=20000, attachment=None, te
                 }
             })
         body = json.dumps(payload)
-        response = client.invoke_model(
+        response = client.invoke_model_with_response_stream(
             modelId=model_id,
             body=body
         )
-        response_body = json.loads(response['body'].read())
-        return response_body['choices'][0]['message']['content']
+        for chunk in _stream_chunks(response):
+            for choice in chunk.get('choices', []):
+                # Streamed choices carry the new text under `message` (or `delta`).
+                text = (choice.get('message') or choice.get('delta') or {}).get('content')
+                if text:
+                    yield text
     elif model_id.find('claude') != -1:
         payload = {
             "anthropic_version": "bedrock-2023-05-31",
@@ -80,16 +96,15 @@ def invoke_model(client, model_id, prompt, max_tokens=20000, attachment=None, te
                     "data": attachment
                 }
             })
-        response = client.invoke_model(
+        response = client.invoke_model_with_response_stream(
             modelId=model_id,
             contentType='application/json',
             accept='application/json',
             body=json.dumps(payload)
         )
-
-        response_body = json.loads(response['body'].read())
-        response_content = response_body.pop('content')
-        return response_content[0]['text']
+        for chunk in _stream_chunks(response):
+            if chunk.get('type') == 'content_block_delta' and chunk['delta'].get('type') == 'text_delta':
+                yield chunk['delta']['text']
     elif model_id.find('deepseek') != -1:
         # DEEPSEEK invoke_model does not return the text response and reasoning process in one block text!!!
         # # Embed the prompt in DeepSeek-R1's instruction format.
@@ -111,7 +126,7 @@ def invoke_model(client, model_id, prompt, max_tokens=20000, attachment=None, te
         # choices = model_response["choices"]
         # return choices[0]['text']
         
-        response = client.converse(
+        response = client.converse_stream(
             modelId=model_id,
             messages=[
                 {
@@ -128,9 +143,8 @@ def invoke_model(client, model_id, prompt, max_tokens=20000, attachment=None, te
                 'temperature': temperature
             }
         )
-        LOGGER.info(f'response: {response}')
-        response_content = response['output']['message'].pop('content')
-        return response_content[0]['text']
+        # R1's reasoning arrives as separate reasoningContent deltas and is dropped.
+        yield from _converse_text(response)
     elif model_id.find('llama') != -1:
         payload = {
             "messages": [
@@ -154,7 +168,7 @@ def invoke_model(client, model_id, prompt, max_tokens=20000, attachment=None, te
                 }
             })
 
-        response = client.converse(
+        response = client.converse_stream(
             modelId=model_id,
             messages=payload["messages"],
             inferenceConfig={
@@ -163,5 +177,4 @@ def invoke_model(client, model_id, prompt, max_tokens=20000, attachment=None, te
                 "topP": 0.9
             }
         )
-        response_text = response["output"]["message"]["content"][0]["text"]
-        return response_text
+        yield from _converse_text(response)
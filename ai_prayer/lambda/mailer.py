@@ -0,0 +1,173 @@
+import os
+import time
+import json
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import emit
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+SES_BULK_MAX_DESTINATIONS = 50  # hard limit of SendBulkTemplatedEmail
+MAILER_WORKERS = int(os.environ.get("MAILER_WORKERS", "4"))
+MAILER_MAX_ATTEMPTS = int(os.environ.get("MAILER_MAX_ATTEMPTS", "5"))
+# Fraction of the account's MaxSendRate we allow ourselves, leaving room for
+# the transactional mails (signup, feedback, prayers) sent at the same time.
+SEND_RATE_HEADROOM = 0.8
+# Per-recipient statuses worth another attempt; 'Failed' and the rest are final.
+RETRYABLE_STATUSES = ('AccountThrottled', 'TransientFailure')
+
+_ensured_templates = set()
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursting to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, n=1):
+        """Take `n` tokens. Requests larger than the bucket are charged in
+        capacity-sized parts, so every destination counts against the rate."""
+        while n > 0:
+            part = min(n, self.capacity)
+            self._take(part)
+            n -= part
+
+    def _take(self, n):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                wait = (n - self.tokens) / self.rate
+                self.waited += wait
+            time.sleep(wait)
+
+
+def ensure_template(ses_client, name, subject, html):
+    """Create or update an SES template once per container."""
+    if name in _ensured_templates:
+        return
+    template = {'TemplateName': name, 'SubjectPart': subject, 'HtmlPart': html}
+    try:
+        current = ses_client.get_template(TemplateName=name)['Template']
+        if current.get('SubjectPart') != subject or current.get('HtmlPart') != html:
+            ses_client.update_template(Template=template)
+    except ses_client.exceptions.TemplateDoesNotExistException:
+        try:
+            ses_client.create_template(Template=template)
+        except ses_client.exceptions.AlreadyExistsException:
+            pass
+    _ensured_templates.add(name)
+
+
+def send_rate_governor(ses_client):
+    """Build a token bucket sized from the account's SES sending quota."""
+    quota = ses_client.get_send_quota()
+    remaining = quota['Max24HourSend'] - quota['SentLast24Hours']
+    LOGGER.info(f"SES quota: max rate {quota['MaxSendRate']}/s, {remaining:.0f} sends left in 24h")
+    return TokenBucket(max(1.0, quota['MaxSendRate'] * SEND_RATE_HEADROOM))
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _send_chunk(ses_client, source, template, chunk, governor, metrics, lock):
+    pending = chunk
+    for attempt in range(MAILER_MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(min(2 ** attempt * 0.2, 5) * random.uniform(0.5, 1.5))
+        governor.acquire(len(pending))
+        try:
+            response = ses_client.send_bulk_templated_email(
+                Source=source,
+                Template=template,
+                DefaultTemplateData="{}",
+                Destinations=[{
+                    'Destination': {'ToAddresses': [email]},
+                    'ReplacementTemplateData': json.dumps(data)
+                } for email, data in pending]
+            )
+        except ses_client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in ('Throttling', 'ThrottlingException'):
+                LOGGER.error(f"Bulk send of {len(pending)} emails failed: {e}")
+                with lock:
+                    metrics['failed'] += len(pending)
+                return
+            with lock:
+                metrics['throttled'] += len(pending)
+            continue
+
+        retry = []
+        sent = rejected = 0
+        for (email, data), status in zip(pending, response['Status']):
+            code = status.get('Status', 'Success')
+            if code == 'Success':
+                sent += 1
+            elif code in RETRYABLE_STATUSES:
+                retry.append((email, data))
+            else:
+                LOGGER.error(f"Email to {email} rejected: {code} {status.get('Error')}")
+                rejected += 1
+        with lock:
+            metrics['sent'] += sent
+            metrics['failed'] += rejected
+            metrics['throttled'] += len(retry)
+        pending = retry
+        if not pending:
+            return
+    LOGGER.error(f"Giving up on {len(pending)} emails after {MAILER_MAX_ATTEMPTS} attempts")
+    with lock:
+        metrics['failed'] += len(pending)
+
+
+def send_bulk_templated(ses_client, source, template, destinations, governor=None):
+    """Send a template to (email, template_data) pairs, 50 recipients per call.
+
+    Calls go through a token bucket sized from GetSendQuota, and only the
+    throttled or transiently failed recipients of a call are retried.
+    Returns counters for sent, failed and throttled recipients.
+    """
+    governor = governor or send_rate_governor(ses_client)
+    metrics = {'sent': 0, 'failed': 0, 'throttled': 0}
+    lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(MAILER_WORKERS * 2)
+
+    def worker(chunk):
+        try:
+            _send_chunk(ses_client, source, template, chunk, governor, metrics, lock)
+        except Exception:
+            LOGGER.exception(f"Bulk send of {len(chunk)} emails failed")
+            with lock:
+                metrics['failed'] += len(chunk)
+        finally:
+            in_flight.release()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=MAILER_WORKERS) as executor:
+        for chunk in _chunks(destinations, SES_BULK_MAX_DESTINATIONS):
+            in_flight.acquire()
+            executor.submit(worker, chunk)
+    metrics['seconds'] = round(time.perf_counter() - start, 3)
+    metrics['rate_wait_seconds'] = round(governor.waited, 3)
+    emit("ses-bulk-send", metrics)
+    return metrics
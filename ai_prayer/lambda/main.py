@@ -1,354 +1,423 @@
 import os
-import re
-import boto3
 import json
-import tempfile
+import time
 import logging
-import openai
-import requests
-from bs4 import BeautifulSoup
-from datetime import date
-from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import urllib.parse
-from elevenlabs.client import ElevenLabs
-from pydub import AudioSegment
-from llm import invoke_model
+from clients import get_client, get_dynamodb, get_openai, connection_stats
+from users import iter_verified_users, iter_shard_users, backfill_user_indexes, claim_check_in
+from sqs_batch import send_batched
+from gospel import get_gospel, prefetch_gospels
+from personality import update_profile, rebuild_profile, pending_update, save_update, PROFILE_MODEL
+from feelings import recent_feelings
+import ledger
+import batch
+from metrics import emit, log_event, span, trace
 import uuid
-import secrets
+# Modules only one route needs are imported in it, so the other routes don't
+# pay for them on a cold start.
 
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.INFO)
 
-dynamodb_client = boto3.resource("dynamodb")
-ses_client = boto3.client("ses")
+dynamodb_client = get_dynamodb()
+ses_client = get_client("ses")
 
 USERS_TABLE = dynamodb_client.Table(os.environ["USERS_TABLE_NAME"])
 FEELINGS_TABLE = dynamodb_client.Table(os.environ["FEELINGS_TABLE_NAME"])
+# Idempotency ledger keyed by (email, day); without it every delivery runs.
+LEDGER_TABLE = dynamodb_client.Table(os.environ["PRAYER_LEDGER_TABLE_NAME"]) if os.environ.get("PRAYER_LEDGER_TABLE_NAME") else None
 SEND_EMAIL = os.environ["SEND_EMAIL"]
-ADMIN_EMAIL = os.environ["ADMIN_EMAIL"]
-
-
-def get_today_gospel():
-    today = date.today().isoformat()
-    url = f"https://bible.usccb.org/daily-bible-reading?date={today}"
-    
-    response = requests.get(url)
-    if response.status_code != 200:
-        return f"Failed to fetch data: {response.status_code}"
-
-    soup = BeautifulSoup(response.text, 'html.parser')
-
-    # Find all the reading blocks
-    readings = soup.find_all('div', class_='b-verse')
-    
-    for reading in readings:
-        # Find the title of the reading
-        title_tag = reading.find('h3', class_='name')
-        
-        if title_tag and 'Gospel' in title_tag.text:
-            gospel_title = title_tag.text.strip()
-            
-            # Find the content of the reading
-            content_body = reading.find('div', class_='content-body')
-            if content_body:
-                gospel_text = content_body.get_text(separator="\n").strip()
-                return f"{gospel_title}\n\n{gospel_text}"
-
-    return ""
-
-
-def signup(event):
-    body = json.loads(event['body'])
-    email = body['email']
-    
-    verification_token = secrets.token_urlsafe(16)
-    
-    USERS_TABLE.put_item(
-        Item={
-            'email': email,
-            'verified': False,
-            'verification_token': verification_token,
-            'subscribed_at': datetime.utcnow().isoformat()
-        }
-    )
-    
-    api_gateway_url = f"https://{event['requestContext']['domainName']}/{event['requestContext']['stage']}"
-    verification_link = f"{api_gateway_url}/verify?email={urllib.parse.quote(email)}&token={verification_token}"
-    unsubscribe_link = f"{api_gateway_url}/unsubscribe?email={urllib.parse.quote(email)}&token={verification_token}"
-    
-    ses_client.send_email(
-        Source=SEND_EMAIL,
-        Destination={'ToAddresses': [email]},
-        Message={
-            'Subject': {'Data': "Verify your email for AI Prayer Companion"},
-            'Body': {
-                'Html': {
-                    'Data': f"""
-                        <p>Thank you for signing up! Please click the link below to verify your email address:</p>
-                        <a href="{verification_link}">Verify Email</a>
-                        <hr>
-                        <p style="font-size: 0.8em; color: #666;">To unsubscribe, <a href="{unsubscribe_link}">click here</a>.</p>
-                        <p style="font-size: 0.8em; color: #666; text-align: center;">
-                            Visit our main page at <a href="https://prayer.graceful.cloud">prayer.graceful.cloud</a>
-                        </p>
-                    """
-                }
-            }
-        }
-    )
-    
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'POST, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'
-        },
-        'body': json.dumps({'message': 'Verification email sent.'})
-    }
-
-
-def verify(event):
-    email = event['queryStringParameters']['email']
-    token = event['queryStringParameters']['token']
-    
-    response = USERS_TABLE.get_item(Key={'email': email})
-    user = response.get('Item')
-    
-    if user and user.get('verification_token') == token:
-        USERS_TABLE.update_item(
-            Key={'email': email},
-            UpdateExpression="set verified = :v",
-            ExpressionAttributeValues={':v': True}
-        )
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'text/html'},
-            'body': "<h1>Email verified successfully!</h1><p>You will now receive daily prayer check-ins.</p>"
-        }
-    
-    return {
-        'statusCode': 400,
-        'headers': {'Content-Type': 'text/html'},
-        'body': "<h1>Invalid verification link.</h1>"
-    }
-
-
-def unsubscribe(event):
-    email = event['queryStringParameters']['email']
-    token = event['queryStringParameters']['token']
-
-    response = USERS_TABLE.get_item(Key={'email': email})
-    user = response.get('Item')
-
-    if user and user.get('verification_token') == token:
-        USERS_TABLE.update_item(
-            Key={'email': email},
-            UpdateExpression="set verified = :v, unsubscribed_at = :u",
-            ExpressionAttributeValues={
-                ':v': False,
-                ':u': datetime.utcnow().isoformat()
-            }
-        )
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'text/html'},
-            'body': "<h1>You have been unsubscribed successfully.</h1>"
-        }
-
-    return {
-        'statusCode': 400,
-        'headers': {'Content-Type': 'text/html'},
-        'body': "<h1>Invalid unsubscribe link.</h1>"
-    }
-
-
-def journal(event):
-    body = json.loads(event['body'])
-    email = body['email']
-    feeling = body['feeling']
-    
-    FEELINGS_TABLE.put_item(
-        Item={
-            'email': email,
-            'timestamp': datetime.utcnow().isoformat(),
-            'feeling': feeling
-        }
+PRAYER_CONCURRENCY = int(os.environ.get("PRAYER_CONCURRENCY", "4"))
+# Prayers go out this many hours after the check-in shard, i.e. at noon local
+# time the day after a 21:00 check-in.
+DISPATCH_AFTER_CHECK_IN_HOURS = 15
+# "online" generates each prayer text when its message is processed; "batch"
+# submits the day's profile and prayer prompts as one batch job instead.
+GENERATION_MODE = os.environ.get("GENERATION_MODE", "online")
+# This function's timeout, see the stack.
+FUNCTION_TIMEOUT_SECONDS = int(os.environ.get("FUNCTION_TIMEOUT_SECONDS", "180"))
+# A batch manifest is claimed by an invocation about to submit its job, so one
+# still without a job a function timeout later belongs to a dispatch that died;
+# its prayers go online.
+BATCH_SUBMIT_TIMEOUT_SECONDS = FUNCTION_TIMEOUT_SECONDS
+# Time a batch dispatch keeps free to store what it prepared or submit the job.
+BATCH_PREPARE_RESERVE_SECONDS = 30
+# Time kept free at the end of an invocation, on top of sending what is queued,
+# to hand the rest of its work to a new one.
+CONTINUE_MARGIN_SECONDS = 20
+# Result of work an invocation left to the next one.
+_DEFERRED = object()
+
+
+def event_shard(event, offset_hours=0):
+    """The delivery shard an invocation is for, or None for everybody.
+
+    Hourly rules pass the schedule's `time`; those runs take only the shard
+    whose check-in hour was `offset_hours` before it. An explicit `shard`
+    wins, and events with neither (daily rules, manual runs) take everybody.
+    """
+    if 'shard' in event:
+        return int(event['shard'])
+    if event.get('time'):
+        hour = datetime.fromisoformat(event['time'].replace('Z', '+00:00')).hour
+        return (hour - offset_hours) % 24
+    return None
+
+
+def scheduled_users(event, offset_hours=0):
+    """Users an invocation should handle, see event_shard. Shards are those
+    of the check-in the run belongs to, `offset_hours` before it."""
+    shard = event_shard(event, offset_hours)
+    if shard is None:
+        return iter_verified_users(USERS_TABLE)
+    LOGGER.info(f"Processing delivery shard {shard}")
+    now = datetime.fromisoformat(event['time'].replace('Z', '+00:00')) if event.get('time') else datetime.now(timezone.utc)
+    return iter_shard_users(USERS_TABLE, shard, now - timedelta(hours=offset_hours))
+
+
+CHECK_IN_TEMPLATE = "AiPrayerCheckIn"
+CHECK_IN_SUBJECT = "How are you feeling today?"
+CHECK_IN_HTML = """
+    <h1>How are you feeling today?</h1>
+    <p>Click the link below to share your thoughts and feelings for today's prayer:</p>
+    <a href="{{journal_link}}">Share Your Feelings</a>
+    <hr>
+    <p style="font-size: 0.8em; color: #666;">To unsubscribe, <a href="{{unsubscribe_link}}">click here</a>.</p>
+    <p style="font-size: 0.8em; color: #666; text-align: center;">
+        Visit our main page at <a href="https://prayer.graceful.cloud">prayer.graceful.cloud</a>
+    </p>
+"""
+
+
+def continue_async(context, event):
+    """Hand `event` to a new asynchronous invocation of this function."""
+    get_client("lambda").invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType="Event",
+        Payload=json.dumps(event)
     )
-    
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'POST, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'
-        },
-        'body': json.dumps({'message': 'Journal entry saved.'})
-    }
 
 
-def handle_feedback(event):
-    body = json.loads(event['body'])
-    feedback_text = body.get('feedback')
-    user_email = body.get('email', 'Anonymous')
+def check_in(event, context=None):
+    """Email the scheduled users their check-in link, once per user and day.
 
-    subject = "New Feedback Received for AI Prayer Companion"
-    body_html = f"""
-    <h3>New Feedback Received</h3>
-    <p><strong>From:</strong> {user_email}</p>
-    <p><strong>Message:</strong></p>
-    <p>{feedback_text}</p>
+    Each user is claimed for the day before being queued, so a retried or
+    continued run skips everyone it already mailed. When the time left only
+    just covers sending what is queued, the rest goes to a new invocation.
     """
+    from mailer import ensure_template, send_bulk_templated, send_rate_governor, MAILER_WORKERS, SES_BULK_MAX_DESTINATIONS
 
-    ses_client.send_email(
-        Source=SEND_EMAIL,
-        Destination={'ToAddresses': [ADMIN_EMAIL]},
-        Message={
-            'Subject': {'Data': subject},
-            'Body': {'Html': {'Data': body_html}}
-        }
-    )
-
-    return {
-        'statusCode': 200,
-        'headers': {
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'POST, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'
-        },
-        'body': json.dumps({'message': 'Feedback sent successfully.'})
-    }
-
-
-def check_in(event):
     web_bucket_url = event.get('web_bucket_url')
     api_gateway_url = event.get('api_gateway_url')
     if not web_bucket_url or not api_gateway_url:
         LOGGER.error("web_bucket_url or api_gateway_url not found in event")
         return {"statusCode": 500, "body": "URL not configured"}
 
-    response = USERS_TABLE.scan(FilterExpression="verified = :v", ExpressionAttributeValues={':v': True})
-    users = response.get('Items', [])
-    
-    for user in users:
-        email = user['email']
-        token = user.get('verification_token')
-        if not token:
-            LOGGER.warning(f"User {email} is missing a verification token. Skipping check-in email.")
-            continue
-
-        journal_link = f"{web_bucket_url}/journal.html?email={urllib.parse.quote(email)}"
-        unsubscribe_link = f"{api_gateway_url}/unsubscribe?email={urllib.parse.quote(email)}&token={token}"
-        
-        ses_client.send_email(
-            Source=SEND_EMAIL,
-            Destination={'ToAddresses': [email]},
-            Message={
-                'Subject': {'Data': "How are you feeling today?"},
-                'Body': {
-                    'Html': {
-                        'Data': f"""
-                            <h1>How are you feeling today?</h1>
-                            <p>Click the link below to share your thoughts and feelings for today's prayer:</p>
-                            <a href="{journal_link}">Share Your Feelings</a>
-                            <hr>
-                            <p style="font-size: 0.8em; color: #666;">To unsubscribe, <a href="{unsubscribe_link}">click here</a>.</p>
-                            <p style="font-size: 0.8em; color: #666; text-align: center;">
-                                Visit our main page at <a href="https://prayer.graceful.cloud">prayer.graceful.cloud</a>
-                            </p>
-                        """
-                    }
-                }
+    ensure_template(ses_client, CHECK_IN_TEMPLATE, CHECK_IN_SUBJECT, CHECK_IN_HTML)
+    # The day of the scheduled run, so its retries and continuations share it.
+    day = event.get('check_in_day')
+    if not day:
+        at = datetime.fromisoformat(event['time'].replace('Z', '+00:00')) if event.get('time') else datetime.now(timezone.utc)
+        day = at.date().isoformat()
+    governor = send_rate_governor(ses_client)
+    # Queued chunks plus the one being filled, at the governed rate.
+    reserve_ms = ((MAILER_WORKERS * 2 + 1) * SES_BULK_MAX_DESTINATIONS / governor.rate + CONTINUE_MARGIN_SECONDS) * 1000
+    stopped = []
+
+    def destinations():
+        for user in scheduled_users(event):
+            email = user['email']
+            token = user.get('verification_token')
+            if not token:
+                LOGGER.warning(f"User {email} is missing a verification token. Skipping check-in email.")
+                continue
+            if user.get('check_in_day') == day:
+                continue
+            if context is not None and context.get_remaining_time_in_millis() < reserve_ms:
+                stopped.append(email)
+                return
+            if not claim_check_in(USERS_TABLE, email, day):
+                continue
+            yield email, {
+                'journal_link': f"{web_bucket_url}/journal.html?email={urllib.parse.quote(email)}",
+                'unsubscribe_link': f"{api_gateway_url}/unsubscribe?email={urllib.parse.quote(email)}&token={token}",
             }
-        )
-        
+
+    metrics = send_bulk_templated(ses_client, SEND_EMAIL, CHECK_IN_TEMPLATE, destinations(), governor)
+    LOGGER.info(f"Sent {metrics['sent']} check-in emails ({metrics['failed']} failed)")
+    if stopped:
+        LOGGER.info(f"Out of time at {stopped[0]}, continuing the check-in in a new invocation")
+        continue_async(context, dict(event, check_in_day=day))
+        return {"statusCode": 202, "body": "Check-in emails sent in part, continuing."}
+
     return {"statusCode": 200, "body": "Check-in emails sent."}
 
 
-def prayer_generation_dispatch(event):
+def prayer_generation_dispatch(event, context=None):
     queue_url = os.environ["PRAYER_REQUEST_QUEUE_URL"]
-    sqs_client = boto3.client("sqs")
+    sqs_client = get_client("sqs")
     api_gateway_url = event.get('api_gateway_url')
     if not api_gateway_url:
         LOGGER.error("api_gateway_url not found in prayer_generation_dispatch event")
         return {"statusCode": 500, "body": "api_gateway_url not configured"}
-    
-    response = USERS_TABLE.scan(FilterExpression="verified = :v", ExpressionAttributeValues={':v': True})
-    users = response.get('Items', [])
+    # A continuation carries the day of the dispatch it continues, which
+    # drained the journal already.
+    day = event.get('day')
+    if not day:
+        from journal_writer import drain as drain_journal
+
+        # Read-your-writes: entries still in the write-behind queue must be in the
+        # feelings table before any prayer for today is generated from it.
+        drain_journal()
+        # Stamped at dispatch so a rerun later in the day hits the same ledger entries.
+        day = datetime.utcnow().date().isoformat()
+    if GENERATION_MODE == "batch":
+        return prayer_batch_dispatch(event, api_gateway_url, day, context)
+
+    def message_bodies():
+        for user in scheduled_users(event, DISPATCH_AFTER_CHECK_IN_HOURS):
+            email = user['email']
+            token = user.get('verification_token')
+            if not token:
+                LOGGER.warning(f"User {email} is missing a verification token. Skipping prayer dispatch.")
+                continue
+            yield json.dumps({
+                "recipient_email": email,
+                "token": token,
+                "api_gateway_url": api_gateway_url,
+                "day": day
+            })
 
-    for user in users:
-        email = user['email']
-        token = user.get('verification_token')
-        if not token:
-            LOGGER.warning(f"User {email} is missing a verification token. Skipping prayer dispatch.")
-            continue
-        message_body = json.dumps({
-            "recipient_email": email,
-            "token": token,
-            "api_gateway_url": api_gateway_url
-        })
-        sqs_client.send_message(
-            QueueUrl=queue_url,
-            MessageBody=message_body
-        )
-        LOGGER.info(f"Dispatched prayer request for {email}")
+    metrics = send_batched(sqs_client, queue_url, message_bodies())
+    LOGGER.info(f"Dispatched {metrics['sent']} prayer requests ({metrics['failed']} failed)")
 
     return {"statusCode": 200, "body": "Prayer requests dispatched."}
 
 
-def prayer_generation_process(event):
-    for record in event['Records']:
-        message = json.loads(record['body'])
-        recipient_email = message['recipient_email']
-        token = message['token']
-        api_gateway_url = message['api_gateway_url']
-        
-        LOGGER.info(f"Processing prayer for {recipient_email}")
-
-        prayers_bucket_name = os.environ["PRAYERS_BUCKET_NAME"]
-        lookback_days = int(os.environ["LOOKBACK_DAYS"])
-        openai_api_key = os.environ["OPENAI_API_KEY"]
-        
-        openai_client = openai.OpenAI(api_key=openai_api_key)
-        
-        start_date = (datetime.utcnow() - timedelta(days=lookback_days)).isoformat()
-        
-        response = FEELINGS_TABLE.query(
-            KeyConditionExpression="email = :email AND #ts > :start_date",
-            ExpressionAttributeNames={"#ts": "timestamp"},
-            ExpressionAttributeValues={
-                ":email": recipient_email,
-                ":start_date": start_date,
-            },
-        )
-        
-        feelings = [item["feeling"] for item in response.get("Items", [])]
-        if not feelings:
-            LOGGER.info(f"no feelings found for {recipient_email}, skipping")
-            continue
-        
-        recent_activities = feelings[:-1]
-        last_day_feeling = feelings[-1]
-        
-        gospel = get_today_gospel()
-        
-        prompt = f"""
-    Please using five words to summarize my personal characteristics based on the following words: 
-    {"\n".join(feelings)}
-    
-    Output rule:
-    1. Output in JSON format with the characteristics as the key, and explanation as the value
+def prayer_batch_dispatch(event, api_gateway_url, day, context=None):
+    """Submit today's profile updates and prayer prompts as one batch job.
+
+    The prayer prompts use the profile as stored; the updates made by the
+    same job are folded in when it is ingested, for the next day's prayer.
+    There is one job per day and shard: a retried or repeated invocation
+    finds the manifest of the first one and submits nothing. Users not
+    prepared in time are left to a new invocation; what this one prepared is
+    stored as a part, and the invocation that prepares the last user submits
+    the job from all parts.
     """
-        LOGGER.info(f'prompt: {prompt}')
-        response = openai_client.responses.create(
-            model="gpt-4.1",
-            input=prompt
-        )
-        characteristics = response.output[0].content[0].text
-        
-        prompt = f"""
+    bucket = os.environ["PRAYERS_BUCKET_NAME"]
+    shard = event_shard(event, DISPATCH_AFTER_CHECK_IN_HOURS)
+    name = f"prayers-{day}" if shard is None else f"prayers-{day}-shard-{shard}"
+    if batch.manifest_exists(bucket, name):
+        LOGGER.info(f"Batch {name} was already dispatched")
+        return {"statusCode": 200, "body": f"Prayer batch {name} already dispatched."}
+    parts = list(batch.load_parts(bucket, name))
+    done = {email for part in parts for email in part["users"]}
+    lookback_days = int(os.environ["LOOKBACK_DAYS"])
+    start_date = (datetime.utcnow() - timedelta(days=lookback_days)).isoformat()
+    gospel = get_gospel()
+
+    def prepare(user):
+        email = user['email']
+        if email in done:
+            return email, None
+        if context is not None and context.get_remaining_time_in_millis() < BATCH_PREPARE_RESERVE_SECONDS * 1000:
+            return email, _DEFERRED
+        token = user.get('verification_token')
+        if not token:
+            LOGGER.warning(f"User {email} is missing a verification token. Skipping prayer dispatch.")
+            return email, None
+        if LEDGER_TABLE is not None and ledger.next_stage(ledger.get_entry(LEDGER_TABLE, email, day)) != "text":
+            return email, None
+        latest = recent_feelings(FEELINGS_TABLE, email, start_date, max_entries=1)
+        if not latest:
+            return email, None
+        profile, update = pending_update(email, lookback_days)
+        characteristics = profile["characteristics"] if profile else "Not known yet, judge them from my feelings."
+        message = {"recipient_email": email, "token": token, "api_gateway_url": api_gateway_url, "day": day}
+        return email, (message, prayer_prompt(characteristics, gospel, latest[0][1]), update)
+
+    # Requests are keyed by custom_id, so users prepared twice by overlapping
+    # invocations are submitted once.
+    part = {"users": [], "messages": {}, "lines": {}, "profiles": {}}
+    deferred = 0
+    with ThreadPoolExecutor(max_workers=PRAYER_CONCURRENCY) as executor:
+        for email, prepared in executor.map(prepare, scheduled_users(event, DISPATCH_AFTER_CHECK_IN_HOURS)):
+            if prepared is _DEFERRED:
+                deferred += 1
+                continue
+            if email not in done:
+                part["users"].append(email)
+            if prepared is None:
+                continue
+            message, prompt, update = prepared
+            part["messages"][email] = message
+            part["lines"][f"prayer:{email}"] = batch.request_line(f"prayer:{email}", PRAYER_MODEL, prompt)
+            if update:
+                # The prompt goes into the job; keep only what saving needs.
+                part["profiles"][email] = {k: v for k, v in update.items() if k != "prompt"}
+                part["lines"][f"profile:{email}"] = batch.request_line(f"profile:{email}", PROFILE_MODEL, update["prompt"])
+    if deferred:
+        batch.save_part(bucket, name, part)
+        LOGGER.info(f"Prepared {len(part['messages'])} prayers of batch {name}, leaving {deferred} users to a new invocation")
+        continue_async(context, dict(event, day=day))
+        return {"statusCode": 202, "body": f"Prayer batch {name} prepared in part, continuing."}
+
+    messages, lines, updates = {}, {}, {}
+    for prepared in parts + [part]:
+        messages.update(prepared["messages"])
+        lines.update(prepared["lines"])
+        updates.update(prepared["profiles"])
+    if not messages:
+        LOGGER.info("No prayers to generate")
+        return {"statusCode": 200, "body": "No prayers to generate."}
+
+    manifest = {
+        "name": name,
+        "day": day,
+        "submitted_at": datetime.utcnow().isoformat(),
+        "messages": messages,
+        "profiles": updates,
+    }
+    # Claimed before submitting, so two invocations cannot both submit.
+    if not batch.claim_manifest(bucket, manifest):
+        LOGGER.info(f"Batch {name} is being dispatched by another invocation")
+        return {"statusCode": 200, "body": f"Prayer batch {name} already dispatched."}
+    job_id = batch.get_provider().submit(name, list(lines.values()))
+    manifest["job_id"] = job_id
+    batch.save_manifest(bucket, manifest)
+    emit("prayer-batch-dispatch", {"prayers": len(messages), "profile_updates": len(updates)}, {"job_id": job_id})
+    LOGGER.info(f"Submitted batch {job_id} with {len(messages)} prayers and {len(updates)} profile updates")
+    return {"statusCode": 200, "body": f"Prayer batch {job_id} submitted."}
+
+
+def ingest_batch(manifest):
+    """Store a finished job's outputs and start TTS for every prayer in it.
+
+    Prayers without a usable output go back through the online path.
+    """
+    messages = manifest["messages"]
+    prayers, fallback = {}, []
+    for custom_id, text in batch.get_provider().results(manifest["job_id"]):
+        kind, email = custom_id.split(":", 1)
+        if kind == "profile" and text:
+            save_update(email, text, manifest["profiles"][email])
+        elif kind == "prayer" and text:
+            prayers[email] = text
+
+    def start_tts(email):
+        # The text stage stores the batch output; run_stage then advances to TTS.
+        run_stage(dict(messages[email], batch_text=prayers[email]), "text")
+
+    with ThreadPoolExecutor(max_workers=max(1, PRAYER_CONCURRENCY)) as executor:
+        futures = {executor.submit(start_tts, email): email for email in prayers}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception:
+                LOGGER.exception(f"Failed to ingest the batch prayer for {futures[future]}")
+                fallback.append(futures[future])
+    ingested = len(prayers) - len(fallback)
+    # Prayers the job has no output for were never in `prayers`.
+    fallback += [email for email in messages if email not in prayers]
+    return ingested, fallback
+
+
+def prayer_batch_poll(event):
+    """Check submitted batch jobs and ingest the finished ones."""
+    bucket = os.environ["PRAYERS_BUCKET_NAME"]
+    provider = batch.get_provider()
+    for manifest in batch.pending_manifests(bucket):
+        job_id = manifest.get("job_id")
+        submitted = datetime.fromisoformat(manifest["submitted_at"])
+        if job_id is None:
+            # Claimed, but the dispatch never recorded a job: it may still be
+            # submitting, or it died before the provider took the job.
+            if datetime.utcnow() - submitted < timedelta(seconds=BATCH_SUBMIT_TIMEOUT_SECONDS):
+                LOGGER.info(f"Batch {manifest['name']} is still being submitted")
+                continue
+            status = "failed"
+        else:
+            status = provider.status(job_id)
+        if status == "running":
+            LOGGER.info(f"Batch {job_id} is still running")
+            continue
+        if status == "completed":
+            ingested, fallback = ingest_batch(manifest)
+        else:
+            ingested, fallback = 0, list(manifest["messages"])
+        if fallback:
+            # Generate these online after all, as if dispatched without batching.
+            metrics = send_batched(get_client("sqs"), os.environ["PRAYER_REQUEST_QUEUE_URL"],
+                                   (json.dumps(manifest["messages"][email]) for email in fallback))
+            LOGGER.warning(f"Batch {manifest['name']}: {metrics['sent']} prayers fell back to online generation")
+        batch.finish_manifest(bucket, manifest, status)
+        emit("prayer-batch-ingest", {
+            "prayers": ingested,
+            "fallbacks": len(fallback),
+            "turnaround_seconds": round((datetime.utcnow() - submitted).total_seconds(), 1),
+        }, {"name": manifest["name"], "job_id": job_id, "status": status})
+    return {"statusCode": 200, "body": "Prayer batches polled."}
+
+
+SQS_MAX_DELAY_SECONDS = 900
+PIPELINE_STAGE_QUEUES = {
+    "tts": "PRAYER_TTS_QUEUE_URL",
+    "mix": "PRAYER_MIX_QUEUE_URL",
+    "deliver": "PRAYER_DELIVERY_QUEUE_URL",
+}
+TTS_INSTRUCTION = (
+    "Speak as if you are God speaking directly to a beloved child—"
+    "with deep authority, infinite compassion, and peaceful pace, "
+    "and a voice that is both awe-inspiring and calming."
+)
+TTS_ARGS = dict(model="gpt-4o-mini-tts", voice="onyx", instructions=TTS_INSTRUCTION)
+# "chunked" renders paragraphs/sentences in parallel; "single" is one streamed call.
+TTS_MODE = os.environ.get("TTS_MODE", "single")
+
+
+def artifact_key(message, name):
+    return f"artifacts/{message['day']}/{message['recipient_email']}/{name}"
+
+
+def stage_queue_url(stage):
+    """The queue `stage` runs from, or None where it runs inline."""
+    # Text runs from the request queue the dispatch fills.
+    return os.environ.get(PIPELINE_STAGE_QUEUES.get(stage, "PRAYER_REQUEST_QUEUE_URL"))
+
+
+def defer(message, stage, until):
+    """Queue `stage` again as a new message, delayed until `until` (epoch
+    seconds) or by the longest SQS allows. Returns False, queueing nothing,
+    for a stage without a queue."""
+    queue_url = stage_queue_url(stage)
+    if not queue_url:
+        return False
+    delay = SQS_MAX_DELAY_SECONDS if until is None else min(max(until - int(time.time()) + 1, 0), SQS_MAX_DELAY_SECONDS)
+    get_client("sqs").send_message(QueueUrl=queue_url, MessageBody=json.dumps(dict(message, stage=stage)),
+                                   DelaySeconds=delay)
+    return True
+
+
+def advance(message, stage):
+    """Hand a prayer to its next stage: through that stage's queue when one is
+    configured, otherwise by running the stage inline."""
+    message = dict(message, stage=stage)
+    queue_url = stage_queue_url(stage)
+    if queue_url:
+        get_client("sqs").send_message(QueueUrl=queue_url, MessageBody=json.dumps(message))
+    else:
+        run_stage(message, stage)
+
+
+PRAYER_MODEL = "gpt-4.1"
+
+
+def prayer_prompt(characteristics, gospel, last_day_feeling):
+    return f"""
     You are a HOLY prayer creator. Based on my personality:
     {characteristics}
     
@@ -370,47 +439,133 @@ def prayer_generation_process(event):
         c. It ends with Amen.
     
     3. Just output those words, do not give explanations."""
-        LOGGER.info(f'prompt: {prompt}')
+
+
+def prayer_text_stage(message):
+    if 'batch_text' in message:
+        # Generated by a batch job (see prayer_batch_poll); only stored here.
+        message = dict(message)
+        return store_prayer_text(message, message.pop('batch_text'))
+
+    recipient_email = message['recipient_email']
+    lookback_days = int(os.environ["LOOKBACK_DAYS"])
+    openai_client = get_openai()
+    
+    start_date = (datetime.utcnow() - timedelta(days=lookback_days)).isoformat()
+    
+    with span("feelings_query"):
+        latest = recent_feelings(FEELINGS_TABLE, recipient_email, start_date, max_entries=1)
+    if not latest:
+        LOGGER.info(f"no feelings found for {recipient_email}, skipping")
+        return None
+    
+    last_day_feeling = latest[0][1]
+    
+    with span("gospel"):
+        gospel = get_gospel()
+    
+    # Only the entries written since the last run are sent to the model.
+    with span("profile_llm"):
+        profile = update_profile(openai_client, recipient_email, lookback_days)
+    characteristics = profile["characteristics"]
+    
+    prompt = prayer_prompt(characteristics, gospel, last_day_feeling)
+    LOGGER.info(f'prompt: {prompt}')
+    with span("prayer_llm") as llm:
         response = openai_client.responses.create(
-            model="gpt-4.1",
+            model=PRAYER_MODEL,
             input=prompt
         )
         prayer_text = response.output[0].content[0].text
+        llm["bytes"] = len(prayer_text.encode('utf-8'))
+
+    return store_prayer_text(message, prayer_text)
 
-        instruction = (
-            "Speak as if you are God speaking directly to a beloved child—"
-            "with deep authority, infinite compassion, and peaceful pace, "
-            "and a voice that is both awe-inspiring and calming."
-        )
-        
-        s3_client = boto3.client("s3")
-        file_name = f"prayer-{datetime.utcnow().isoformat()}.mp3"
-        s3_key = f"prayers/{recipient_email}/{file_name}"
-        
-        with tempfile.TemporaryDirectory() as temp_dir:
-            audio_path = os.path.join(temp_dir, file_name)
-            with openai_client.audio.speech.with_streaming_response.create(
-                model="gpt-4o-mini-tts",
-                voice="onyx",
-                input=prayer_text,
-                instructions=instruction,
-            ) as response:
-                response.stream_to_file(audio_path)
-                
-            audio_path = merge_prayer_with_pg(audio_path)
-            s3_client.upload_file(audio_path, prayers_bucket_name, s3_key, ExtraArgs={
-                "ContentType": "audio/mp3",
-                "ContentDisposition": "inline"
-            })
 
-        presigned_url = s3_client.generate_presigned_url(
-            "get_object",
-            Params={"Bucket": prayers_bucket_name, "Key": s3_key},
-            ExpiresIn=3600*24,
+def store_prayer_text(message, prayer_text):
+    message = dict(message, text_key=artifact_key(message, "prayer.txt"))
+    with span("s3_put"):
+        get_client("s3").put_object(
+            Bucket=os.environ["PRAYERS_BUCKET_NAME"],
+            Key=message['text_key'],
+            Body=prayer_text.encode('utf-8'),
+            ContentType="text/plain; charset=utf-8"
         )
+    return message
+
+
+def prayer_tts_stage(message):
+    from mixer import upload_stream, CHUNK_SIZE
+    from tts import synthesize_chunked
+
+    prayers_bucket_name = os.environ["PRAYERS_BUCKET_NAME"]
+    s3_client = get_client("s3")
+    with span("s3_get"):
+        prayer_text = s3_client.get_object(Bucket=prayers_bucket_name, Key=message['text_key'])['Body'].read().decode('utf-8')
+
+    openai_client = get_openai()
+
+    if TTS_MODE == "chunked":
+        try:
+            with span("tts_chunked") as tts:
+                audio = synthesize_chunked(openai_client, prayer_text, **TTS_ARGS)
+                tts["bytes"] = len(audio)
+        except Exception:
+            LOGGER.exception(f"Chunked TTS failed for {message['recipient_email']}, falling back to a single call")
+            audio = None
+        if audio is not None:
+            message = dict(message, voice_key=artifact_key(message, "voice.wav"))
+            with span("s3_put"):
+                s3_client.put_object(Bucket=prayers_bucket_name, Key=message['voice_key'], Body=audio,
+                                     ContentType="audio/wav")
+            return message
+
+    message = dict(message, voice_key=artifact_key(message, "voice.mp3"))
+    # The TTS response streams straight into S3, so the span covers both.
+    with span("tts_upload") as tts, openai_client.audio.speech.with_streaming_response.create(
+        input=prayer_text,
+        **TTS_ARGS,
+    ) as response:
+        tts["bytes"] = upload_stream(s3_client, prayers_bucket_name, message['voice_key'],
+                                     response.iter_bytes(CHUNK_SIZE), extra_args={"ContentType": "audio/mpeg"})
+    return message
+
+
+def prayer_mix_stage(message):
+    from mixer import mix_with_background, upload_stream, audio_profile, CHUNK_SIZE
+    from cdn import PRAYER_CACHE_CONTROL
+
+    prayers_bucket_name = os.environ["PRAYERS_BUCKET_NAME"]
+    s3_client = get_client("s3")
+    profile = audio_profile()
+    file_name = f"prayer-{datetime.utcnow().isoformat()}.{profile['extension']}"
+    message = dict(message, audio_key=f"prayers/{message['recipient_email']}/{file_name}")
+
+    voice = s3_client.get_object(Bucket=prayers_bucket_name, Key=message['voice_key'])['Body']
+    # The voice track streams through ffmpeg straight into a multipart upload.
+    mixed = mix_with_background(voice.iter_chunks(CHUNK_SIZE), output_format=profile['format'],
+                                output_args=profile['args'])
+    with span("mix_upload") as mix:
+        mix["bytes"] = upload_stream(s3_client, prayers_bucket_name, message['audio_key'], mixed, extra_args={
+            "ContentType": profile['content_type'],
+            "ContentDisposition": "inline",
+            "CacheControl": PRAYER_CACHE_CONTROL
+        })
+    return message
+
+
+def prayer_delivery_stage(message):
+    from cdn import audio_url
 
-        unsubscribe_link = f"{api_gateway_url}/unsubscribe?email={urllib.parse.quote(recipient_email)}&token={token}"
-        body_html = f"""
+    recipient_email = message['recipient_email']
+    token = message['token']
+    api_gateway_url = message['api_gateway_url']
+
+    with span("presign"):
+        presigned_url = audio_url(os.environ["PRAYERS_BUCKET_NAME"], message['audio_key'], 3600*24)
+
+    unsubscribe_link = f"{api_gateway_url}/unsubscribe?email={urllib.parse.quote(recipient_email)}&token={token}"
+    body_html = f"""
     <html>
     <body>
         <h1>Your Daily Prayer</h1>
@@ -426,6 +581,7 @@ def prayer_generation_process(event):
     </html>
     """
 
+    with span("ses_send"):
         ses_client.send_email(
             Source=SEND_EMAIL,
             Destination={"ToAddresses": [recipient_email]},
@@ -434,63 +590,171 @@ def prayer_generation_process(event):
                 "Body": {"Html": {"Data": body_html}},
             }
         )
-        LOGGER.info(f"Prayer generated and sent to {recipient_email}")
+    LOGGER.info(f"Prayer generated and sent to {recipient_email}")
+    return message
 
-    return {"statusCode": 200, "body": f"Processed {len(event['Records'])} prayer requests."}
 
+PIPELINE_STAGES = {
+    "text": prayer_text_stage,
+    "tts": prayer_tts_stage,
+    "mix": prayer_mix_stage,
+    "deliver": prayer_delivery_stage,
+}
 
-def merge_prayer_with_pg(prayer_path):
-    prayer = AudioSegment.from_file(prayer_path)
-    bg_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bg.mp3')
-    background = AudioSegment.from_file(bg_path)
-    if len(background) < len(prayer):
-        background = background * (len(prayer) // len(background) + 1)
 
-    background = background[:len(prayer)]
-    combined = prayer.overlay(background)
-    
-    prefix, ext = os.path.splitext(prayer_path)
-    final_path = f'{prefix}_bg1{ext}'
-    combined.export(final_path, format="mp3")
-    return final_path
+def run_stage(message, stage):
+    """Run one stage under the ledger's lease, then advance to the next one.
+
+    Stages already recorded for the user and day are skipped: a duplicate
+    message of a completed stage stops here, since the run that completed it
+    handed the prayer on, and one of a prayer whose later stages run inline
+    resumes from the first stage it has not completed. A stage another worker
+    holds the lease on is queued again for when the lease runs out, as a new
+    message, so waiting for it does not use up the receives before the
+    dead-letter queue.
+    """
+    email, day = message['recipient_email'], message['day']
+    leased = LEDGER_TABLE is not None
+    if leased:
+        entry = ledger.get_entry(LEDGER_TABLE, email, day)
+        resume = ledger.next_stage(entry)
+        if resume is None:
+            LOGGER.info(f"Prayer for {email} on {day} was already delivered, skipping")
+            return
+        if ledger.STAGE_ORDER.index(resume) > ledger.STAGE_ORDER.index(stage):
+            if stage_queue_url(resume):
+                LOGGER.info(f"{stage} stage for {email} on {day} already done, skipping")
+                return
+            # Stages run inline have no message of their own to redeliver.
+            LOGGER.info(f"{stage} stage for {email} on {day} already done, resuming at {resume}")
+            advance(dict(message, **ledger.outputs(entry)), resume)
+            return
+        owner = str(uuid.uuid4())
+        try:
+            acquired = ledger.acquire(LEDGER_TABLE, email, day, stage, owner)
+        except ledger.LeaseHeld as e:
+            if not defer(message, stage, e.until):
+                raise
+            LOGGER.info(f"{e}, retrying the {stage} stage then")
+            return
+        if not acquired:
+            LOGGER.info(f"{stage} stage for {email} on {day} was completed concurrently, skipping")
+            return
+
+    try:
+        with trace(f"prayer-{stage}"):
+            message = PIPELINE_STAGES[stage](message)
+    except Exception:
+        if leased:
+            ledger.release(LEDGER_TABLE, email, day, owner)
+        raise
+    if message is None:
+        if leased:
+            ledger.release(LEDGER_TABLE, email, day, owner)
+        return
+    if leased:
+        try:
+            ledger.complete(LEDGER_TABLE, email, day, stage, owner, message)
+        except ledger.LeaseHeld:
+            # The lease ran out mid-stage and another worker took the stage
+            # over; it hands the prayer on.
+            LOGGER.warning(f"Lost the lease on the {stage} stage for {email} on {day}")
+            return
+
+    position = ledger.STAGE_ORDER.index(stage)
+    if position + 1 < len(ledger.STAGE_ORDER):
+        next_stage = ledger.STAGE_ORDER[position + 1]
+        try:
+            advance(message, next_stage)
+        except Exception:
+            if leased and stage_queue_url(next_stage):
+                # Never handed on, so the redelivered message must run the stage again.
+                ledger.reopen(LEDGER_TABLE, email, day, stage)
+            raise
+
+
+def process_prayer_record(record):
+    message = json.loads(record['body'])
+    # Messages from prayer_generation_dispatch carry no stage and start at text;
+    # ones queued before `day` was stamped at dispatch default to today.
+    stage = message.get('stage', 'text')
+    message.setdefault('day', datetime.utcnow().date().isoformat())
+    LOGGER.info(f"Processing {stage} stage of the prayer for {message['recipient_email']}")
+    run_stage(message, stage)
+
+
+def prayer_generation_process(event):
+    """Process an SQS batch concurrently and report only the failed messages.
+
+    Returning batchItemFailures (with ReportBatchItemFailures enabled on the
+    event source) makes SQS redeliver just those records instead of the batch.
+    """
+    records = event['Records']
+    failures = []
+    with ThreadPoolExecutor(max_workers=max(1, min(PRAYER_CONCURRENCY, len(records)))) as executor:
+        futures = {executor.submit(process_prayer_record, record): record for record in records}
+        for future in as_completed(futures):
+            record = futures[future]
+            try:
+                future.result()
+            except Exception:
+                LOGGER.exception(f"Failed to process prayer message {record['messageId']}")
+                failures.append({"itemIdentifier": record['messageId']})
+
+    LOGGER.info(f"Processed {len(records) - len(failures)} of {len(records)} prayer requests")
+    return {"batchItemFailures": failures}
+
+
+def rebuild_profiles(event):
+    """Recompute personality profiles from scratch, for one user or every verified user."""
+    openai_client = get_openai()
+    lookback_days = int(os.environ["LOOKBACK_DAYS"])
+    if event.get('email'):
+        emails = [event['email']]
+    else:
+        emails = (user['email'] for user in iter_verified_users(USERS_TABLE))
+
+    def rebuild(email):
+        return rebuild_profile(openai_client, email, lookback_days)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        rebuilt = sum(executor.map(rebuild, emails))
+    LOGGER.info(f"Rebuilt {rebuilt} personality profiles")
+    return {"statusCode": 200, "body": f"Rebuilt {rebuilt} profiles."}
 
 
 def handler(event, context):
-    LOGGER.info(f"Received event: {json.dumps(event)}")
+    log_event(event)
+    try:
+        return route(event, context)
+    finally:
+        emit("connections", connection_stats())
+
 
+def route(event, context=None):
     if 'httpMethod' in event:
-        path = event['path']
-        method = event['httpMethod']
-        
-        if path == '/signup' and method == 'POST':
-            return signup(event)
-        elif path == '/verify' and method == 'GET':
-            return verify(event)
-        elif path == '/unsubscribe' and method == 'GET':
-            return unsubscribe(event)
-        elif path == '/journal' and method == 'POST':
-            return journal(event)
-        elif path == '/feedback' and method == 'POST':
-            return handle_feedback(event)
-        elif method == 'OPTIONS':
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Methods': 'POST, GET, OPTIONS',
-                    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'
-                },
-                'body': ''
-            }
+        # Served by the API function; kept here for events still routed to this one.
+        import api
+        return api.route(event)
 
     if "Records" in event and event["Records"][0]["eventSource"] == "aws:sqs":
         return prayer_generation_process(event)
 
     action = event.get("action")
     if action == "check-in":
-        return check_in(event)
+        return check_in(event, context)
     elif action == "prayer-generation-dispatch":
-        return prayer_generation_dispatch(event)
+        return prayer_generation_dispatch(event, context)
+    elif action == "prayer-batch-poll":
+        return prayer_batch_poll(event)
+    elif action == "gospel-prefetch":
+        results = prefetch_gospels(event.get('days'))
+        return {"statusCode": 200, "body": json.dumps(results)}
+    elif action == "rebuild-profile":
+        return rebuild_profiles(event)
+    elif action == "backfill-user-index":
+        updated = backfill_user_indexes(USERS_TABLE)
+        return {"statusCode": 200, "body": f"Backfilled {updated} users."}
 
     LOGGER.error(f"Unknown event: {event}")
     return {"statusCode": 400, "body": "Invalid action or event source."}
@@ -0,0 +1,121 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "AiPrayer")
+# Fraction of invocations whose event payload is logged, and how much of it.
+EVENT_LOG_SAMPLE_RATE = float(os.environ.get("EVENT_LOG_SAMPLE_RATE", "0.05"))
+EVENT_LOG_MAX_BYTES = int(os.environ.get("EVENT_LOG_MAX_BYTES", "2048"))
+
+_write_lock = threading.Lock()
+_local = threading.local()
+
+_UNITS = {
+    "ms": "Milliseconds",
+    "bytes": "Bytes",
+    "seconds": "Seconds",
+    "second": "Count/Second",  # e.g. per_second
+}
+
+
+def _unit(name):
+    return _UNITS.get(name.rsplit("_", 1)[-1], "Count")
+
+
+def emit(operation, metrics, properties=None):
+    """Write one CloudWatch Embedded Metric Format line for `operation`.
+
+    Numeric values become metrics (unit picked from the name's suffix) under
+    the Operation dimension; anything else, plus `properties`, is kept as
+    searchable log fields. EMF lines must be bare JSON, so they go straight
+    to stdout rather than through the runtime's prefixed log format.
+    """
+    values = {name: value for name, value in metrics.items()
+              if isinstance(value, (int, float)) and not isinstance(value, bool)}
+    record = dict(properties or {})
+    record.update({name: value for name, value in metrics.items() if name not in values})
+    record.update(values)
+    record["Operation"] = operation
+    record["_aws"] = {
+        "Timestamp": int(time.time() * 1000),
+        "CloudWatchMetrics": [{
+            "Namespace": METRICS_NAMESPACE,
+            "Dimensions": [["Operation"]],
+            "Metrics": [{"Name": name, "Unit": _unit(name)} for name in values],
+        }],
+    }
+    line = json.dumps(record, default=str)
+    with _write_lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+
+def record(name, value):
+    """Add `value` to metric `name` of the trace running on this thread.
+
+    Repeated names are summed. Outside a trace the value is emitted on its own.
+    """
+    current = getattr(_local, "trace", None)
+    if current is None:
+        emit(name, {name: value})
+        return
+    current[name] = current.get(name, 0) + value
+
+
+@contextmanager
+def trace(operation, **properties):
+    """Collect the spans of one unit of work (e.g. a pipeline stage for one
+    prayer) and emit them as a single EMF line with its total duration."""
+    metrics = {}
+    previous = getattr(_local, "trace", None)
+    _local.trace = metrics
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        _local.trace = previous
+        metrics["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        emit(operation, metrics, properties)
+
+
+@contextmanager
+def span(name):
+    """Time a block as `<name>_ms`. Setting `span["bytes"]` inside the block
+    also records the payload size as `<name>_bytes`."""
+    info = {}
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        record(f"{name}_ms", round((time.perf_counter() - start) * 1000, 1))
+        if "bytes" in info:
+            record(f"{name}_bytes", info["bytes"])
+
+
+def describe_event(event):
+    """A short, payload-free summary of a Lambda event."""
+    if "httpMethod" in event:
+        return f"{event['httpMethod']} {event.get('path')}"
+    records = event.get("Records")
+    if records:
+        return f"{len(records)} {records[0].get('eventSource')} records"
+    return f"action {event.get('action')}"
+
+
+def log_event(event):
+    """Log a summary of every event and the (truncated) payload of a sample."""
+    LOGGER.info(f"Received event: {describe_event(event)}")
+    if random.random() >= EVENT_LOG_SAMPLE_RATE:
+        return
+    payload = json.dumps(event, default=str)
+    if len(payload) > EVENT_LOG_MAX_BYTES:
+        payload = f"{payload[:EVENT_LOG_MAX_BYTES]}... ({len(payload)} bytes)"
+    LOGGER.info(f"Sampled event payload: {payload}")
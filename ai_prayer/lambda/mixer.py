@@ -0,0 +1,185 @@
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+FFMPEG = os.environ.get("FFMPEG_PATH", "ffmpeg")
+BG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bg.mp3')
+BG_SAMPLE_RATE = 44100
+BG_CHANNELS = 2
+CHUNK_SIZE = 64 * 1024
+# S3 multipart parts must be at least 5 MiB (except the last one).
+PART_SIZE = 8 * 1024 * 1024
+
+_bg_lock = threading.Lock()
+
+
+def _background_pcm_path():
+    """Where the decoded BG_PATH lives: named after the file's path, size and
+    mtime, so a different or replaced background is decoded afresh."""
+    stat = os.stat(BG_PATH)
+    source = f"{os.path.abspath(BG_PATH)}:{stat.st_size}:{stat.st_mtime_ns}"
+    digest = hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"bg-{digest}-{BG_SAMPLE_RATE}-{BG_CHANNELS}.s16le")
+
+
+def background_pcm():
+    """Decode bg.mp3 once per container into a raw s16le PCM file under /tmp.
+
+    ffmpeg loops over that file for every prayer, so the MP3 is never decoded
+    again and the PCM stays hot in the page cache between invocations.
+    """
+    path = _background_pcm_path()
+    if os.path.exists(path):
+        return path
+    with _bg_lock:
+        if not os.path.exists(path):
+            partial = f"{path}.{os.getpid()}.part"
+            subprocess.run(
+                [FFMPEG, "-hide_banner", "-loglevel", "error", "-y", "-i", BG_PATH,
+                 "-f", "s16le", "-ar", str(BG_SAMPLE_RATE), "-ac", str(BG_CHANNELS), partial],
+                check=True, capture_output=True
+            )
+            os.replace(partial, path)
+            LOGGER.info(f"Decoded background music to {path} ({os.path.getsize(path)} bytes)")
+        return path
+
+
+# Matches what pydub's overlay/export produced: both tracks synced to the
+# higher sample rate and channel count.
+DEFAULT_OUTPUT_ARGS = ("-ar", str(BG_SAMPLE_RATE), "-ac", str(BG_CHANNELS))
+
+# Encodings for the mixed prayer. A prayer is one voice over quiet music, so
+# mono at speech bitrates loses little. Every format here can be produced on
+# a pipe: Opus goes in Ogg and AAC in ADTS, since MP4 needs seekable output.
+AUDIO_PROFILES = {
+    # What pydub exported: 44.1 kHz stereo CBR MP3 with ffmpeg's defaults.
+    "mp3": {
+        "format": "mp3", "extension": "mp3", "content_type": "audio/mpeg",
+        "args": DEFAULT_OUTPUT_ARGS,
+    },
+    "mp3-vbr": {
+        "format": "mp3", "extension": "mp3", "content_type": "audio/mpeg",
+        "args": ("-ar", "44100", "-ac", "1", "-c:a", "libmp3lame", "-q:a", "6"),
+    },
+    "opus": {
+        "format": "ogg", "extension": "opus", "content_type": "audio/ogg; codecs=opus",
+        "args": ("-ar", "48000", "-ac", "1", "-c:a", "libopus", "-b:a", "32k", "-application", "audio"),
+    },
+    "aac": {
+        "format": "adts", "extension": "aac", "content_type": "audio/aac",
+        "args": ("-ar", "44100", "-ac", "1", "-c:a", "aac", "-b:a", "64k"),
+    },
+}
+AUDIO_PROFILE = os.environ.get("AUDIO_PROFILE", "mp3")
+
+
+def audio_profile(name=None):
+    """Look up an encoding profile, falling back to plain MP3 for unknown names."""
+    name = name or AUDIO_PROFILE
+    if name not in AUDIO_PROFILES:
+        LOGGER.warning(f"Unknown audio profile {name}, using mp3")
+        name = "mp3"
+    return AUDIO_PROFILES[name]
+
+
+def mix_with_background(prayer_chunks, output_format="mp3", output_args=DEFAULT_OUTPUT_ARGS):
+    """Overlay the looped background under a prayer, streaming through ffmpeg.
+
+    `prayer_chunks` is an iterable of encoded audio bytes (e.g. a TTS response
+    stream); the mixed audio is yielded in chunks as ffmpeg produces it, so
+    neither side is ever held in memory as a whole.
+    """
+    command = [
+        FFMPEG, "-hide_banner", "-loglevel", "error",
+        "-i", "pipe:0",
+        "-f", "s16le", "-ar", str(BG_SAMPLE_RATE), "-ac", str(BG_CHANNELS),
+        "-stream_loop", "-1", "-i", background_pcm(),
+        # Plain sum of both tracks, like pydub's overlay, cut at the prayer's end.
+        "-filter_complex", "[0:a][1:a]amix=inputs=2:duration=first:dropout_transition=0:normalize=0",
+        *output_args,
+        "-f", output_format, "pipe:1",
+    ]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    writer_error = []
+
+    def feed():
+        try:
+            for chunk in prayer_chunks:
+                process.stdin.write(chunk)
+        except Exception as e:
+            writer_error.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+    try:
+        while True:
+            chunk = process.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        process.stdout.close()
+        writer.join()
+        returncode = process.wait()
+        stderr = process.stderr.read().decode(errors="replace")
+        process.stderr.close()
+    if writer_error:
+        raise writer_error[0]
+    if returncode != 0:
+        raise Exception(f"ffmpeg mixing failed ({returncode}): {stderr}")
+
+
+def upload_stream(s3_client, bucket, key, chunks, extra_args=None):
+    """Upload an iterable of bytes to S3 as a multipart upload, part by part.
+
+    Small outputs that never fill a part go up with a single put_object.
+    Returns the number of bytes written.
+    """
+    extra_args = extra_args or {}
+    buffer = bytearray()
+    upload_id = None
+    parts = []
+    total = 0
+    try:
+        for chunk in chunks:
+            buffer += chunk
+            total += len(chunk)
+            if len(buffer) >= PART_SIZE:
+                if upload_id is None:
+                    upload_id = s3_client.create_multipart_upload(Bucket=bucket, Key=key, **extra_args)['UploadId']
+                response = s3_client.upload_part(
+                    Bucket=bucket, Key=key, UploadId=upload_id,
+                    PartNumber=len(parts) + 1, Body=bytes(buffer)
+                )
+                parts.append({'PartNumber': len(parts) + 1, 'ETag': response['ETag']})
+                buffer.clear()
+
+        if upload_id is None:
+            s3_client.put_object(Bucket=bucket, Key=key, Body=bytes(buffer), **extra_args)
+            return total
+        if buffer:
+            response = s3_client.upload_part(
+                Bucket=bucket, Key=key, UploadId=upload_id,
+                PartNumber=len(parts) + 1, Body=bytes(buffer)
+            )
+            parts.append({'PartNumber': len(parts) + 1, 'ETag': response['ETag']})
+        s3_client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+        return total
+    except Exception:
+        if upload_id is not None:
+            s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
@@ -0,0 +1,127 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from clients import get_dynamodb
+from feelings import recent_feelings
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+dynamodb_client = get_dynamodb()
+
+PROFILES_TABLE = dynamodb_client.Table(os.environ["PROFILES_TABLE_NAME"])
+FEELINGS_TABLE = dynamodb_client.Table(os.environ["FEELINGS_TABLE_NAME"])
+PROFILE_MODEL = "gpt-4.1"
+
+OUTPUT_RULE = """
+    Output rule:
+    1. Output in JSON format with the characteristics as the key, and explanation as the value
+    """
+
+
+def build_prompt(feelings, characteristics=None):
+    joined = "\n".join(feelings)
+    if not characteristics:
+        return f"""
+    Please using five words to summarize my personal characteristics based on the following words:
+    {joined}
+    {OUTPUT_RULE}"""
+    return f"""
+    Here are five words summarizing my personal characteristics:
+    {characteristics}
+
+    Please update them with what the following new words tell about me, still using five words:
+    {joined}
+    {OUTPUT_RULE}"""
+
+
+def get_profile(email):
+    return PROFILES_TABLE.get_item(Key={"email": email}).get("Item")
+
+
+def _save_profile(email, characteristics, updated_through, entry_count, previous):
+    item = {
+        "email": email,
+        "characteristics": characteristics,
+        "updated_through": updated_through,
+        "entry_count": entry_count,
+        "updated_at": datetime.utcnow().isoformat(),
+    }
+    # Optimistic concurrency: a redelivered message folding the same entries
+    # in parallel must not clobber a newer profile.
+    if previous:
+        PROFILES_TABLE.put_item(
+            Item=item,
+            ConditionExpression="updated_through = :prev",
+            ExpressionAttributeValues={":prev": previous["updated_through"]},
+        )
+    else:
+        PROFILES_TABLE.put_item(Item=item, ConditionExpression="attribute_not_exists(email)")
+    return item
+
+
+def pending_update(email, lookback_days, rebuild=False):
+    """Work out the next profile update without calling the model.
+
+    Returns the stored profile and, if there are entries to fold in, an
+    update dict holding the prompt and what save_update needs afterwards;
+    otherwise the update is None.
+    """
+    profile = get_profile(email)
+    start = (datetime.utcnow() - timedelta(days=lookback_days)).isoformat()
+    since = start if rebuild or not profile else max(profile["updated_through"], start)
+    # Newest entries within the configured entry/token budget, folded in
+    # chronologically; anything older that doesn't fit is skipped for good.
+    entries = recent_feelings(FEELINGS_TABLE, email, since)[::-1]
+    if not entries:
+        return profile, None
+
+    characteristics = None if rebuild or not profile else profile["characteristics"]
+    return profile, {
+        "prompt": build_prompt([feeling for _, feeling in entries], characteristics),
+        "updated_through": entries[-1][0],
+        "entry_count": len(entries) if characteristics is None else int(profile.get("entry_count", 0)) + len(entries),
+        "previous_through": profile["updated_through"] if profile else None,
+    }
+
+
+def save_update(email, characteristics, update):
+    """Store the model's answer to a pending_update prompt."""
+    previous = {"updated_through": update["previous_through"]} if update["previous_through"] else None
+    try:
+        return _save_profile(email, characteristics, update["updated_through"], update["entry_count"], previous)
+    except PROFILES_TABLE.meta.client.exceptions.ConditionalCheckFailedException:
+        LOGGER.info(f"Profile for {email} was updated concurrently, using the stored one")
+        return get_profile(email)
+
+
+def _apply_update(openai_client, email, update):
+    LOGGER.info(f'prompt: {update["prompt"]}')
+    response = openai_client.responses.create(
+        model=PROFILE_MODEL,
+        input=update["prompt"]
+    )
+    return save_update(email, response.output[0].content[0].text, update)
+
+
+def update_profile(openai_client, email, lookback_days, rebuild=False):
+    """Fold journal entries written since the last update into the stored profile.
+
+    With `rebuild`, the profile is recomputed from the most recent entries of
+    the lookback window. Returns the updated profile item; without new entries
+    that is the stored profile, unchanged (None if the user has none yet).
+    """
+    profile, update = pending_update(email, lookback_days, rebuild)
+    if update is None:
+        return profile
+    return _apply_update(openai_client, email, update)
+
+
+def rebuild_profile(openai_client, email, lookback_days):
+    """Recompute a profile from the lookback window. Returns False, leaving
+    the stored profile alone, when there are no entries to rebuild it from."""
+    _, update = pending_update(email, lookback_days, rebuild=True)
+    if update is None:
+        return False
+    _apply_update(openai_client, email, update)
+    return True
@@ -0,0 +1,94 @@
+import os
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import emit
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+SQS_BATCH_SIZE = 10  # hard limit of SendMessageBatch
+DISPATCH_WORKERS = int(os.environ.get("DISPATCH_WORKERS", "8"))
+DISPATCH_MAX_ATTEMPTS = int(os.environ.get("DISPATCH_MAX_ATTEMPTS", "4"))
+
+
+def _batches(bodies, size=SQS_BATCH_SIZE):
+    batch = []
+    for body in bodies:
+        batch.append(body)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _send_batch(sqs_client, queue_url, batch, max_attempts):
+    """Send one batch, retrying only the entries SQS reports as failed.
+
+    Returns (sent, failed, retries).
+    """
+    entries = {str(i): body for i, body in enumerate(batch)}
+    dropped = 0
+    retries = 0
+    for attempt in range(max_attempts):
+        if attempt:
+            retries += len(entries)
+            time.sleep(min(2 ** attempt * 0.1, 2) * random.uniform(0.5, 1.5))
+        try:
+            response = sqs_client.send_message_batch(
+                QueueUrl=queue_url,
+                Entries=[{'Id': entry_id, 'MessageBody': body} for entry_id, body in entries.items()]
+            )
+        except Exception as e:
+            LOGGER.warning(f"send_message_batch failed on attempt {attempt + 1}: {e}")
+            continue
+        remaining = {}
+        for failure in response.get('Failed', []):
+            # Sender faults (e.g. a malformed body) will never succeed on retry.
+            if failure.get('SenderFault'):
+                LOGGER.error(f"Dropping message {entries[failure['Id']]}: {failure.get('Message')}")
+                dropped += 1
+            else:
+                remaining[failure['Id']] = entries[failure['Id']]
+        entries = remaining
+        if not entries:
+            break
+    failed = dropped + len(entries)
+    return len(batch) - failed, failed, retries
+
+
+def send_batched(sqs_client, queue_url, bodies, max_workers=None, max_attempts=None):
+    """Fan message bodies out with SendMessageBatch through a bounded worker pool.
+
+    `bodies` may be any iterable (e.g. a streaming user scan); at most
+    2 * max_workers batches are buffered at a time. Returns throughput metrics.
+    """
+    max_workers = max_workers or DISPATCH_WORKERS
+    max_attempts = max_attempts or DISPATCH_MAX_ATTEMPTS
+    metrics = {'sent': 0, 'failed': 0, 'retries': 0, 'batches': 0}
+    lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(max_workers * 2)
+
+    def worker(batch):
+        try:
+            sent, failed, retries = _send_batch(sqs_client, queue_url, batch, max_attempts)
+            with lock:
+                metrics['sent'] += sent
+                metrics['failed'] += failed
+                metrics['retries'] += retries
+                metrics['batches'] += 1
+        finally:
+            in_flight.release()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch in _batches(bodies):
+            in_flight.acquire()
+            executor.submit(worker, batch)
+    metrics['seconds'] = round(time.perf_counter() - start, 3)
+    metrics['per_second'] = round(metrics['sent'] / metrics['seconds'], 1) if metrics['seconds'] else 0.0
+    emit("sqs-fan-out", metrics)
+    return metrics
@@ -0,0 +1,108 @@
+import io
+import os
+import re
+import time
+import wave
+import logging
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from metrics import emit
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+TTS_CHUNK_CHARS = int(os.environ.get("TTS_CHUNK_CHARS", "600"))
+TTS_WORKERS = int(os.environ.get("TTS_WORKERS", "4"))
+# Silence put between stitched chunks, replacing whatever each chunk had.
+PARAGRAPH_GAP_MS = int(os.environ.get("TTS_PARAGRAPH_GAP_MS", "700"))
+SENTENCE_GAP_MS = int(os.environ.get("TTS_SENTENCE_GAP_MS", "250"))
+# OpenAI's `pcm` response format: 24 kHz, 16-bit signed little-endian, mono.
+PCM_SAMPLE_RATE = 24000
+PCM_SAMPLE_WIDTH = 2
+# Samples quieter than this count as silence when trimming chunk edges.
+SILENCE_THRESHOLD = 500
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_text(text, max_chars=None):
+    """Split text into (chunk, gap_ms) pairs at paragraph, then sentence, boundaries.
+
+    Paragraphs are kept whole when they fit in `max_chars`; longer ones are
+    cut between sentences. `gap_ms` is the pause to put before the chunk.
+    """
+    max_chars = max_chars or TTS_CHUNK_CHARS
+    chunks = []
+    for paragraph in re.split(r"\n\s*\n", text.strip()):
+        paragraph = " ".join(paragraph.split())
+        if not paragraph:
+            continue
+        gap = PARAGRAPH_GAP_MS if chunks else 0
+        current = ""
+        for sentence in _SENTENCE_END.split(paragraph):
+            if current and len(current) + 1 + len(sentence) > max_chars:
+                chunks.append((current, gap))
+                gap = SENTENCE_GAP_MS
+                current = sentence
+            else:
+                current = f"{current} {sentence}" if current else sentence
+        if current:
+            chunks.append((current, gap))
+    return chunks
+
+
+def trim_silence(pcm):
+    """Drop leading and trailing near-silent samples from 16-bit PCM."""
+    samples = array("h")
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % PCM_SAMPLE_WIDTH])
+    start, end = 0, len(samples)
+    while start < end and abs(samples[start]) < SILENCE_THRESHOLD:
+        start += 1
+    while end > start and abs(samples[end - 1]) < SILENCE_THRESHOLD:
+        end -= 1
+    return samples[start:end].tobytes()
+
+
+def _silence(ms):
+    return b"\0" * (PCM_SAMPLE_RATE * ms // 1000 * PCM_SAMPLE_WIDTH)
+
+
+def synthesize_chunked(openai_client, text, **speech_args):
+    """Synthesize `text` chunk by chunk in parallel and stitch it into one WAV.
+
+    Every chunk is rendered as raw PCM with the same speech arguments, trimmed
+    of its own edge silence and joined with fixed paragraph/sentence gaps.
+    Raises if any chunk fails, so callers can fall back to a single call.
+    """
+    chunks = split_text(text)
+
+    def render(index, chunk):
+        start = time.perf_counter()
+        response = openai_client.audio.speech.create(input=chunk, response_format="pcm", **speech_args)
+        pcm = trim_silence(response.content)
+        return {
+            "chunk": index,
+            "chars": len(chunk),
+            "bytes": len(pcm),
+            "seconds": round(time.perf_counter() - start, 3),
+        }, pcm
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(TTS_WORKERS, len(chunks)))) as executor:
+        results = list(executor.map(render, range(len(chunks)), [chunk for chunk, _ in chunks]))
+    elapsed = time.perf_counter() - start
+
+    output = io.BytesIO()
+    with wave.open(output, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(PCM_SAMPLE_WIDTH)
+        wav.setframerate(PCM_SAMPLE_RATE)
+        for (_, gap), (_, pcm) in zip(chunks, results):
+            wav.writeframes(_silence(gap))
+            wav.writeframes(pcm)
+
+    latencies = [stats for stats, _ in results]
+    emit("tts-chunked", {"chunks": len(chunks), "render_seconds": round(elapsed, 3),
+                         "max_chunk_seconds": max(stats["seconds"] for stats in latencies)},
+         {"per_chunk": latencies})
+    return output.getvalue()
@@ -1,66 +1,116 @@
 import os
+import csv
+import io
 import boto3
+import tempfile
 from datetime import datetime, timedelta
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
 
 # Environment Variables
 USERS_TABLE_NAME = os.environ['USERS_TABLE_NAME']
 ADMIN_EMAIL = os.environ['ADMIN_EMAIL']
 SEND_EMAIL = os.environ['SEND_EMAIL']
+# GSI keyed on verification_state + subscribed_at. Leave empty to fall back
+# to a filtered scan (e.g. before the existing users have been backfilled).
+VERIFICATION_STATE_INDEX = os.environ.get('VERIFICATION_STATE_INDEX', '')
+REPORT_AFTER_HOURS = int(os.environ.get('REPORT_AFTER_HOURS', '24'))
+# Reports with more users than this list them in a CSV attachment only.
+INLINE_LIMIT = int(os.environ.get('REPORT_INLINE_LIMIT', '50'))
+# Keep the CSV in memory up to this size before spilling to /tmp.
+SPOOL_MAX_SIZE = 1024 * 1024
 
 # AWS Clients
 dynamodb = boto3.resource('dynamodb')
 ses = boto3.client('ses')
 
-def handler(event, context):
-    users_table = dynamodb.Table(USERS_TABLE_NAME)
-    
-    # Scan for users who are not verified
-    response = users_table.scan(
-        FilterExpression='verified = :v',
-        ExpressionAttributeValues={':v': False}
-    )
-    
-    unverified_users = response.get('Items', [])
-    
-    # Filter for users who signed up more than 24 hours ago
-    reportable_users = []
-    for user in unverified_users:
-        subscribed_at_str = user.get('subscribed_at')
-        if subscribed_at_str:
-            subscribed_at = datetime.fromisoformat(subscribed_at_str)
-            if datetime.utcnow() - subscribed_at > timedelta(hours=24):
-                reportable_users.append(user['email'])
 
-    if not reportable_users:
-        print("No unverified users older than 24 hours found.")
-        return {
-            'statusCode': 200,
-            'body': 'No reportable users.'
-        }
+def unverified_users(users_table, cutoff):
+    """Yield (email, subscribed_at) of unverified users who signed up before `cutoff`."""
+    if VERIFICATION_STATE_INDEX:
+        operation = users_table.query
+        kwargs = dict(
+            IndexName=VERIFICATION_STATE_INDEX,
+            KeyConditionExpression='verification_state = :s AND subscribed_at < :c',
+            ExpressionAttributeValues={':s': 'unverified', ':c': cutoff}
+        )
+    else:
+        operation = users_table.scan
+        # Same users as the index: unsubscribed ones have state 'unsubscribed' there.
+        kwargs = dict(
+            FilterExpression='verified = :v AND subscribed_at < :c AND attribute_not_exists(unsubscribed_at)',
+            ExpressionAttributeValues={':v': False, ':c': cutoff}
+        )
+    while True:
+        response = operation(**kwargs)
+        for user in response.get('Items', []):
+            yield user['email'], user['subscribed_at']
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
 
-    # Send email report to admin
-    subject = "Daily Report: Unverified Users on AI Prayer Companion"
+def build_report(csv_file, total, inline_emails):
+    message = MIMEMultipart()
+    message['Subject'] = "Daily Report: Unverified Users on AI Prayer Companion"
+    message['From'] = SEND_EMAIL
+    message['To'] = ADMIN_EMAIL
+    if inline_emails is None:
+        listing = "<p>The full list is attached as unverified_users.csv.</p>"
+    else:
+        listing = f"<ul>{''.join([f'<li>{email}</li>' for email in inline_emails])}</ul>"
     body_html = f"""
     <h3>Unverified User Report</h3>
-    <p>The following users signed up more than 24 hours ago but have not verified their email address:</p>
-    <ul>
-        {''.join([f'<li>{email}</li>' for email in reportable_users])}
-    </ul>
-    <p>Total: {len(reportable_users)}</p>
+    <p>The following users signed up more than {REPORT_AFTER_HOURS} hours ago but have not verified their email address:</p>
+    {listing}
+    <p>Total: {total}</p>
     """
-    
-    ses.send_email(
+    message.attach(MIMEText(body_html, 'html'))
+
+    csv_file.seek(0)
+    attachment = MIMEApplication(csv_file.read(), _subtype='csv')
+    attachment.add_header('Content-Disposition', 'attachment', filename='unverified_users.csv')
+    message.attach(attachment)
+    return message
+
+
+def handler(event, context):
+    users_table = dynamodb.Table(USERS_TABLE_NAME)
+    cutoff = (datetime.utcnow() - timedelta(hours=REPORT_AFTER_HOURS)).isoformat()
+
+    # Stream rows straight into the CSV instead of collecting the users first.
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+        text = io.TextIOWrapper(spool, encoding='utf-8', newline='')
+        writer = csv.writer(text)
+        writer.writerow(['email', 'subscribed_at'])
+        total = 0
+        inline_emails = []
+        for email, subscribed_at in unverified_users(users_table, cutoff):
+            writer.writerow([email, subscribed_at])
+            total += 1
+            if total <= INLINE_LIMIT:
+                inline_emails.append(email)
+        text.detach()
+
+        if not total:
+            print(f"No unverified users older than {REPORT_AFTER_HOURS} hours found.")
+            return {
+                'statusCode': 200,
+                'body': 'No reportable users.'
+            }
+
+        message = build_report(spool, total, inline_emails if total <= INLINE_LIMIT else None)
+
+    ses.send_raw_email(
         Source=SEND_EMAIL,
-        Destination={'ToAddresses': [ADMIN_EMAIL]},
-        Message={
-            'Subject': {'Data': subject},
-            'Body': {'Html': {'Data': body_html}}
-        }
+        Destinations=[ADMIN_EMAIL],
+        RawMessage={'Data': message.as_bytes()}
     )
-    
-    print(f"Sent report for {len(reportable_users)} unverified users to {ADMIN_EMAIL}.")
-    
+
+    print(f"Sent report for {total} unverified users to {ADMIN_EMAIL}.")
+
     return {
         'statusCode': 200,
-        'body': f'Report sent for {len(reportable_users)} users.'
+        'body': f'Report sent for {total} users.'
     }
@@ -0,0 +1,255 @@
+import os
+import queue
+import itertools
+import logging
+import threading
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor
+
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# Sparse GSI that only holds verified users (keyed on `verified_at`, which is
+# removed again on unsubscribe). Leave empty to fall back to a filtered scan.
+VERIFIED_USERS_INDEX = os.environ.get("VERIFIED_USERS_INDEX", "")
+USER_SCAN_SEGMENTS = int(os.environ.get("USER_SCAN_SEGMENTS", "1"))
+# Sparse GSI on `delivery_shard`, the UTC hour of a verified user's check-in.
+DELIVERY_SHARD_INDEX = os.environ.get("DELIVERY_SHARD_INDEX", "")
+# Local time at which users get their check-in email.
+CHECK_IN_LOCAL_HOUR = int(os.environ.get("CHECK_IN_LOCAL_HOUR", "21"))
+
+_DONE = object()
+
+
+def scan_pages(table, **kwargs):
+    """Yield the items of every page of a scan, following LastEvaluatedKey."""
+    # The resource's low-level client is thread safe (the Table object is not)
+    # and still carries the high-level type (de)serialization.
+    client = table.meta.client
+    kwargs['TableName'] = table.name
+    while True:
+        response = client.scan(**kwargs)
+        for item in response.get('Items', []):
+            yield item
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return
+        kwargs['ExclusiveStartKey'] = last_key
+
+
+def query_pages(table, **kwargs):
+    """Yield the items of every page of a query, following LastEvaluatedKey."""
+    client = table.meta.client
+    kwargs['TableName'] = table.name
+    while True:
+        response = client.query(**kwargs)
+        for item in response.get('Items', []):
+            yield item
+        last_key = response.get('LastEvaluatedKey')
+        if not last_key:
+            return
+        kwargs['ExclusiveStartKey'] = last_key
+
+
+def parallel_scan(table, total_segments=1, **kwargs):
+    """Stream the items of a segmented scan run through a thread pool.
+
+    Items are yielded as soon as any segment returns a page, so callers never
+    hold the whole table in memory. Closing the generator early stops the
+    workers after their in-flight page.
+    """
+    if total_segments <= 1:
+        yield from scan_pages(table, **kwargs)
+        return
+
+    pages = queue.Queue(maxsize=total_segments * 2)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def scan_segment(segment):
+        try:
+            client = table.meta.client
+            params = dict(kwargs, TableName=table.name, Segment=segment, TotalSegments=total_segments)
+            while True:
+                response = client.scan(**params)
+                if not put(response.get('Items', [])):
+                    return
+                last_key = response.get('LastEvaluatedKey')
+                if not last_key:
+                    return
+                params['ExclusiveStartKey'] = last_key
+        except Exception as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        for segment in range(total_segments):
+            executor.submit(scan_segment, segment)
+        try:
+            remaining = total_segments
+            while remaining:
+                page = pages.get()
+                if page is _DONE:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield from page
+        finally:
+            stop.set()
+
+
+def iter_verified_users(table, total_segments=None):
+    """Yield every verified user, reading the sparse index when configured."""
+    if total_segments is None:
+        total_segments = USER_SCAN_SEGMENTS
+    if VERIFIED_USERS_INDEX:
+        return parallel_scan(table, total_segments, IndexName=VERIFIED_USERS_INDEX)
+    return parallel_scan(
+        table, total_segments,
+        FilterExpression="verified = :v",
+        ExpressionAttributeValues={':v': True}
+    )
+
+
+def _move_shard(table, email, shard):
+    """Store a verified user's recomputed shard. Returns False, storing
+    nothing, for a user who unsubscribed in the meantime."""
+    client = table.meta.client
+    try:
+        client.update_item(
+            TableName=table.name,
+            Key={'email': email},
+            UpdateExpression="set delivery_shard = :d",
+            ConditionExpression="verified = :v",
+            ExpressionAttributeValues={':d': shard, ':v': True}
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def claim_check_in(table, email, day):
+    """Mark a verified user's check-in for `day` as sent. Returns False, storing
+    nothing, if it already was or the user unsubscribed in the meantime."""
+    client = table.meta.client
+    try:
+        client.update_item(
+            TableName=table.name,
+            Key={'email': email},
+            UpdateExpression="set check_in_day = :d",
+            ConditionExpression="verified = :v AND (attribute_not_exists(check_in_day) OR check_in_day <> :d)",
+            ExpressionAttributeValues={':d': day, ':v': True}
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def iter_shard_users(table, shard, at=None):
+    """Yield the verified users whose check-in falls in UTC hour `shard` on
+    the day of `at` (default now).
+
+    A stored shard moves by an hour when daylight saving time starts or ends,
+    so the neighbouring shards are read too and every user's shard is
+    recomputed for `at`. Users whose shard changed are stored under the new
+    one and yielded only if it is `shard`; the run for a later hour picks up
+    the others, and the run an hour earlier already had them.
+    """
+    at = at or datetime.now(timezone.utc)
+    shards = [(shard + delta) % 24 for delta in (-1, 0, 1)]
+    if DELIVERY_SHARD_INDEX:
+        users = itertools.chain.from_iterable(query_pages(
+            table,
+            IndexName=DELIVERY_SHARD_INDEX,
+            KeyConditionExpression="delivery_shard = :s",
+            ExpressionAttributeValues={':s': stored}
+        ) for stored in shards)
+    else:
+        users = parallel_scan(
+            table, USER_SCAN_SEGMENTS,
+            FilterExpression="delivery_shard IN (:a, :b, :c)",
+            ExpressionAttributeValues={':a': shards[0], ':b': shards[1], ':c': shards[2]}
+        )
+    moved = 0
+    for user in users:
+        current = delivery_shard(user.get('tz'), at)
+        if current != user['delivery_shard']:
+            if not _move_shard(table, user['email'], current):
+                continue
+            moved += 1
+        if current == shard:
+            yield user
+    if moved:
+        LOGGER.info(f"Moved {moved} users to their current delivery shard")
+
+
+def valid_time_zone(name):
+    """Return `name` if it is a known IANA time zone, else None."""
+    if not isinstance(name, str) or not name:
+        return None
+    try:
+        ZoneInfo(name)
+        return name
+    except (ValueError, KeyError, OSError):
+        return None
+
+
+def delivery_shard(tz, now=None):
+    """The UTC hour at which CHECK_IN_LOCAL_HOUR falls in `tz` today.
+
+    Users without a (valid) time zone get UTC, which keeps them on the
+    original 21:00 UTC check-in. The hour moves with daylight saving time;
+    iter_shard_users corrects the stored shards as it reads them.
+    """
+    # timezone.utc needs no tzdata, unlike ZoneInfo("UTC").
+    zone = ZoneInfo(tz) if valid_time_zone(tz) else timezone.utc
+    now = now or datetime.now(timezone.utc)
+    local = now.astimezone(zone).replace(hour=CHECK_IN_LOCAL_HOUR, minute=0, second=0, microsecond=0)
+    return local.astimezone(timezone.utc).hour
+
+
+def verification_state(user):
+    """Derive the `verification_state` attribute from the legacy flags."""
+    if user.get('verified'):
+        return 'verified'
+    return 'unsubscribed' if user.get('unsubscribed_at') else 'unverified'
+
+
+def backfill_user_indexes(table, total_segments=None):
+    """Populate the index attributes for users created before the indexes existed."""
+    if total_segments is None:
+        total_segments = USER_SCAN_SEGMENTS
+    client = table.meta.client
+    updated = 0
+    for user in parallel_scan(table, total_segments):
+        updates = {}
+        if user.get('verified') and not user.get('verified_at'):
+            updates['verified_at'] = user.get('subscribed_at') or datetime.utcnow().isoformat()
+        if not user.get('verification_state'):
+            updates['verification_state'] = verification_state(user)
+        if user.get('verified'):
+            shard = delivery_shard(user.get('tz'))
+            if user.get('delivery_shard') != shard:
+                updates['delivery_shard'] = shard
+        if not updates:
+            continue
+        client.update_item(
+            TableName=table.name,
+            Key={'email': user['email']},
+            UpdateExpression="set " + ", ".join(f"{name} = :{name}" for name in updates),
+            ExpressionAttributeValues={f":{name}": value for name, value in updates.items()}
+        )
+        updated += 1
+    LOGGER.info(f"Backfilled index attributes for {updated} users")
+    return updated
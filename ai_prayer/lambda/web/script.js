@@ -20,7 +20,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 headers: {
                     'Content-Type': 'application/json'
                 },
-                body: JSON.stringify({ email: email })
+                body: JSON.stringify({ email: email, tz: Intl.DateTimeFormat().resolvedOptions().timeZone })
             })
             .then(response => {
                 if (!response.ok) {
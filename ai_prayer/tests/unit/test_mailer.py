@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+import threading
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "lambda"))
+
+from mailer import TokenBucket, SES_BULK_MAX_DESTINATIONS, send_bulk_templated  # noqa: E402
+
+
+def test_bulk_acquire_charges_every_destination():
+    # Smaller than a bulk send, which used to be charged only `rate` tokens.
+    rate = 40
+    bucket = TokenBucket(rate)
+    bulks = 3
+    sent = []
+    start = time.monotonic()
+    for _ in range(bulks):
+        bucket.acquire(SES_BULK_MAX_DESTINATIONS)
+        sent.append(SES_BULK_MAX_DESTINATIONS)
+    elapsed = time.monotonic() - start
+
+    # The bucket starts full, so `rate` sends are free; the rest pay full price.
+    assert elapsed >= (sum(sent) - rate) / rate * 0.95
+    assert (sum(sent) - rate) / elapsed <= rate * 1.05
+
+
+def test_concurrent_acquire_stays_within_rate():
+    rate = 30
+    bucket = TokenBucket(rate)
+    start = time.monotonic()
+    threads = [threading.Thread(target=bucket.acquire, args=(SES_BULK_MAX_DESTINATIONS,)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    assert (2 * SES_BULK_MAX_DESTINATIONS - rate) / elapsed <= rate * 1.05
+
+
+def test_only_transient_statuses_are_retried():
+    ses_client = mock.Mock()
+    ses_client.exceptions.ClientError = Exception
+    ses_client.send_bulk_templated_email.side_effect = [
+        {'Status': [{'Status': 'Success'}, {'Status': 'Failed'}, {'Status': 'TransientFailure'}]},
+        {'Status': [{'Status': 'Success'}]},
+    ]
+    destinations = [(f"user{i}@example.com", {}) for i in range(3)]
+
+    with mock.patch("mailer.emit"), mock.patch("mailer.time.sleep"):
+        metrics = send_bulk_templated(ses_client, "from@example.com", "Template", destinations, TokenBucket(1000))
+
+    retried = ses_client.send_bulk_templated_email.call_args_list[1].kwargs['Destinations']
+    assert [d['Destination']['ToAddresses'] for d in retried] == [["user2@example.com"]]
+    assert (metrics['sent'], metrics['failed'], metrics['throttled']) == (2, 1, 1)
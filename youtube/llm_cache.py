@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# Set LLM_CACHE_PATH to an empty string to keep the cache in memory only.
+LLM_CACHE_PATH = os.environ.get('LLM_CACHE_PATH', os.path.expanduser('~/.cache/youtube/llm_cache.sqlite3'))
+LLM_CACHE_MEMORY_ENTRIES = int(os.environ.get('LLM_CACHE_MEMORY_ENTRIES', '256'))
+LLM_CACHE_TTL_SECONDS = int(os.environ.get('LLM_CACHE_TTL_SECONDS', str(30 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.environ.get('LLM_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+
+def cache_key(*parts):
+    """Content address of a model call: a hash over everything that shapes the answer."""
+    return hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+
+
+class SQLiteBackend:
+    """Disk tier. Any object with the same get/put/discard methods can stand in."""
+
+    def __init__(self, path, ttl=LLM_CACHE_TTL_SECONDS, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'key TEXT PRIMARY KEY, value TEXT, size INTEGER, created_at REAL, accessed_at REAL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT value FROM responses WHERE key = ? AND created_at > ?', (key, now - self.ttl)
+            ).fetchone()
+            if row:
+                self.conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+        return row[0] if row else None
+
+    def put(self, key, value):
+        """Store `value`, then drop expired entries and, past `max_bytes`, the
+        least recently read ones. Returns how many entries were evicted."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                (key, value, len(value.encode('utf-8')), now, now)
+            )
+            evicted = self.conn.execute('DELETE FROM responses WHERE created_at <= ?', (now - self.ttl,)).rowcount
+            total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if total > self.max_bytes:
+                for old_key, size in self.conn.execute(
+                    'SELECT key, size FROM responses ORDER BY accessed_at'
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self.conn.execute('DELETE FROM responses WHERE key = ?', (old_key,))
+                    total -= size
+                    evicted += 1
+        return evicted
+
+    def discard(self, key):
+        with self.lock:
+            self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+
+
+class LLMCache:
+    """Two-tier response cache: an in-process LRU in front of a disk backend."""
+
+    def __init__(self, backend=None, memory_entries=LLM_CACHE_MEMORY_ENTRIES, ttl=LLM_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.memory_entries = memory_entries
+        self.ttl = ttl
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'puts': 0, 'evictions': 0}
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def _remember(self, key, value, created_at):
+        with self.lock:
+            self.memory[key] = (value, created_at)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+    def get(self, key, count_miss=True):
+        """The cached value or None. Pass count_miss=False for a look ahead
+        of a get that will count the miss itself."""
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry and entry[1] > time.time() - self.ttl:
+                self.memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return entry[0]
+        value = self.backend.get(key) if self.backend else None
+        if value is None:
+            if count_miss:
+                self._count('misses')
+            return None
+        self._count('disk_hits')
+        self._remember(key, value, time.time())
+        return value
+
+    def put(self, key, value):
+        self._remember(key, value, time.time())
+        self._count('puts')
+        if self.backend:
+            self._count('evictions', self.backend.put(key, value))
+
+    def discard(self, key):
+        with self.lock:
+            self.memory.pop(key, None)
+        if self.backend:
+            self.backend.discard(key)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+def _default_backend():
+    if not LLM_CACHE_PATH:
+        return None
+    try:
+        return SQLiteBackend(LLM_CACHE_PATH)
+    except (OSError, sqlite3.Error) as e:
+        LOGGER.warning(f'LLM cache at {LLM_CACHE_PATH} unavailable, caching in memory only: {e}')
+        return None
+
+
+LLM_CACHE = LLMCache(_default_backend())
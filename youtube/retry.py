@@ -0,0 +1,129 @@
+import os
+import time
+import random
+import logging
+import threading
+LOGGER = logging.getLogger()
+LOGGER.setLevel(logging.INFO)
+
+# Client-side limit for Bedrock calls across every thread of the process.
+BEDROCK_REQUESTS_PER_SECOND = float(os.environ.get('BEDROCK_REQUESTS_PER_SECOND', '2'))
+BEDROCK_BURST = int(os.environ.get('BEDROCK_BURST', '4'))
+# Attempts per call, throttled ones included, and the backoff between them.
+BEDROCK_MAX_ATTEMPTS = int(os.environ.get('BEDROCK_MAX_ATTEMPTS', '5'))
+BEDROCK_BACKOFF_BASE = float(os.environ.get('BEDROCK_BACKOFF_BASE', '2'))
+BEDROCK_BACKOFF_MAX = float(os.environ.get('BEDROCK_BACKOFF_MAX', '60'))
+
+# Errors that mean Bedrock is over capacity, so the limiter should back off.
+# Compared in lower case: the response stream's EventStreamError spells them
+# throttlingException, serviceUnavailableException and so on.
+THROTTLING_CODES = ('throttlingexception', 'toomanyrequestsexception', 'servicequotaexceededexception',
+                    'serviceunavailableexception', 'modeltimeoutexception')
+
+
+def is_throttle(e):
+    code = getattr(e, 'response', {}).get('Error', {}).get('Code', '').lower()
+    message = str(e).lower()
+    return code in THROTTLING_CODES or any(name in message for name in THROTTLING_CODES)
+
+
+class TokenBucket:
+    """Thread-safe token bucket. `rate` adapts: it is cut on every throttle
+    and creeps back up towards `max_rate` while calls succeed."""
+
+    def __init__(self, rate, burst, min_rate=0.1):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Take a token, blocking until one is free. Returns the seconds waited."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def throttled(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            # Drop the saved-up burst so the callers queued behind us slow down too.
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class Retrier:
+    """Runs calls through a shared TokenBucket, retrying failures with
+    exponential backoff and full jitter until `max_attempts` is used up."""
+
+    def __init__(self, bucket, max_attempts=BEDROCK_MAX_ATTEMPTS, backoff_base=BEDROCK_BACKOFF_BASE,
+                 backoff_max=BEDROCK_BACKOFF_MAX):
+        self.bucket = bucket
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lock = threading.Lock()
+        self.metrics = {
+            'calls': 0,
+            'attempts': 0,
+            'throttles': 0,
+            'errors': 0,
+            'failures': 0,
+            'limiter_wait_seconds': 0.0,
+            'backoff_seconds': 0.0,
+        }
+
+    def _count(self, **deltas):
+        with self.lock:
+            for name, value in deltas.items():
+                self.metrics[name] += value
+
+    def stats(self):
+        """A snapshot of the counters, plus the limiter's current rate."""
+        with self.lock:
+            return dict(self.metrics, requests_per_second=round(self.bucket.rate, 3))
+
+    def call(self, fn, *args, **kwargs):
+        """Return `fn(*args, **kwargs)`, re-raising its last error once every
+        attempt has failed."""
+        self._count(calls=1)
+        for attempt in range(self.max_attempts):
+            self._count(attempts=1, limiter_wait_seconds=self.bucket.acquire())
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if is_throttle(e):
+                    self.bucket.throttled()
+                    self._count(throttles=1)
+                else:
+                    self._count(errors=1)
+                if attempt + 1 == self.max_attempts:
+                    self._count(failures=1)
+                    LOGGER.error(f'{getattr(fn, "__name__", fn)} failed after {self.max_attempts} attempts: {e}')
+                    raise
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                LOGGER.warning(f'{getattr(fn, "__name__", fn)} attempt {attempt + 1} failed, retrying in {delay:.1f}s: {e}')
+                self._count(backoff_seconds=delay)
+                time.sleep(delay)
+                continue
+            self.bucket.succeeded()
+            return result
+
+
+BEDROCK = Retrier(TokenBucket(BEDROCK_REQUESTS_PER_SECOND, BEDROCK_BURST))
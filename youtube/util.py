@@ -3,9 +3,11 @@ import re
 import copy
 import json
 #import fitz
-import time
 import base64
 import logging
+from extract import extract_json, extract_markdown
+from retry import BEDROCK
+from llm_cache import LLM_CACHE, cache_key
 #import pymupdf
 #from prompt import REQ_ANALYZE, MD_EXTRACT, META_INFO_EXTRACT, PROOFREADING_PROMPT, DOUBLE_CHECK_PROMPT
 LOGGER = logging.getLogger()
@@ -52,26 +54,13 @@ def pdf_to_image(pdf_path, output_dir, dpi=700):
 
 
 def image_to_md(image_path, client, model_id, model_type):
-    retry_cnt = 3
-    md_content = ''
-    while retry_cnt > 0:
-        try:
-            md_content = image_to_md_chat(image_path, client, model_id, model_type)
-            if not md_content:
-                # for unittest only
-                return ''
-        except Exception as e:
-            if 'ThrottlingException' in str(e):
-                time.sleep(10)
-                LOGGER.error(e)
-                continue
-            LOGGER.error(e)
-            time.sleep(10)
-            retry_cnt -= 1
-            continue
-        break
+    try:
+        md_content = image_to_md_chat(image_path, client, model_id, model_type)
+    except Exception as e:
+        raise Exception("image to md exception!") from e
     if not md_content:
-        raise Exception("image to md exception!")
+        # for unittest only
+        return ''
     md_name = os.path.basename(image_path).rsplit('.', 1)[0] + '.md'
     md_path = os.path.join(os.path.dirname(image_path), md_name)
     with open(md_path, 'w') as fp:
@@ -81,20 +70,9 @@ def image_to_md(image_path, client, model_id, model_type):
 
 def format_result(content, type='json'):
     if type == 'json':
-        pattern = r'(?P<quote>["\'`]{3})json\s*(?P<json>(\{.*?\}|\[.*?\]))\s*(?P=quote)'
-        match = re.search(pattern, content, re.DOTALL)
-        if match:
-            json_str = match.group("json")
-            return json.loads(json_str)
-        else:
-            return json.loads(content)
+        return extract_json(content)
     elif type == 'markdown':
-        pattern = r'(?P<quote>["\'`]{3})markdown\s+(.*?)(?P=quote)'
-        match = re.search(pattern, content, re.DOTALL)
-        if match:
-            return match.group(2)
-        else:
-            return content
+        return extract_markdown(content)
 
 
 def image_to_md_chat(image_path, client, model_id, model_type, max_tokens=20000):
@@ -102,11 +80,77 @@ def image_to_md_chat(image_path, client, model_id, model_type, max_tokens=20000)
         image_bytes = image_file.read()
         image_base64 = base64.b64encode(image_bytes).decode('utf-8')
 
-    md_content = invoke_model(client, model_id, MD_EXTRACT, attachment=image_base64, model_type=model_type)
-    return format_result(md_content, type='markdown')
+    return call_model_parsed(client, model_id, MD_EXTRACT, type='markdown', max_tokens=max_tokens,
+                             attachment=image_base64, model_type=model_type)
 
 
-def invoke_model(client, model_id, prompt, max_tokens=20000, attachment=None, model_type='mistral', temperature=0.9):
+def _stream_chunks(response):
+    """Decode the JSON chunks of an invoke_model_with_response_stream response."""
+    for event in response['body']:
+        if 'chunk' in event:
+            yield json.loads(event['chunk']['bytes'])
+
+
+def _converse_text(response):
+    """Yield the text deltas of a converse_stream response."""
+    for event in response['stream']:
+        delta = event.get('contentBlockDelta', {}).get('delta', {})
+        if 'text' in delta:
+            yield delta['text']
+
+
+def _call_key(model_id, prompt, max_tokens=20000, attachment=None, model_type='mistral', temperature=0.9):
+    return cache_key(model_id, model_type, prompt, attachment, temperature, max_tokens)
+
+
+def invoke_model(client, model_id, prompt, max_tokens=20000, attachment=None, model_type='mistral', temperature=0.9,
+                 cache=True):
+    """Call the model and return the whole completion once it has finished.
+
+    Answers are cached on everything that shapes them, so re-running the same
+    prompt costs no model time. Pass cache=False where a fresh sample is wanted.
+    """
+    key = _call_key(model_id, prompt, max_tokens, attachment, model_type, temperature) if cache else None
+    if key:
+        cached = LLM_CACHE.get(key)
+        if cached is not None:
+            return cached
+    content = "".join(invoke_model_stream(client, model_id, prompt, max_tokens=max_tokens, attachment=attachment,
+                                          model_type=model_type, temperature=temperature))
+    if key and content:
+        LLM_CACHE.put(key, content)
+    return content
+
+
+def invoke_model_parsed(client, model_id, prompt, type='json', **kwargs):
+    """invoke_model followed by format_result. An answer that does not parse
+    is dropped from the cache, so a retry asks the model again."""
+    content = invoke_model(client, model_id, prompt, **kwargs)
+    try:
+        return format_result(content, type=type)
+    except Exception:
+        LOGGER.info('unparseable output:%s', content)
+        LLM_CACHE.discard(_call_key(model_id, prompt, **{k: v for k, v in kwargs.items() if k != 'cache'}))
+        raise
+
+
+def call_model_parsed(client, model_id, prompt, type='json', **kwargs):
+    """invoke_model_parsed through the BEDROCK retrier and rate limiter.
+    A cached answer is returned straight away, without taking a token."""
+    if kwargs.get('cache', True):
+        key = _call_key(model_id, prompt, **{k: v for k, v in kwargs.items() if k != 'cache'})
+        content = LLM_CACHE.get(key, count_miss=False)
+        if content is not None:
+            try:
+                return format_result(content, type=type)
+            except Exception:
+                LLM_CACHE.discard(key)
+    return BEDROCK.call(invoke_model_parsed, client, model_id, prompt, type=type, **kwargs)
+
+
+def invoke_model_stream(client, model_id, prompt, max_tokens=20000, attachment=None, model_type='mistral', temperature=0.9):
+    """Yield the completion's text as the model generates it, so callers can
+    start on the output before the last token arrives."""
     if model_type == 'mistral':
         payload = {
             "messages" : [
@@ -131,12 +175,16 @@ def invoke_model(client, model_id, prompt, max_tokens=20000, attachment=None, mo
                 }
             })
         body = json.dumps(payload)
-        response = client.invoke_model(
+        response = client.invoke_model_with_response_stream(
             modelId=model_id,
             body=body
         )
-        response_body = json.loads(response['body'].read())
-        return response_body['choices'][0]['message']['content']
+        for chunk in _stream_chunks(response):
+            for choice in chunk.get('choices', []):
+                # Streamed choices carry the new text under `message` (or `delta`).
+                text = (choice.get('message') or choice.get('delta') or {}).get('content')
+                if text:
+                    yield text
     elif model_type == 'claude':
         payload = {
             "anthropic_version": "bedrock-2023-05-31",
@@ -164,17 +212,15 @@ def invoke_model(client, model_id, prompt, max_tokens=20000, attachment=None, mo
                 }
             })
         # LOGGER.info('input payload:%s', json.dumps(payload))
-        response = client.invoke_model(
+        response = client.invoke_model_with_response_stream(
             modelId=model_id,
             contentType='application/json',
             accept='application/json',
             body=json.dumps(payload)
         )
-
-        response_body = json.loads(response['body'].read())
-        response_content = response_body.pop('content')
-        print(response_body)
-        return response_content[0]['text']
+        for chunk in _stream_chunks(response):
+            if chunk.get('type') == 'content_block_delta' and chunk['delta'].get('type') == 'text_delta':
+                yield chunk['delta']['text']
     elif model_type == 'deepseek':
         # DEEPSEEK invoke_model does not return the text response and reasoning process in one block text!!!
         # # Embed the prompt in DeepSeek-R1's instruction format.
@@ -196,7 +242,7 @@ def invoke_model(client, model_id, prompt, max_tokens=20000, attachment=None, mo
         # choices = model_response["choices"]
         # return choices[0]['text']
         
-        response = client.converse(
+        response = client.converse_stream(
             modelId=model_id,
             messages=[
                 {
@@ -213,55 +259,31 @@ def invoke_model(client, model_id, prompt, max_tokens=20000, attachment=None, mo
                 'temperature': temperature
             }
         )
-        response_content = response['output']['message'].pop('content')
-        print(response)
-        return response_content[0]['text']
+        # R1's reasoning arrives as separate reasoningContent deltas and is dropped.
+        yield from _converse_text(response)
 
 
 def requirement_analyze(req, md_path, client, model_id, model_type) -> json:
     with open(md_path, 'r') as fp:
         content = fp.read()
     prompt = REQ_ANALYZE.replace("{req}", req).replace("{content}", content)
-    retry_cnt = 3
-    while retry_cnt > 0:
-        try:
-            content = invoke_model(client, model_id, prompt, model_type=model_type)
-            LOGGER.info('output:%s', content)
-            return format_result(content)
-        except Exception as e:
-            if 'ThrottlingException' in str(e):
-                time.sleep(10)
-                LOGGER.error(e)
-                continue
-            LOGGER.error(e)
-            time.sleep(10)
-            retry_cnt -= 1
-            continue
-    return {
-        'result': '',
-        'rationale': ''
-    }
+    try:
+        return call_model_parsed(client, model_id, prompt, model_type=model_type)
+    except Exception:
+        return {
+            'result': '',
+            'rationale': ''
+        }
 
 
 def meta_info_extract(md_path, client, model_id):
     with open(md_path, 'r') as fp:
         content = fp.read()
     prompt = META_INFO_EXTRACT.replace("{content}", content)
-    retry_cnt = 3
-    while retry_cnt > 0:
-        try:
-            content = invoke_model(client, model_id, prompt, model_type='deepseek')
-            return format_result(content)
-        except Exception as e:
-            if 'ThrottlingException' in str(e):
-                time.sleep(10)
-                LOGGER.error(e)
-                continue
-            LOGGER.error(e)
-            time.sleep(10)
-            retry_cnt -= 1
-            continue
-    raise Exception("get meta info failed!")
+    try:
+        return call_model_parsed(client, model_id, prompt, model_type='deepseek')
+    except Exception as e:
+        raise Exception("get meta info failed!") from e
 
 
 def proofreading_analyze(req_desc, random_hash, para_path, client, model_id, model_type='deepseek'):
@@ -284,23 +306,11 @@ def proofreading_analyze(req_desc, random_hash, para_path, client, model_id, mod
         content = fp.read()
     
     prompt = PROOFREADING_PROMPT.replace("{req}", req_desc).replace("{content}", content)
-    retry_cnt = 3
-    model_result = []
-    while retry_cnt > 0:
-        try:
-            model_result = invoke_model(client, model_id, prompt, model_type=model_type, temperature=0.1)
-            model_result = format_result(model_result)
-            break
-        except Exception as e:
-            if 'ThrottlingException' in str(e):
-                time.sleep(10)
-                LOGGER.error(e)
-                continue
-            LOGGER.error(e)
-            time.sleep(10)
-            retry_cnt -= 1
-            continue
-    
+    try:
+        model_result = call_model_parsed(client, model_id, prompt, model_type=model_type, temperature=0.1)
+    except Exception:
+        model_result = []
+
     model_result2 = copy.deepcopy(model_result)
     if model_result:
         model_result2 = filter_out_result(prompt, model_result, keys=['finding', 'correction', 'rationale'], key_pair=('finding', 'correction'), org_key='finding')
@@ -340,24 +350,11 @@ def filter_out_result(prompt, result, keys=[], key_pair=None, org_key=''):
 
 def double_check_result(model_result, req_desc, client, model_id, model_type='deepseek'):
     prompt = DOUBLE_CHECK_PROMPT.replace("{req}", req_desc).replace("{content}", json.dumps(model_result))
-    retry_cnt = 3
-    model_result2 = []
-    while retry_cnt > 0:
-        try:
-            model_result2 = invoke_model(client, model_id, prompt, model_type=model_type, temperature=0.1)
-            return format_result(model_result2)
-        except Exception as e:
-            if 'ThrottlingException' in str(e):
-                time.sleep(10)
-                LOGGER.error(e)
-                continue
-            LOGGER.info('model_result2:%s', json.dumps(model_result2))
-            LOGGER.error(e)
-            time.sleep(10)
-            retry_cnt -= 1
-            continue
-    LOGGER.error("double_check_result retry failed!")
-    return model_result
+    try:
+        return call_model_parsed(client, model_id, prompt, model_type=model_type, temperature=0.1)
+    except Exception:
+        LOGGER.error("double_check_result retry failed!")
+        return model_result
     
 def extract_sections_by_first_heading(md_text):
     lines = md_text.splitlines()